@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from gsheets_cms import utc_now_iso
+from state_store import StateStore
+
+
+# Telegram delivers an album as separate updates within about a second;
+# the group is processed once no new photo arrived for this long.
+ALBUM_WINDOW_SECONDS = float(os.environ.get("ALBUM_WINDOW_SECONDS", "3") or "3")
+ALBUM_MAX_WAIT_SECONDS = 30
+ALBUM_UPLOAD_WORKERS = int(os.environ.get("ALBUM_UPLOAD_WORKERS", "6") or "6")
+
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+# Shared by the webhook job and the polling bot so both write the same captions.
+ALBUM_BRIEF = (
+    "اكتب كابشنز فيسبوك باللهجة المصرية الشيك (عامية مهذبة) لصانع محتوى رياضي محترف. "
+    "كل كابشن 3-5 سطور، معلومات مفيدة قابلة للتطبيق، نصيحة تدريب أو صحة، "
+    "تحفيز للّاعبين وأولياء الأمور، و CTA لطيف للحجز. "
+    "اذكر واحدة من رياضات الأكاديمية (كاراتيه/كونغ فو/كيك بوكس/جمباز/ملاكمة/تايكوندو). "
+    "إيموجيز بسيطة بدون مبالغة. لا تذكر أنك لم ترَ الصور."
+)
+
+AlbumItem = Dict[str, Any]
+
+
+def _album_key(media_group_id: str) -> str:
+    return f"tg_album:{media_group_id}"
+
+
+def _item_key(item: AlbumItem) -> Any:
+    return item.get("update_id") or item.get("file_id")
+
+
+def collect_album_item(state: StateStore, media_group_id: str, item: AlbumItem, *, ttl: float = 600) -> bool:
+    """Add one album update to the shared group; True for the update that opened the group.
+
+    The group lives in the state store, so updates of one album may land on
+    different workers. Re-delivered updates are ignored.
+    """
+
+    def add(album: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        items = list((album or {}).get("items") or [])
+        if all(_item_key(i) != _item_key(item) for i in items):
+            items.append(item)
+        now = time.time()
+        return {"items": items, "first": (album or {}).get("first") or now, "last": now}
+
+    album = state.update(_album_key(media_group_id), add, ttl=ttl)
+    return len(album["items"]) == 1 and _item_key(album["items"][0]) == _item_key(item)
+
+
+def album_quiet_in(
+    state: StateStore,
+    media_group_id: str,
+    *,
+    window: float = ALBUM_WINDOW_SECONDS,
+    max_wait: float = ALBUM_MAX_WAIT_SECONDS,
+) -> float:
+    """Seconds until the group has been quiet for ``window`` (0 when it can be taken).
+
+    Never later than ``max_wait`` after its first photo. Callers re-check
+    after that delay instead of sleeping on a worker thread.
+    """
+    album = state.get(_album_key(media_group_id)) or {}
+    now = time.time()
+    quiet_at = float(album.get("last") or 0) + window
+    deadline = float(album.get("first") or now) + max_wait
+    return max(min(quiet_at, deadline) - now, 0.0)
+
+
+def take_album(state: StateStore, media_group_id: str) -> List[AlbumItem]:
+    """Remove the group and return its items in the order they were sent (message_id).
+
+    Photos arriving after the group was taken open a new group.
+    """
+    album = state.pop(_album_key(media_group_id)) or {}
+    return sorted(album.get("items") or [], key=lambda i: int(i.get("message_id") or 0))
+
+
+def upload_all(
+    sources: List[Any],
+    upload: Callable[[Any], str],
+    *,
+    workers: int = ALBUM_UPLOAD_WORKERS,
+) -> Tuple[List[str], List[str]]:
+    """Run ``upload`` (e.g. download + ImgBB) over ``sources`` in parallel.
+
+    Returns (urls in input order, error messages); failed photos are dropped.
+    """
+    if not sources:
+        return [], []
+
+    def one(source: Any) -> Tuple[Optional[str], Optional[str]]:
+        try:
+            return upload(source), None
+        except Exception as e:
+            return None, str(e)
+
+    with ThreadPoolExecutor(max_workers=max(min(workers, len(sources)), 1)) as pool:
+        results = list(pool.map(one, sources))
+    return [u for u, _ in results if u], [e for _, e in results if e]
+
+
+def clean_caption(text: str) -> str:
+    """Drop lines where the model leaked its prompt or image description."""
+    lines = [ln.strip() for ln in str(text or "").splitlines() if ln.strip()]
+    banned = ("prompt", "english", "description", "وصف الصورة", "image prompt")
+    filtered = [ln for ln in lines if all(b not in ln.lower() for b in banned)]
+    return "\n".join(filtered).strip() or str(text or "").strip()
+
+
+def caption_album(groq, image_urls: List[str], brief: str, fallback: str, *, note: str = "") -> List[str]:
+    """One chat completion returning a caption per photo of the album as JSON.
+
+    Missing captions (no client, bad JSON, short answer) are filled with ``fallback``.
+    """
+    count = len(image_urls)
+    captions: List[str] = []
+    if groq and count > 0:
+        links = "\n".join(f"{i}. {url}" for i, url in enumerate(image_urls, start=1))
+        prompt = (
+            f"{brief}\n\n"
+            f"These {count} photos were sent together as one album (links for context only):\n{links}\n"
+            + (f"Admin note: {note}\n" if note else "")
+            + f"Write {count} different captions, one per photo, in the same order, as JSON: "
+            '{"captions": ["<Arabic Facebook caption>", ...]}. JSON only.'
+        )
+        try:
+            res = groq.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=min(300 * count + 200, 6000),
+                temperature=0.85,
+                response_format={"type": "json_object"},
+            )
+            data = json.loads(res.choices[0].message.content or "{}")
+            # Empty entries keep their position so captions stay aligned with photos.
+            captions = [clean_caption(str(c or "")) or fallback for c in data.get("captions") or []]
+        except Exception as e:
+            print("album caption generation failed:", str(e))
+
+    captions = captions[:count]
+    while len(captions) < count:
+        captions.append(fallback)
+    return captions
+
+
+def album_rows(
+    image_urls: List[str],
+    captions: List[str],
+    slots: List[datetime],
+    *,
+    source: str = "User_Upload",
+) -> List[Dict[str, Any]]:
+    """Scheduled rows for an album, one post per photo at ``slots`` (from SlotAllocator.allocate)."""
+    timestamp = utc_now_iso()
+    return [
+        {
+            "Timestamp": timestamp,
+            "Image_URL": url,
+            "AI_Caption": caption,
+            "Status": "Scheduled",
+            "Scheduled_Time": slot.isoformat(),
+            "Source": source,
+        }
+        for url, caption, slot in zip(image_urls, captions, slots)
+    ]
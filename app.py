@@ -7,10 +7,12 @@ Smart Academy Manager - Streamlit Application
 import streamlit as st
 import json
 import random
+import re
 import requests
 import base64
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from datetime import datetime
 from io import BytesIO
@@ -309,67 +311,96 @@ def generate_ai_response(client, model, system_prompt, user_message, academy_dat
 
 
 # --- Image Functions ---
-def fetch_rss_images(sport, data):
-    """Fetch images from RSS feeds for a specific sport."""
-    if not FEEDPARSER_AVAILABLE:
+RSS_IMAGES_CACHE_TTL = 900  # ثواني: صور كل رياضة تتخزن ربع ساعة
+RSS_FETCH_TIMEOUT = 6  # مهلة كل مصدر
+RSS_FETCH_BUDGET = 8  # أقصى انتظار لكل المصادر مع بعض
+
+_IMG_SRC_RE = re.compile(r"""<img\b[^>]*?\bsrc\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+
+
+def _fetch_source_images(name, url):
+    """Parse one RSS source and return its image candidates."""
+    resp = requests.get(url, timeout=RSS_FETCH_TIMEOUT)
+    resp.raise_for_status()
+    feed = feedparser.parse(resp.content)
+
+    images = []
+    for entry in feed.entries[:3]:
+        title = entry.get("title", "")
+        # Try to find images in entry
+        for media in entry.get("media_content") or []:
+            if "image" in str(media.get("type") or ""):
+                images.append({"url": media.get("url"), "title": title, "source": name})
+        # Check for enclosures (common in RSS)
+        for enc in entry.get("enclosures") or []:
+            if "image" in str(enc.get("type") or ""):
+                images.append({"url": enc.get("href"), "title": title, "source": name})
+        # Check for images in content
+        for content in entry.get("content") or []:
+            value = content.get("value") if hasattr(content, "get") else ""
+            if not isinstance(value, str):
+                value = str(value or "")
+            for img_url in _IMG_SRC_RE.findall(value):
+                if img_url.startswith("http"):
+                    images.append({"url": img_url, "title": title, "source": name})
+    return images
+
+
+class _PartialSportImages(Exception):
+    """Some source failed or ran out of time; carries what did arrive."""
+
+    def __init__(self, images):
+        super().__init__("partial RSS image fetch")
+        self.images = images
+
+
+@st.cache_data(ttl=RSS_IMAGES_CACHE_TTL, show_spinner=False)
+def _cached_sport_images(sport, sources):
+    """Fetch all sources of a sport in parallel (cached per sport + sources).
+
+    Only complete results are cached: if any source fails or misses the
+    budget, _PartialSportImages is raised (st.cache_data keeps nothing) so
+    the next rerun fetches again.
+    """
+    if not sources:
         return []
 
-    content_sources = data.get("content_sources", {})
-    sport_sources = content_sources.get(sport, [])
+    pool = ThreadPoolExecutor(max_workers=min(8, len(sources)))
+    futures = [pool.submit(_fetch_source_images, name, url) for name, url in sources]
+    # مصدر بطيء ما يوقفش الصفحة: ناخد اللي خلص في حدود الوقت
+    wait(futures, timeout=RSS_FETCH_BUDGET)
+    pool.shutdown(wait=False, cancel_futures=True)
 
     images = []
-    for source in sport_sources[:2]:  # Limit to 2 sources to avoid delays
-        try:
-            feed = feedparser.parse(source.get("url", ""))
-            for entry in feed.entries[:3]:
-                # Try to find images in entry
-                if hasattr(entry, "media_content"):
-                    for media in entry.media_content:
-                        if "image" in str(media.get("type") or ""):
-                            images.append(
-                                {
-                                    "url": media.get("url"),
-                                    "title": entry.get("title", ""),
-                                    "source": source.get("name", ""),
-                                }
-                            )
-                # Check for enclosures (common in RSS)
-                if hasattr(entry, "enclosures"):
-                    for enc in entry.enclosures:
-                        if "image" in str(enc.get("type") or ""):
-                            images.append(
-                                {
-                                    "url": enc.get("href"),
-                                    "title": entry.get("title", ""),
-                                    "source": source.get("name", ""),
-                                }
-                            )
-                # Check for images in content
-                if hasattr(entry, "content"):
-                    for content in entry.content:
-                        value = content.get("value") if hasattr(content, "get") else ""
-                        if not isinstance(value, str):
-                            value = str(value or "")
-
-                        if "<img" in value:
-                            import re
-
-                            img_urls = re.findall(r'src="([^"]+)"', value)
-                            for img_url in img_urls:
-                                if img_url.startswith("http"):
-                                    images.append(
-                                        {
-                                            "url": img_url,
-                                            "title": entry.get("title", ""),
-                                            "source": source.get("name", ""),
-                                        }
-                                    )
-        except Exception as e:
+    complete = True
+    for future in futures:
+        if not future.done() or future.cancelled() or future.exception():
+            complete = False
             continue
-
+        images.extend(future.result())
+    if not complete:
+        raise _PartialSportImages(images[:5])
     return images[:5]  # Return max 5 images
 
 
+def fetch_rss_images(sport, data):
+    """Fetch images from RSS feeds for a specific sport."""
+    if not FEEDPARSER_AVAILABLE:
+        return []
+
+    content_sources = data.get("content_sources", {})
+    sport_sources = tuple(
+        (str(source.get("name", "")), str(source.get("url", "")))
+        for source in content_sources.get(sport, [])
+        if source.get("url")
+    )
+    try:
+        return _cached_sport_images(sport, sport_sources)
+    except _PartialSportImages as partial:
+        # نعرض اللي وصل، من غير ما نخزنه ربع ساعة
+        return partial.images
+
+
 def generate_nvidia_image(prompt, api_key):
     """Generate image using NVIDIA FLUX API."""
     if not api_key:
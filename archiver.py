@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from gsheets_cms import (
+    ID_COLUMN,
+    SheetConfig,
+    append_rows,
+    compile_schema,
+    delete_rows,
+    ensure_header_row,
+    list_records,
+    list_records_projected,
+    open_worksheet,
+    parse_time_utc,
+    utc_now_iso,
+)
+from publish_lock import PublishLock
+from publisher import ARCHIVE_LEASE
+
+if TYPE_CHECKING:
+    import gspread
+
+
+ARCHIVE_WORKSHEET = os.environ.get("ARCHIVE_WORKSHEET", "Archive").strip() or "Archive"
+# Posted/Failed rows older than this leave the live Buffer sheet.
+ARCHIVE_RETENTION_DAYS = int(os.environ.get("ARCHIVE_RETENTION_DAYS", "14") or "14")
+ARCHIVE_MAX_ROWS_PER_RUN = int(os.environ.get("ARCHIVE_MAX_ROWS_PER_RUN", "500") or "500")
+
+_DONE_STATUSES = {"posted", "failed"}
+# A row is deleted only while these still match what was copied to the Archive.
+_MATCH_FIELDS = (ID_COLUMN, "Status", "Scheduled_Time")
+
+
+def _row_age_time(row) -> Optional[datetime]:
+    return parse_time_utc(row.get("Scheduled_Time")) or parse_time_utc(row.get("Timestamp"))
+
+
+def archivable_rows(rows, now_utc: datetime, retention_days: int = ARCHIVE_RETENTION_DAYS) -> List[Any]:
+    cutoff = now_utc - timedelta(days=max(retention_days, 0))
+    out = []
+    for r in rows:
+        if str(r.get("Status", "")).strip().lower() not in _DONE_STATUSES:
+            continue
+        dt = _row_age_time(r)
+        if dt and dt < cutoff:
+            out.append(r)
+    return out
+
+
+def open_archive(ws: gspread.Worksheet, header: List[str]) -> Tuple[gspread.Worksheet, List[str]]:
+    archive = open_worksheet(ws.client, SheetConfig(sheet_id=ws.spreadsheet_id, worksheet=ARCHIVE_WORKSHEET))
+    return archive, ensure_header_row(archive, list(header) + ["Archived_At"])
+
+
+def archive_once(
+    ws: gspread.Worksheet,
+    header: List[str],
+    *,
+    lock: PublishLock,
+    owner: str,
+    now_utc: Optional[datetime] = None,
+    retention_days: int = ARCHIVE_RETENTION_DAYS,
+    max_rows: int = ARCHIVE_MAX_ROWS_PER_RUN,
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """Move old Posted/Failed rows from the Buffer sheet to the Archive worksheet.
+
+    Runs only while holding the archive lease and with no publish claim in
+    flight, since deleting rows shifts the row numbers those claims use.
+    Rows are copied with one append and removed with one batchUpdate;
+    rows already in the Archive (by ID) are not copied twice.
+    """
+    now_utc = now_utc or datetime.now(timezone.utc).replace(microsecond=0)
+    with lock.lease(ARCHIVE_LEASE, owner) as acquired:
+        if not acquired:
+            return {"action": "busy"}
+        if lock.active_claims():
+            return {"action": "busy", "reason": "publish in progress"}
+
+        rows = archivable_rows(list_records(ws), now_utc, retention_days)[: max(max_rows, 0)]
+        if not rows:
+            return {"action": "noop", "archived": 0}
+        if dry_run:
+            return {"action": "dry_run", "archived": len(rows)}
+
+        # The sheet can be edited by hand (or via /cms/delete) between the read
+        # and the delete; re-check the cheap columns and stop if anything moved.
+        current = {r.get("_row_number"): r for r in list_records_projected(ws, header)}
+        for r in rows:
+            now_row = current.get(r.get("_row_number"))
+            if now_row is None or any(now_row.get(k) != r.get(k) for k in _MATCH_FIELDS):
+                return {"action": "busy", "reason": "sheet changed during archive"}
+
+        # A run that died between copy and delete already archived some rows;
+        # copy only IDs the Archive does not have yet, then delete them all.
+        archive, archive_header = open_archive(ws, compile_schema(header).header)
+        archived_ids = {
+            str(r.get(ID_COLUMN) or "").strip()
+            for r in list_records_projected(archive, archive_header, [ID_COLUMN])
+        }
+        archived_at = utc_now_iso()
+        append_rows(
+            archive,
+            archive_header,
+            [
+                {**r.to_dict(), "Archived_At": archived_at}
+                for r in rows
+                if not str(r.get(ID_COLUMN) or "").strip()
+                or str(r.get(ID_COLUMN)).strip() not in archived_ids
+            ],
+        )
+        numbers = delete_rows(ws, header, rows, match=_MATCH_FIELDS)
+        result: Dict[str, Any] = {"action": "archived", "archived": len(numbers), "rows": numbers}
+        if len(numbers) < len(rows):
+            result["skipped"] = len(rows) - len(numbers)
+        return result
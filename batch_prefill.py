@@ -0,0 +1,118 @@
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from gsheets_cms import append_rows, utc_now_iso
+from slot_allocator import SlotAllocator
+
+
+# When the queue runs dry, fill every free active-hour slot up to this far ahead.
+PREFILL_HORIZON_HOURS = int(os.environ.get("PREFILL_HORIZON_HOURS", "24") or "24")
+# Upper bound on rows created by one prefill (and captions asked from one LLM call).
+PREFILL_BATCH_MAX = int(os.environ.get("PREFILL_BATCH_MAX", "8") or "8")
+
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+# One brief for every prefill (webhook tick and main.py), so the queue reads the same whoever filled it.
+PREFILL_BRIEF = (
+    "You write Facebook posts for a sports academy in Egypt, as a professional sports content creator. "
+    "Each caption: polite Egyptian Arabic (colloquial), 3-5 lines, a useful and actionable training or health tip, "
+    "motivation for players and parents, and a gentle booking CTA. Mention one of the academy sports "
+    "(karate, kung fu, kickboxing, gymnastics, boxing, taekwondo). Simple emojis, not overdone. "
+    "Never mention the image prompt in the caption. "
+    "Each image prompt: anime/cartoon style scene that visually matches its caption, vibrant colors, "
+    "clean lines, soft shading, no text, no watermark, safe-for-work."
+)
+PREFILL_FALLBACK = {
+    "caption": "🥋 تدريب النهارده نار! جاهزين تبدأوا؟ احجز مكانك دلوقتي 💪📞",
+    "image_prompt": (
+        "Anime-style illustration of kids martial arts training in Cairo gym, "
+        "vibrant colors, clean lines, soft shading, no text, no watermark"
+    ),
+}
+
+Item = Dict[str, str]
+
+
+def plan_slots(
+    allocator: SlotAllocator,
+    now_utc: datetime,
+    *,
+    horizon_hours: int = PREFILL_HORIZON_HOURS,
+    max_items: int = PREFILL_BATCH_MAX,
+) -> List[datetime]:
+    """Free slots between now and the horizon (at most ``max_items``)."""
+    return allocator.allocate(now_utc, max_items, until=now_utc + timedelta(hours=max(horizon_hours, 1)))
+
+
+def generate_batch(groq, count: int, brief: str, fallback: Item) -> List[Item]:
+    """One chat completion returning ``count`` {"caption", "image_prompt"} items as JSON.
+
+    Missing items (no client, bad JSON, short answer) are filled with ``fallback``.
+    """
+    items: List[Item] = []
+    if groq and count > 0:
+        prompt = (
+            f"{brief}\n\n"
+            f"Return {count} different posts as JSON: "
+            '{"posts": [{"caption": "<Arabic Facebook caption>", '
+            '"image_prompt": "<English image prompt, 12-20 words>"}]}. '
+            "Vary the sport, angle and tip between posts. JSON only."
+        )
+        try:
+            res = groq.chat.completions.create(
+                model=GROQ_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=min(350 * count + 200, 6000),
+                temperature=0.9,
+                response_format={"type": "json_object"},
+            )
+            data = json.loads(res.choices[0].message.content or "{}")
+            for post in data.get("posts") or []:
+                caption = str(post.get("caption") or "").strip()
+                image_prompt = str(post.get("image_prompt") or "").strip().strip('"')
+                if caption and image_prompt:
+                    items.append({"caption": caption, "image_prompt": image_prompt})
+        except Exception as e:
+            print("batch prefill generation failed:", str(e))
+
+    items = items[:count]
+    while len(items) < count:
+        items.append(dict(fallback))
+    return items
+
+
+def run_batch_prefill(
+    ws,
+    header: List[str],
+    allocator: SlotAllocator,
+    now_utc: datetime,
+    generate: Callable[[int], List[Item]],
+    image_url: Callable[[str], str],
+    *,
+    clean_caption: Optional[Callable[[str], str]] = None,
+    horizon_hours: int = PREFILL_HORIZON_HOURS,
+    max_items: int = PREFILL_BATCH_MAX,
+) -> List[Dict[str, Any]]:
+    """Plan free slots, generate all posts in one call and append them in one write."""
+    slots = plan_slots(allocator, now_utc, horizon_hours=horizon_hours, max_items=max_items)
+    if not slots:
+        return []
+
+    items = generate(len(slots))
+    timestamp = utc_now_iso()
+    new_rows = [
+        {
+            "Timestamp": timestamp,
+            "Image_URL": image_url(item["image_prompt"]),
+            "AI_Caption": clean_caption(item["caption"]) if clean_caption else item["caption"],
+            "Status": "Scheduled",
+            "Scheduled_Time": slot.isoformat(),
+            "Source": "AI_Generated",
+        }
+        for slot, item in zip(slots, items)
+    ]
+    for row, number in zip(new_rows, append_rows(ws, header, new_rows)):
+        row["_row_number"] = number
+    return new_rows
@@ -4,7 +4,9 @@ import requests
 from typing import Optional, Tuple
 
 from gsheets_connection import GoogleSheetsConnection
-from gsheets_cms import delete_row, update_fields
+from gsheets_cms import ID_COLUMN, delete_row, resolve_row, update_fields
+from publish_lock import PublishLock
+from publisher import publish_now
 
 
 st.set_page_config(page_title="CMS Buffer", layout="wide")
@@ -20,6 +22,12 @@ def _get_setting(key: str, default: str = "") -> str:
 PAGE_ACCESS_TOKEN = _get_setting("PAGE_ACCESS_TOKEN", "")
 
 
+@st.cache_resource
+def _publish_lock() -> PublishLock:
+    # Same saas.db claims as the webhook/scheduler when they share a disk.
+    return PublishLock()
+
+
 def _post_to_facebook(caption: str, image_url: Optional[str]) -> Tuple[bool, str]:
     if not PAGE_ACCESS_TOKEN:
         return False, "Missing PAGE_ACCESS_TOKEN in Streamlit secrets"
@@ -69,7 +77,7 @@ def _post_to_facebook(caption: str, image_url: Optional[str]) -> Tuple[bool, str
 st.title("🗂️ Buffer CMS (Google Sheets)")
 st.caption("مراجعة + تعديل + اعتماد المنشورات قبل النشر")
 st.info(
-    "أوامر تيليجرام للأدمن: /queue, /post <row>, /delete <row>, /caption <row> <text>, /status",
+    "أوامر تيليجرام للأدمن: /queue, /post <id>, /delete <id>, /caption <id> <text>, /status",
     icon="💬",
 )
 
@@ -92,15 +100,24 @@ if not pending_rows:
     st.success("✅ لا يوجد منشورات معلّقة")
     st.stop()
 
+def _current_row(row_id: str, fallback: int) -> int:
+    # The snapshot may be stale (rows deleted elsewhere shift numbers); look the ID up again.
+    if not row_id:
+        return fallback
+    return resolve_row(ws, header, row_id) or 0
+
+
 for row in pending_rows:
+    row_id = str(row.get(ID_COLUMN) or "").strip()
     row_number = int(row.get("_row_number") or 0)
+    widget_key = row_id or f"{row_number}_{row.get('Scheduled_Time')}"
     img_url = str(row.get("Image_URL") or "").strip()
     sched = str(row.get("Scheduled_Time") or "").strip()
     source = str(row.get("Source") or "").strip()
     caption = str(row.get("AI_Caption") or "").strip()
 
     with st.container(border=True):
-        st.markdown(f"**Time:** {sched} • **Source:** {source} • **Row:** {row_number or 'N/A'}")
+        st.markdown(f"**Time:** {sched} • **Source:** {source} • **ID:** {row_id or row_number or 'N/A'}")
         if img_url:
             st.image(img_url, use_container_width=True)
 
@@ -108,38 +125,50 @@ for row in pending_rows:
             "Caption",
             value=caption,
             height=120,
-            key=f"cap_{row_number}_{sched}",
+            key=f"cap_{widget_key}",
         )
 
         c1, c2, c3 = st.columns(3)
         with c1:
-            if st.button("💾 Save Updates", key=f"save_{row_number}_{sched}"):
+            if st.button("💾 Save Updates", key=f"save_{widget_key}"):
+                row_number = _current_row(row_id, row_number)
                 if not row_number:
                     st.error("لم أستطع تحديد رقم الصف في الشيت.")
                 else:
                     update_fields(ws, row_number, header, {"AI_Caption": new_caption})
+                    conn.invalidate()
                     st.success("✅ تم الحفظ")
                     st.rerun()
 
         with c2:
-            if st.button("🚀 Post Now", key=f"post_{row_number}_{sched}"):
+            if st.button("🚀 Post Now", key=f"post_{widget_key}"):
+                row_number = _current_row(row_id, row_number)
                 if not row_number:
                     st.error("لم أستطع تحديد رقم الصف في الشيت.")
                 else:
-                    ok, err = _post_to_facebook(new_caption, img_url or None)
-                    if ok:
-                        update_fields(ws, row_number, header, {"Status": "Posted", "AI_Caption": new_caption})
+                    if new_caption != caption:
+                        update_fields(ws, row_number, header, {"AI_Caption": new_caption})
+                    # Same claim/Publishing path as the scheduler, so a due row is never posted twice.
+                    result = publish_now(
+                        ws, header, row_number, _post_to_facebook, lock=_publish_lock(), row_id=row_id or None
+                    )
+                    conn.invalidate()
+                    if result is None:
+                        st.warning("الصف بيتنشر أو بيتأرشف دلوقتي، جرّب بعد شوية.")
+                    elif result["action"] == "posted":
                         st.success("✅ تم النشر")
                         st.rerun()
                     else:
-                        update_fields(ws, row_number, header, {"Status": "Failed"})
-                        st.error(f"❌ فشل النشر: {err}")
+                        st.error(f"❌ فشل النشر: {result.get('error')}")
 
         with c3:
-            if st.button("🗑️ Delete", key=f"del_{row_number}_{sched}"):
+            if st.button("🗑️ Delete", key=f"del_{widget_key}"):
+                row_number = _current_row(row_id, row_number)
                 if not row_number:
                     st.error("لم أستطع تحديد رقم الصف في الشيت.")
-                else:
-                    delete_row(ws, row_number)
+                elif delete_row(ws, header, row_number, row_id or None):
+                    conn.invalidate()
                     st.success("✅ تم الحذف")
                     st.rerun()
+                else:
+                    st.error("الصف اتغير قبل الحذف، اعمل تحديث وجرّب تاني.")
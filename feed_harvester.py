@@ -0,0 +1,367 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Union
+
+import requests
+
+from publish_lock import PublishLock
+from sqlite_db import SQLiteDB
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FEED_DB_PATH = os.environ.get("FEED_DB_PATH", "").strip() or os.path.join(BASE_DIR, "feeds.db")
+
+HARVEST_INTERVAL_SECONDS = int(os.environ.get("FEED_HARVEST_INTERVAL_SECONDS", "1800") or "1800")
+HARVEST_WORKERS = int(os.environ.get("FEED_HARVEST_WORKERS", "8") or "8")
+HARVEST_TIMEOUT_SECONDS = float(os.environ.get("FEED_HARVEST_TIMEOUT_SECONDS", "10") or "10")
+
+# Every worker runs the loop; the lease lets one of them harvest at a time.
+HARVEST_LEASE = "feed-harvest"
+HARVEST_LEASE_SECONDS = 600
+
+# Entries kept per feed; pick_entry only ever looks at the newest few.
+ENTRIES_PER_FEED = 30
+PICK_FROM_LATEST = 5
+
+# Health is an exponentially weighted success rate in [0, 1].
+HEALTH_ALPHA = 0.3
+MIN_FEED_HEALTH = 0.2
+
+USER_AGENT = "AcademyManager-FeedHarvester/1.0 (+https://github.com/m0shaban/academy-manager)"
+
+
+def _utc_now_iso() -> str:
+    return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+
+def _entry_published(entry: Any) -> str:
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    if parsed:
+        try:
+            return datetime(*parsed[:6], tzinfo=timezone.utc).isoformat()
+        except Exception:
+            pass
+    return _utc_now_iso()
+
+
+def _entry_image(entry: Any) -> str:
+    for media in entry.get("media_content") or []:
+        if "image" in str(media.get("type") or "image") and media.get("url"):
+            return str(media["url"])
+    for thumb in entry.get("media_thumbnail") or []:
+        if thumb.get("url"):
+            return str(thumb["url"])
+    for enc in entry.get("enclosures") or []:
+        if "image" in str(enc.get("type") or "") and enc.get("href"):
+            return str(enc["href"])
+    return ""
+
+
+class FeedHarvester:
+    """Polls RSS feeds in the background and keeps their entries in SQLite.
+
+    Feeds are fetched concurrently with conditional GETs (ETag /
+    Last-Modified), so unchanged feeds cost a single 304. Picking an idea
+    is a local indexed query and never touches the network. With ``lock``,
+    worker processes take turns through a lease and skip a harvest another
+    worker finished less than an interval ago.
+    """
+
+    def __init__(
+        self,
+        db: Union[str, SQLiteDB],
+        feeds_provider: Callable[[], List[str]],
+        *,
+        lock: Optional[PublishLock] = None,
+        image_extractor: Optional[Callable[[str], Optional[str]]] = None,
+        max_workers: int = HARVEST_WORKERS,
+        timeout: float = HARVEST_TIMEOUT_SECONDS,
+    ) -> None:
+        self.db = db if isinstance(db, SQLiteDB) else SQLiteDB(db)
+        self.lock = lock
+        self.feeds_provider = feeds_provider
+        self.image_extractor = image_extractor
+        self.max_workers = max(1, max_workers)
+        self.timeout = timeout
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.init_db()
+
+    def init_db(self) -> None:
+        cur = self.db.conn().cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS feeds (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                health REAL DEFAULT 1.0,
+                fail_count INTEGER DEFAULT 0,
+                last_status TEXT,
+                last_checked_at TEXT,
+                last_ok_at TEXT
+            )
+            """
+        )
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                feed_url TEXT NOT NULL,
+                link TEXT NOT NULL UNIQUE,
+                title TEXT,
+                summary TEXT,
+                image_url TEXT,
+                published_at TEXT,
+                fetched_at TEXT
+            )
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_entries_feed_published ON entries (feed_url, published_at DESC)"
+        )
+
+    # ---------- Polling ----------
+    def _poll_feed(
+        self, url: str, etag: str, last_modified: str, known_images: Set[str]
+    ) -> Dict[str, Any]:
+        import feedparser
+
+        headers = {"User-Agent": USER_AGENT}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        try:
+            resp = requests.get(url, headers=headers, timeout=self.timeout)
+        except Exception as e:
+            return {"url": url, "ok": False, "status": f"error: {type(e).__name__}"}
+
+        if resp.status_code == 304:
+            return {"url": url, "ok": True, "status": "304", "entries": None}
+        if resp.status_code != 200:
+            return {"url": url, "ok": False, "status": str(resp.status_code)}
+
+        parsed = feedparser.parse(resp.content)
+        if not parsed.entries:
+            return {"url": url, "ok": False, "status": "empty"}
+
+        entries = []
+        for entry in parsed.entries[:ENTRIES_PER_FEED]:
+            link = str(entry.get("link") or "").strip()
+            title = str(entry.get("title") or "").strip()
+            if not link or not title:
+                continue
+            image_url = _entry_image(entry)
+            if (
+                not image_url
+                and self.image_extractor
+                and link not in known_images
+                and len(entries) < PICK_FROM_LATEST
+            ):
+                image_url = self.image_extractor(link) or ""
+            entries.append(
+                {
+                    "link": link,
+                    "title": title,
+                    "summary": str(entry.get("summary") or ""),
+                    "image_url": image_url,
+                    "published_at": _entry_published(entry),
+                }
+            )
+
+        return {
+            "url": url,
+            "ok": True,
+            "status": "200",
+            "etag": resp.headers.get("ETag", ""),
+            "last_modified": resp.headers.get("Last-Modified", ""),
+            "entries": entries,
+        }
+
+    def _store_result(self, conn: sqlite3.Connection, result: Dict[str, Any]) -> None:
+        cur = conn.cursor()
+        now = _utc_now_iso()
+        url = result["url"]
+        ok = bool(result.get("ok"))
+
+        cur.execute("INSERT OR IGNORE INTO feeds (url) VALUES (?)", (url,))
+        cur.execute(
+            """
+            UPDATE feeds SET
+                health = COALESCE(health, 1.0) * (1 - ?) + ? * ?,
+                fail_count = CASE WHEN ? THEN 0 ELSE COALESCE(fail_count, 0) + 1 END,
+                last_status = ?,
+                last_checked_at = ?,
+                last_ok_at = CASE WHEN ? THEN ? ELSE last_ok_at END
+            WHERE url = ?
+            """,
+            (HEALTH_ALPHA, HEALTH_ALPHA, 1.0 if ok else 0.0, ok, result.get("status"), now, ok, now, url),
+        )
+
+        entries = result.get("entries")
+        if not entries:
+            return
+
+        cur.execute(
+            "UPDATE feeds SET etag = ?, last_modified = ? WHERE url = ?",
+            (result.get("etag") or "", result.get("last_modified") or "", url),
+        )
+        cur.executemany(
+            """
+            INSERT INTO entries (feed_url, link, title, summary, image_url, published_at, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(link) DO UPDATE SET
+                title = excluded.title,
+                summary = excluded.summary,
+                image_url = COALESCE(NULLIF(excluded.image_url, ''), entries.image_url)
+            """,
+            [
+                (url, e["link"], e["title"], e["summary"], e["image_url"], e["published_at"], now)
+                for e in entries
+            ],
+        )
+        cur.execute(
+            """
+            DELETE FROM entries WHERE feed_url = ? AND id NOT IN (
+                SELECT id FROM entries WHERE feed_url = ? ORDER BY published_at DESC LIMIT ?
+            )
+            """,
+            (url, url, ENTRIES_PER_FEED),
+        )
+
+    def _checked_since(self, seconds: float) -> bool:
+        """True if any feed was polled within the last ``seconds``."""
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=seconds)).replace(microsecond=0).isoformat()
+        row = self.db.query_one("SELECT 1 FROM feeds WHERE last_checked_at > ? LIMIT 1", (cutoff,))
+        return row is not None
+
+    def harvest_once(self, min_age: float = 0) -> Dict[str, int]:
+        """Poll all feeds once; skipped while another worker holds the lease or
+        a harvest finished less than ``min_age`` seconds ago."""
+        if self.lock is None:
+            return self._harvest()
+        with self.lock.lease(HARVEST_LEASE, ttl=HARVEST_LEASE_SECONDS) as acquired:
+            if not acquired or (min_age > 0 and self._checked_since(min_age)):
+                return {"feeds": 0, "ok": 0, "not_modified": 0, "failed": 0, "skipped": 1}
+            return self._harvest()
+
+    def _harvest(self) -> Dict[str, int]:
+        feeds = [str(u).strip() for u in (self.feeds_provider() or []) if str(u).strip()]
+        if not feeds:
+            return {"feeds": 0, "ok": 0, "not_modified": 0, "failed": 0}
+
+        conn = self.db.conn()
+        placeholders = ",".join("?" for _ in feeds)
+        cached = {
+            row[0]: (row[1] or "", row[2] or "")
+            for row in conn.execute(
+                f"SELECT url, etag, last_modified FROM feeds WHERE url IN ({placeholders})",
+                feeds,
+            )
+        }
+        known_images = {
+            row[0]
+            for row in conn.execute(
+                f"SELECT link FROM entries WHERE feed_url IN ({placeholders}) AND image_url != ''",
+                feeds,
+            )
+        }
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(feeds))) as pool:
+            results = list(
+                pool.map(
+                    lambda u: self._poll_feed(u, *cached.get(u, ("", "")), known_images),
+                    feeds,
+                )
+            )
+
+        # Network is concurrent; writes stay on this thread in one transaction.
+        with self.db.transaction() as conn:
+            for result in results:
+                self._store_result(conn, result)
+
+        return {
+            "feeds": len(results),
+            "ok": sum(1 for r in results if r.get("ok") and r.get("status") == "200"),
+            "not_modified": sum(1 for r in results if r.get("status") == "304"),
+            "failed": sum(1 for r in results if not r.get("ok")),
+        }
+
+    # ---------- Background loop ----------
+    def _run(self, interval: int) -> None:
+        while True:
+            try:
+                stats = self.harvest_once(min_age=interval / 2)
+                print(f"📰 Feed harvest: {stats}")
+            except Exception as e:
+                print(f"❌ Feed harvest error: {e}")
+            time.sleep(max(interval, 60))
+
+    def start(self, interval: int = HARVEST_INTERVAL_SECONDS) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(interval,), name="feed-harvester", daemon=True
+            )
+            self._thread.start()
+
+    # ---------- Queries (no network) ----------
+    def pick_entry(self, feeds: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        feeds = [str(u).strip() for u in (feeds if feeds is not None else self.feeds_provider()) if str(u).strip()]
+        if not feeds:
+            return None
+
+        conn = self.db.conn()
+        placeholders = ",".join("?" for _ in feeds)
+        healthy = [
+            row[0]
+            for row in conn.execute(
+                f"""
+                SELECT f.url FROM feeds f
+                WHERE f.url IN ({placeholders}) AND f.health >= ?
+                  AND EXISTS (SELECT 1 FROM entries e WHERE e.feed_url = f.url)
+                """,
+                [*feeds, MIN_FEED_HEALTH],
+            )
+        ]
+        if not healthy:
+            return None
+
+        feed_url = random.choice(healthy)
+        rows = conn.execute(
+            """
+            SELECT title, link, summary, image_url FROM entries
+            WHERE feed_url = ? ORDER BY published_at DESC LIMIT ?
+            """,
+            (feed_url, PICK_FROM_LATEST),
+        ).fetchall()
+
+        if not rows:
+            return None
+        title, link, summary, image_url = random.choice(rows)
+        return {
+            "title": title,
+            "link": link,
+            "summary": summary or "",
+            "image_url": image_url or None,
+            "feed_url": feed_url,
+        }
+
+    def feed_health(self) -> List[Dict[str, Any]]:
+        rows = self.db.query_all(
+            """
+            SELECT url, health, fail_count, last_status, last_checked_at, last_ok_at
+            FROM feeds ORDER BY health DESC
+            """
+        )
+        keys = ("url", "health", "fail_count", "last_status", "last_checked_at", "last_ok_at")
+        return [dict(zip(keys, row)) for row in rows]
+
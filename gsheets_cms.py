@@ -1,14 +1,22 @@
+from __future__ import annotations
+
+import bisect
 import json
 import os
 import random
+import re
+import threading
 import time
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
 
-import gspread
 from dateutil import parser as date_parser
-from google.oauth2.service_account import Credentials
+
+if TYPE_CHECKING:
+    # gspread and google-auth are imported on first client creation, not at import time.
+    import gspread
 
 
 REQUIRED_COLUMNS = [
@@ -27,6 +35,17 @@ class SheetConfig:
     worksheet: str = "Buffer"
 
 
+# Stable row identity (ULID). Row numbers shift when rows are deleted; IDs do not.
+ID_COLUMN = "ID"
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# What the scheduler needs to decide what is due or whether to prefill.
+SCHEDULE_FIELDS = ["Status", "Scheduled_Time", ID_COLUMN]
+
+_RANGE_ROWS_RE = re.compile(r"[A-Z]+(\d+)")
+_APPEND_TRIES = 7
+
+
 class SheetRateLimitError(RuntimeError):
     pass
 
@@ -75,6 +94,9 @@ def load_service_account_info_from_env() -> Optional[Dict[str, Any]]:
 
 
 def make_gspread_client(service_account_info: Dict[str, Any]) -> gspread.Client:
+    import gspread
+    from google.oauth2.service_account import Credentials
+
     scopes = [
         "https://www.googleapis.com/auth/spreadsheets",
         "https://www.googleapis.com/auth/drive",
@@ -83,13 +105,16 @@ def make_gspread_client(service_account_info: Dict[str, Any]) -> gspread.Client:
     return gspread.authorize(creds)
 
 
-def _with_backoff(fn, *, tries: int = 7, base_sleep: float = 0.6):
+def _with_backoff(fn, *, tries: int = 7, base_sleep: float = 0.6, retry_if=None):
+    # ``retry_if(exc)`` limits retries for calls that are not safe to repeat.
     last_exc: Optional[BaseException] = None
     for attempt in range(tries):
         try:
             return fn()
         except Exception as exc:
             last_exc = exc
+            if retry_if is not None and not retry_if(exc):
+                break
             sleep = base_sleep * (2**attempt) + random.random() * 0.25
             time.sleep(min(sleep, 10.0))
     if last_exc is None:
@@ -98,6 +123,16 @@ def _with_backoff(fn, *, tries: int = 7, base_sleep: float = 0.6):
     raise SheetRateLimitError(f"{type(last_exc).__name__}: {msg}")
 
 
+def _is_rate_limited(exc: BaseException) -> bool:
+    """True for errors proving the request was rejected before any write (HTTP 429 / quota)."""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None) or getattr(exc, "code", None)
+    if status == 429:
+        return True
+    text = str(exc)
+    return "RESOURCE_EXHAUSTED" in text or "Quota exceeded" in text
+
+
 def open_worksheet(client: gspread.Client, cfg: SheetConfig) -> gspread.Worksheet:
     sh = _with_backoff(lambda: client.open_by_key(cfg.sheet_id))
     try:
@@ -108,56 +143,458 @@ def open_worksheet(client: gspread.Client, cfg: SheetConfig) -> gspread.Workshee
         )
 
 
+def new_row_id() -> str:
+    """ULID: 48-bit millisecond timestamp + 80 random bits, Crockford base32 (sortable by creation)."""
+    value = (int(time.time() * 1000) << 80) | int.from_bytes(os.urandom(10), "big")
+    chars = []
+    for _ in range(26):
+        chars.append(_CROCKFORD[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def _backfill_ids(ws: gspread.Worksheet, header: List[str], data_rows: List[List[str]]) -> None:
+    col = header.index(ID_COLUMN)
+    missing = [
+        n for n, row in enumerate(data_rows, start=2) if not (col < len(row) and str(row[col]).strip())
+    ]
+    if not missing:
+        return
+    # Rows can be deleted or moved between the read and this write; re-read
+    # them and fill only ID cells that are still empty in an unchanged row.
+    letter = _col_letter(col + 1)
+    updates = []
+    for n, now in zip(missing, fetch_rows(ws, header, missing)):
+        before = data_rows[n - 2]
+        same = all(
+            str(now.get(name) or "") == (str(before[i]) if i < len(before) else "")
+            for i, name in enumerate(header)
+            if i != col
+        )
+        if same and not str(now.get(ID_COLUMN) or "").strip():
+            updates.append({"range": f"{letter}{n}", "values": [[new_row_id()]]})
+    if updates:
+        _with_backoff(lambda: ws.batch_update(updates))
+
+
 def ensure_headers(ws: gspread.Worksheet) -> List[str]:
     values = _with_backoff(lambda: ws.get_all_values())
     if not values:
-        _with_backoff(lambda: ws.append_row(REQUIRED_COLUMNS))
-        return REQUIRED_COLUMNS
+        header = REQUIRED_COLUMNS + [ID_COLUMN]
+        _with_backoff(lambda: ws.append_row(header))
+        return header
 
     header = [str(c).strip() for c in (values[0] or []) if str(c).strip()]
 
-    # Ensure required columns exist; preserve extra columns.
+    # Ensure required columns exist; preserve extra columns. ID goes last so
+    # adding it never moves existing columns.
+    merged = header
     missing = [c for c in REQUIRED_COLUMNS if c not in header]
     if missing or header[: len(REQUIRED_COLUMNS)] != REQUIRED_COLUMNS:
         merged = REQUIRED_COLUMNS + [c for c in header if c not in REQUIRED_COLUMNS]
+    if ID_COLUMN not in merged:
+        merged = merged + [ID_COLUMN]
+    if merged != header:
         _with_backoff(lambda: ws.update([merged], "1:1"))
-        return merged
 
-    return header
+    _backfill_ids(ws, merged, values[1:])
+    return merged
 
 
-def list_rows(ws: gspread.Worksheet) -> List[Dict[str, Any]]:
-    values = _with_backoff(lambda: ws.get_all_values())
+class SheetRow:
+    """Read-only row record backed by the raw value list (no per-row dict)."""
+
+    __slots__ = ("_schema", "_values", "_row_number")
+
+    def __init__(self, schema: "SheetSchema", values: List[str], row_number: int) -> None:
+        self._schema = schema
+        self._values = values
+        self._row_number = row_number
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key == "_row_number":
+            return self._row_number
+        i = self._schema.positions.get(key)
+        if i is None:
+            return default
+        return self._values[i] if i < len(self._values) else ""
+
+    def __getitem__(self, key: str) -> Any:
+        if key != "_row_number" and key not in self._schema.positions:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __contains__(self, key: object) -> bool:
+        return key == "_row_number" or key in self._schema.positions
+
+    def keys(self) -> List[str]:
+        return list(self._schema.positions) + ["_row_number"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self.get(key) for key in self.keys()}
+
+
+class SheetSchema:
+    """Header compiled once: column positions by key, payload building, row records.
+
+    ``fields`` projects records down to the listed columns; ``positions``
+    always maps to indexes in the full sheet row.
+    """
+
+    def __init__(self, header: List[str], fields: Optional[List[str]] = None) -> None:
+        self.header = [str(c).strip() for c in header]
+        columns = {key: i for i, key in enumerate(self.header) if key}
+        self.columns = columns
+        if fields is None:
+            self.positions = columns
+        else:
+            self.positions = {key: columns[key] for key in fields if key in columns}
+
+    def col(self, key: str) -> Optional[int]:
+        """1-based sheet column for ``key`` (None if the sheet lacks it)."""
+        i = self.columns.get(key)
+        return None if i is None else i + 1
+
+    def project(self, fields: List[str]) -> "SheetSchema":
+        return SheetSchema(self.header, fields)
+
+    def payload(self, row: Dict[str, Any]) -> List[str]:
+        payload = [""] * len(self.header)
+        for key, value in row.items():
+            i = self.columns.get(key)
+            if i is not None:
+                payload[i] = "" if value is None else str(value)
+        return payload
+
+    def record(self, values: List[str], row_number: int) -> SheetRow:
+        return SheetRow(self, values, row_number)
+
+    def records(self, values: List[List[str]], *, start: int = 2) -> List[SheetRow]:
+        return [SheetRow(self, row, idx) for idx, row in enumerate(values, start=start)]
+
+
+@lru_cache(maxsize=16)
+def _compiled(header: Tuple[str, ...]) -> SheetSchema:
+    return SheetSchema(list(header))
+
+
+def compile_schema(header: Union[List[str], SheetSchema]) -> SheetSchema:
+    if isinstance(header, SheetSchema):
+        return header
+    return _compiled(tuple(header))
+
+
+def _cached(cache: Any, ws: gspread.Worksheet, kind: str, loader):
+    # ``cache`` is a sheet_cache.SheetCache (or None to always read through).
+    return cache.get(ws, kind, loader) if cache is not None else loader()
+
+
+def list_records(
+    ws: gspread.Worksheet, fields: Optional[List[str]] = None, *, cache: Any = None
+) -> List[SheetRow]:
+    """Like list_rows, but returns slot-based records, optionally projected to ``fields``."""
+    values = _cached(cache, ws, "all", lambda: _with_backoff(lambda: ws.get_all_values()))
     if not values:
         return []
+    schema = SheetSchema(values[0] or [], fields)
+    return schema.records(values[1:])
+
+
+def ensure_header_row(ws: gspread.Worksheet, header: List[str]) -> List[str]:
+    """Make sure row 1 holds at least ``header`` (missing keys are appended at the end)."""
+    current = [str(c).strip() for c in _with_backoff(lambda: ws.row_values(1))]
+    merged = current + [c for c in header if c not in current]
+    if merged != current:
+        _with_backoff(lambda: ws.update([merged], "1:1"))
+    return merged
+
+
+def list_rows(
+    ws: gspread.Worksheet, fields: Optional[List[str]] = None, *, cache: Any = None
+) -> List[Dict[str, Any]]:
+    return [r.to_dict() for r in list_records(ws, fields, cache=cache)]
+
+
+def _col_letter(col: int) -> str:
+    letters = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def list_records_projected(
+    ws: gspread.Worksheet,
+    header: Union[List[str], SheetSchema],
+    fields: List[str] = SCHEDULE_FIELDS,
+    *,
+    cache: Any = None,
+) -> List[SheetRow]:
+    """Read only ``fields`` (one column range each, one batch_get) instead of whole rows.
+
+    Enough for due/prefill decisions; use fetch_rows for rows that get published.
+    With a ``cache`` the read is skipped while the spreadsheet revision is unchanged.
+    """
+    schema = compile_schema(header)
+    present = [f for f in fields if schema.col(f)]
+    if not present:
+        return []
+    letters = [_col_letter(schema.col(f)) for f in present]
+
+    def _load() -> List[List[str]]:
+        result = _with_backoff(
+            lambda: ws.batch_get([f"{c}2:{c}" for c in letters], major_dimension="COLUMNS")
+        )
+        return [list(vr[0]) if vr else [] for vr in result]
+
+    columns = _cached(cache, ws, "cols:" + ",".join(letters), _load)
+    count = max((len(c) for c in columns), default=0)
+    view = SheetSchema(present)
+    return [
+        view.record([c[i] if i < len(c) else "" for c in columns], i + 2)
+        for i in range(count)
+    ]
+
+
+def fetch_rows(
+    ws: gspread.Worksheet, header: Union[List[str], SheetSchema], row_numbers: List[int]
+) -> List[SheetRow]:
+    """Full rows for the given row numbers with a single batch_get."""
+    if not row_numbers:
+        return []
+    schema = compile_schema(header)
+    last = _col_letter(max(len(schema.header), 1))
+    result = _with_backoff(lambda: ws.batch_get([f"A{n}:{last}{n}" for n in row_numbers]))
+    return [schema.record(list(vr[0]) if vr else [], n) for n, vr in zip(row_numbers, result)]
+
+
+def _updated_row_numbers(response: Any, count: int) -> List[int]:
+    """Row numbers from an append response (``updates.updatedRange`` like ``Buffer!A12:F14``)."""
+    updated = ((response or {}).get("updates") or {}).get("updatedRange") or ""
+    match = _RANGE_ROWS_RE.search(updated.rsplit("!", 1)[-1])
+    if not match:
+        return []
+    first = int(match.group(1))
+    return list(range(first, first + count))
+
+
+def append_rows(ws: gspread.Worksheet, header: Union[List[str], SheetSchema], rows: List[Dict[str, Any]]) -> List[int]:
+    """Append all rows with one API call and return their sheet row numbers.
+
+    Rows without an ID get a new one (written back into the given dicts).
+    Appends are not idempotent: a timeout or 5xx may still have written the
+    rows, so before retrying those the ID column is read and rows already
+    there are dropped. Rate-limit rejections are retried as they are.
+    """
+    schema = compile_schema(header)
+    id_col = schema.col(ID_COLUMN)
+    if id_col is not None:
+        for row in rows:
+            if not str(row.get(ID_COLUMN) or "").strip():
+                row[ID_COLUMN] = new_row_id()
+    payloads = [schema.payload(row) for row in rows]
+    if not payloads:
+        return []
 
-    header = [str(c).strip() for c in (values[0] or [])]
-    rows: List[Dict[str, Any]] = []
-    for idx, row in enumerate(values[1:], start=2):
-        item = {header[i]: (row[i] if i < len(row) else "") for i in range(len(header))}
-        item["_row_number"] = idx
-        rows.append(item)
-    return rows
+    numbers: List[Optional[int]] = [None] * len(payloads)
+    pending = list(range(len(payloads)))
+    last_exc: Optional[BaseException] = None
+    for attempt in range(_APPEND_TRIES):
+        if last_exc is not None:
+            time.sleep(min(0.6 * (2**attempt) + random.random() * 0.25, 10.0))
+            if not _is_rate_limited(last_exc):
+                if id_col is None:
+                    break
+                landed = {
+                    str(r.get(ID_COLUMN) or "").strip(): int(r.get("_row_number") or 0)
+                    for r in list_records_projected(ws, schema, [ID_COLUMN])
+                }
+                for i in pending:
+                    numbers[i] = landed.get(payloads[i][id_col - 1])
+                pending = [i for i in pending if numbers[i] is None]
+                if not pending:
+                    break
+        try:
+            response = ws.append_rows([payloads[i] for i in pending])
+        except Exception as exc:
+            last_exc = exc
+            continue
+        for i, n in zip(pending, _updated_row_numbers(response, len(pending))):
+            numbers[i] = n
+        pending = []
+        break
+    if pending:
+        msg = str(last_exc).strip() or repr(last_exc)
+        raise SheetRateLimitError(f"{type(last_exc).__name__}: {msg}")
+    if any(n is None for n in numbers):
+        return []
+    return [int(n) for n in numbers]
 
 
-def append_row(ws: gspread.Worksheet, header: List[str], row: Dict[str, Any]) -> None:
-    payload = ["" for _ in header]
-    for i, key in enumerate(header):
-        if key in row:
-            payload[i] = str(row[key]) if row[key] is not None else ""
-    _with_backoff(lambda: ws.append_row(payload))
+def append_row(ws: gspread.Worksheet, header: Union[List[str], SheetSchema], row: Dict[str, Any]) -> Optional[int]:
+    numbers = append_rows(ws, header, [row])
+    return numbers[0] if numbers else None
 
 
-def update_fields(ws: gspread.Worksheet, row_number: int, header: List[str], fields: Dict[str, Any]) -> None:
+def update_fields(
+    ws: gspread.Worksheet,
+    row_number: int,
+    header: Union[List[str], SheetSchema],
+    fields: Dict[str, Any],
+) -> None:
+    schema = compile_schema(header)
     for key, value in fields.items():
-        if key not in header:
+        col = schema.col(key)
+        if col is None:
             continue
-        col = header.index(key) + 1
         _with_backoff(lambda: ws.update_cell(row_number, col, "" if value is None else str(value)))
 
 
-def delete_row(ws: gspread.Worksheet, row_number: int) -> None:
-    _with_backoff(lambda: ws.delete_rows(row_number))
+def delete_row(
+    ws: gspread.Worksheet,
+    header: Union[List[str], SheetSchema],
+    row_number: int,
+    row_id: Optional[str] = None,
+) -> bool:
+    """Delete one row; with ``row_id`` only if its ID cell still holds it. True when deleted.
+
+    Deleting is not idempotent (a repeat removes the row that moved up), so
+    it is retried only on rate-limit rejections.
+    """
+    if row_id:
+        col = compile_schema(header).col(ID_COLUMN)
+        if col is None or str(_with_backoff(lambda: ws.cell(row_number, col).value) or "").strip() != row_id:
+            return False
+    _with_backoff(lambda: ws.delete_rows(row_number), retry_if=_is_rate_limited)
+    return True
+
+
+def _runs_descending(row_numbers: List[int]) -> List[Tuple[int, int]]:
+    """Contiguous (first, last) row ranges, bottom of the sheet first."""
+    runs: List[Tuple[int, int]] = []
+    for n in sorted(set(row_numbers), reverse=True):
+        if runs and runs[-1][0] == n + 1:
+            runs[-1] = (n, runs[-1][1])
+        else:
+            runs.append((n, n))
+    return runs
+
+
+def delete_rows(
+    ws: gspread.Worksheet,
+    header: Union[List[str], SheetSchema],
+    rows: List[Any],
+    *,
+    match: Tuple[str, ...] = (ID_COLUMN,),
+) -> List[int]:
+    """Delete the given rows with one batchUpdate (bottom-up) and return the deleted row numbers.
+
+    The ``match`` columns are re-read first and only rows still holding the
+    values they were read with are deleted, so rows that moved or changed
+    since are left alone. Like delete_row, retried only on rate limits.
+    """
+    schema = compile_schema(header)
+    fields = [f for f in match if schema.col(f)]
+    current = {r.get("_row_number"): r for r in list_records_projected(ws, schema, fields)}
+    numbers: List[int] = []
+    for r in rows:
+        n = int(r.get("_row_number") or 0)
+        now_row = current.get(n)
+        if now_row is not None and all(str(now_row.get(f) or "") == str(r.get(f) or "") for f in fields):
+            numbers.append(n)
+    requests = [
+        {
+            "deleteDimension": {
+                "range": {
+                    "sheetId": ws.id,
+                    "dimension": "ROWS",
+                    "startIndex": first - 1,
+                    "endIndex": last,
+                }
+            }
+        }
+        for first, last in _runs_descending(numbers)
+    ]
+    if requests:
+        _with_backoff(
+            lambda: ws.spreadsheet.batch_update({"requests": requests}), retry_if=_is_rate_limited
+        )
+    return sorted(set(numbers))
+
+
+class RowIndex:
+    """ID -> row number map kept in step with local deletes and appends.
+
+    Lookups are hints: resolve_row verifies the ID cell before trusting one,
+    so edits made by other processes only cost a re-scan, never a wrong row.
+    """
+
+    def __init__(self) -> None:
+        self._rows: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def rebuild(self, rows) -> None:
+        fresh = {}
+        for r in rows:
+            row_id = str(r.get(ID_COLUMN) or "").strip()
+            if row_id:
+                fresh[row_id] = int(r.get("_row_number") or 0)
+        with self._lock:
+            self._rows = fresh
+
+    def get(self, row_id: str) -> Optional[int]:
+        with self._lock:
+            return self._rows.get(row_id)
+
+    def on_append(self, row_id: str, row_number: int) -> None:
+        with self._lock:
+            self._rows[row_id] = row_number
+
+    def on_delete(self, row_numbers: List[int]) -> None:
+        """Drop the deleted rows and shift later rows up (no sheet read)."""
+        deleted = sorted(set(row_numbers))
+        if not deleted:
+            return
+        gone = set(deleted)
+        with self._lock:
+            self._rows = {
+                row_id: n - bisect.bisect_left(deleted, n)
+                for row_id, n in self._rows.items()
+                if n not in gone
+            }
+
+
+def resolve_row(
+    ws: gspread.Worksheet,
+    header: Union[List[str], SheetSchema],
+    ref: Any,
+    index: Optional[RowIndex] = None,
+) -> Optional[int]:
+    """Row number for an ID (or a legacy numeric row reference).
+
+    The indexed position is confirmed by reading one cell; on a miss the ID
+    column is re-read (one projected call) and the index rebuilt.
+    """
+    ref = str(ref or "").strip()
+    if not ref:
+        return None
+    if ref.isdigit():
+        return int(ref) if int(ref) >= 2 else None
+
+    col = compile_schema(header).col(ID_COLUMN)
+    if col is None:
+        return None
+    hint = index.get(ref) if index else None
+    if hint and str(_with_backoff(lambda: ws.cell(hint, col).value) or "").strip() == ref:
+        return hint
+
+    rows = list_records_projected(ws, header, [ID_COLUMN])
+    if index:
+        index.rebuild(rows)
+    for r in rows:
+        if str(r.get(ID_COLUMN) or "").strip() == ref:
+            return int(r.get("_row_number") or 0)
+    return None
 
 
 def find_due_scheduled(rows: List[Dict[str, Any]], now_utc: Optional[datetime] = None) -> List[Dict[str, Any]]:
@@ -8,6 +8,22 @@ import streamlit as st
 from streamlit.connections import BaseConnection
 
 from gsheets_cms import SheetConfig, ensure_headers, list_rows, make_gspread_client, open_worksheet
+from sheet_cache import SheetCache
+
+
+@st.cache_resource
+def _sheet_cache() -> SheetCache:
+    # Same SQLite file as the webhook/scheduler when they share a disk.
+    return SheetCache()
+
+
+@st.cache_resource(show_spinner=False)
+def _open_sheet(sheet_id: str, worksheet: str, service_account_json: str):
+    # Authorize and check the header row once per server process (like the
+    # webhook's _GS_WS); reruns reuse the handle instead of reading the sheet.
+    client = make_gspread_client(json.loads(service_account_json))
+    ws = open_worksheet(client, SheetConfig(sheet_id=sheet_id, worksheet=worksheet))
+    return ws, ensure_headers(ws)
 
 
 @dataclass(frozen=True)
@@ -65,14 +81,17 @@ class GoogleSheetsConnection(BaseConnection[GoogleSheetsConfig]):
 
     def worksheet(self):
         cfg = self._connect()
-        client = make_gspread_client(self._service_account_info())
-        ws = open_worksheet(client, SheetConfig(sheet_id=cfg.sheet_id, worksheet=cfg.worksheet))
-        header = ensure_headers(ws)
-        return ws, header
+        svc = json.dumps(self._service_account_info(), sort_keys=True)
+        return _open_sheet(cfg.sheet_id, cfg.worksheet, svc)
+
+    def invalidate(self) -> None:
+        """Drop cached snapshots after a write from the dashboard."""
+        ws, _header = self.worksheet()
+        _sheet_cache().invalidate(ws)
 
     def read(self, *, ttl: Optional[int] = 0):
         def _read():
             ws, _header = self.worksheet()
-            return list_rows(ws)
+            return list_rows(ws, cache=_sheet_cache())
 
         return self._cache(_read, ttl=ttl)
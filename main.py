@@ -2,23 +2,29 @@ import os
 import time
 import urllib.parse
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import requests
 from groq import Groq
 
 from gsheets_cms import (
     SheetConfig,
-    append_row,
     ensure_headers,
     find_due_scheduled,
     has_scheduled_within,
-    list_rows,
+    list_records_projected,
     load_service_account_info_from_env,
     make_gspread_client,
     open_worksheet,
-    utc_now_iso,
 )
+from album_ingest import clean_caption
+from batch_prefill import PREFILL_BRIEF, PREFILL_FALLBACK, generate_batch, run_batch_prefill
+from publish_lock import PublishLock, make_owner_id
+from publisher import publish_due_batch, reap_stuck_rows
+from scheduler_engine import SchedulerEngine
+from sheet_cache import SheetCache
+from slot_allocator import SlotAllocator, queue_allocator
+from state_store import make_state_store
 
 
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY_4", "").strip()
@@ -30,34 +36,39 @@ GOOGLE_SHEET_WORKSHEET = os.environ.get("GOOGLE_SHEET_WORKSHEET", "Buffer").stri
 BUFFER_MINUTES = int(os.environ.get("BUFFER_MINUTES", "30") or "30")
 PREFILL_HOURS = int(os.environ.get("PREFILL_HOURS", "6") or "6")
 INTERVAL_SECONDS = int(os.environ.get("PUBLISHER_INTERVAL_SECONDS", "60") or "60")
-
-ACTIVE_HOURS_RAW = os.environ.get("ACTIVE_HOURS", "").strip()
-if ACTIVE_HOURS_RAW:
-    ACTIVE_HOURS = [int(x) for x in ACTIVE_HOURS_RAW.split(",") if x.strip().isdigit()]
-else:
-    ACTIVE_HOURS = []
+# Idle back-off ceiling for sheet refreshes. Keep it under BUFFER_MINUTES so
+# posts added from Telegram/the dashboard are still picked up before they are due.
+MAX_REFRESH_SECONDS = int(os.environ.get("SCHEDULER_MAX_REFRESH_SECONDS", "900") or "900")
+# "1" restores the old fixed-interval polling loop.
+FIXED_INTERVAL = os.environ.get("SCHEDULER_FIXED_INTERVAL", "").strip().lower() in {"1", "true", "yes"}
 
 
 def _utc_now() -> datetime:
     return datetime.now(timezone.utc).replace(microsecond=0)
 
 
-def _next_available_slot(now_utc: datetime) -> datetime:
-    # Always apply buffer first.
-    candidate = now_utc + timedelta(minutes=max(BUFFER_MINUTES, 0))
+_SHEET = None
+# Skips the Sheets read while the Drive revision is unchanged (the scheduler
+# refreshes often while idle).
+_SHEET_CACHE = SheetCache()
+# Leases + row claims in saas.db, shared with the webhook workers.
+_PUBLISH_LOCK = PublishLock()
+# The webhook's state store, for the dashboard settings (active hours).
+_STATE = make_state_store()
 
-    if not ACTIVE_HOURS:
-        return candidate
 
-    # Move forward to next hour that is allowed.
-    for _ in range(0, 72):
-        if candidate.hour in ACTIVE_HOURS:
-            return candidate
-        candidate = (candidate + timedelta(hours=1)).replace(minute=0, second=0)
-    return now_utc + timedelta(minutes=max(BUFFER_MINUTES, 0))
+def _slot_allocator(rows: List[Dict[str, Any]]) -> SlotAllocator:
+    """Same hours as the webhook: ACTIVE_HOURS (UTC), else the dashboard's; queued hours are skipped."""
+    config = _STATE.get("bot_config") or {}
+    return queue_allocator(rows, buffer_minutes=BUFFER_MINUTES, dashboard_hours=config.get("active_hours"))
 
 
 def _get_sheet():
+    # Authorize once per process; the scheduler loop reuses the worksheet handle.
+    global _SHEET
+    if _SHEET is not None:
+        return _SHEET
+
     if not GOOGLE_SHEET_ID:
         raise RuntimeError("GOOGLE_SHEET_ID not set")
 
@@ -68,6 +79,7 @@ def _get_sheet():
     client = make_gspread_client(svc)
     ws = open_worksheet(client, SheetConfig(sheet_id=GOOGLE_SHEET_ID, worksheet=GOOGLE_SHEET_WORKSHEET))
     header = ensure_headers(ws)
+    _SHEET = (ws, header)
     return ws, header
 
 
@@ -76,41 +88,6 @@ def _pollinations_url(prompt_en: str) -> str:
     return f"https://image.pollinations.ai/prompt/{encoded}"
 
 
-def _generate_image_prompt_en(groq: Optional[Groq]) -> str:
-    if not groq:
-        return "Cinematic photo of kids martial arts training in Cairo, golden hour, energetic, high detail"
-
-    prompt = (
-        "Write ONE short English image prompt (8-18 words) for a cinematic sports/martial-arts academy scene. "
-        "Must be safe-for-work, no violence, suitable for Facebook. Avoid copyrighted characters."
-    )
-    res = groq.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=80,
-        temperature=0.9,
-    )
-    return (res.choices[0].message.content or "").strip().strip('"')
-
-
-def _generate_ar_caption(groq: Optional[Groq], prompt_en: str) -> str:
-    if not groq:
-        return "🥋 تدريب النهارده نار! جاهزين تبدأوا؟ احجز مكانك دلوقتي 💪📞"
-
-    prompt = (
-        "اكتب كابشن فيسبوك عربي مصري (عامية) عن صورة تدريب في أكاديمية رياضية. "
-        "الكابشن 2-4 سطور، تحفيزي، وفيه CTA للحجز، وإيموجيز بسيطة. "
-        f"وصف الصورة (بالإنجليزية): {prompt_en}"
-    )
-    res = groq.chat.completions.create(
-        model="llama-3.3-70b-versatile",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=250,
-        temperature=0.85,
-    )
-    return (res.choices[0].message.content or "").strip()
-
-
 def _post_to_facebook(caption: str, image_url: Optional[str]) -> Tuple[bool, str]:
     if not PAGE_ACCESS_TOKEN:
         return False, "PAGE_ACCESS_TOKEN not set"
@@ -141,65 +118,96 @@ def _post_to_facebook(caption: str, image_url: Optional[str]) -> Tuple[bool, str
         return False, str(e)
 
 
-def tick_once() -> None:
-    groq = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+def _publish_due(ws, header, due) -> None:
+    owner = make_owner_id()
+    # Oldest first; rows claimed by the webhook are skipped.
+    results = publish_due_batch(ws, header, due, _post_to_facebook, lock=_PUBLISH_LOCK, owner=owner)
+    for result in results:
+        print("publish:", result)
+    if results:
+        _SHEET_CACHE.invalidate(ws)
 
-    ws, header = _get_sheet()
-    rows = list_rows(ws)
 
-    # 1) Publish due posts (oldest first)
-    due = find_due_scheduled(rows)
-    if due:
-        item = due[0]
-        row_number = int(item.get("_row_number") or 0)
-        caption = str(item.get("AI_Caption") or "").strip()
-        image_url = str(item.get("Image_URL") or "").strip() or None
+def _prefill(ws, header, rows, now: datetime) -> None:
+    window_end = now + timedelta(hours=max(PREFILL_HOURS, 1))
+    if has_scheduled_within(rows, start=now, end=window_end):
+        return
 
-        ok, err = _post_to_facebook(caption, image_url)
-        if ok:
-            from gsheets_cms import update_fields
+    with _PUBLISH_LOCK.lease("prefill") as acquired:
+        if not acquired:
+            return
+        rows = list_records_projected(ws, header)
+        if not has_scheduled_within(rows, start=now, end=window_end):
+            groq = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+            _prefill_batch(groq, ws, header, rows, now)
 
-            update_fields(ws, row_number, header, {"Status": "Posted"})
-        else:
-            from gsheets_cms import update_fields
 
-            update_fields(ws, row_number, header, {"Status": "Failed"})
-        return
+def _reap(ws, header, rows) -> None:
+    results = reap_stuck_rows(ws, header, rows, lock=_PUBLISH_LOCK)
+    for result in results:
+        print("publish:", result)
+    if results:
+        _SHEET_CACHE.invalidate(ws)
 
-    # 2) Prefill AI-generated content if no scheduled posts in next PREFILL_HOURS
-    now = _utc_now()
-    window_end = now + timedelta(hours=max(PREFILL_HOURS, 1))
-    if has_scheduled_within(rows, start=now, end=window_end):
+
+def tick_once() -> None:
+    ws, header = _get_sheet()
+    rows = list_records_projected(ws, header, cache=_SHEET_CACHE)
+    _reap(ws, header, rows)
+
+    # 1) Publish due posts
+    due = find_due_scheduled(rows)
+    if due:
+        _publish_due(ws, header, due)
         return
 
-    prompt_en = _generate_image_prompt_en(groq)
-    img_url = _pollinations_url(prompt_en)
-    caption_ar = _generate_ar_caption(groq, prompt_en)
+    # 2) Prefill AI-generated content if no scheduled posts in next PREFILL_HOURS
+    _prefill(ws, header, rows, _utc_now())
 
-    scheduled_time = _next_available_slot(now)
-    scheduled_iso = scheduled_time.isoformat()
 
-    append_row(
+def _prefill_batch(groq: Optional[Groq], ws, header, rows, now: datetime) -> None:
+    created = run_batch_prefill(
         ws,
         header,
-        {
-            "Timestamp": utc_now_iso(),
-            "Image_URL": img_url,
-            "AI_Caption": caption_ar,
-            "Status": "Scheduled",
-            "Scheduled_Time": scheduled_iso,
-            "Source": "AI_Generated",
-        },
+        _slot_allocator(rows),
+        now,
+        lambda n: generate_batch(groq, n, PREFILL_BRIEF, PREFILL_FALLBACK),
+        _pollinations_url,
+        clean_caption=clean_caption,
     )
+    print("prefill:", len(created), "posts queued")
+    if created:
+        _SHEET_CACHE.invalidate(ws)
+
+
+def _load_rows():
+    ws, header = _get_sheet()
+    rows = list_records_projected(ws, header, cache=_SHEET_CACHE)
+    _reap(ws, header, rows)
+    return ws, header, rows
 
 
 def main() -> None:
-    while True:
-        try:
-            tick_once()
-        except Exception as e:
-            print("tick error:", str(e))
-        time.sleep(INTERVAL_SECONDS)
+    if FIXED_INTERVAL:
+        while True:
+            try:
+                tick_once()
+            except Exception as e:
+                print("tick error:", str(e))
+            time.sleep(INTERVAL_SECONDS)
+
+    # Sleep until the next Scheduled_Time / prefill deadline; `kill -USR1 <pid>`
+    # forces an immediate refresh after an external change.
+    engine = SchedulerEngine(
+        _load_rows,
+        _publish_due,
+        _prefill,
+        prefill_hours=max(PREFILL_HOURS, 1),
+        min_refresh=INTERVAL_SECONDS,
+        max_refresh=MAX_REFRESH_SECONDS,
+    )
+    engine.install_signal_handler()
+    engine.run_forever()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+import html
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+
+
+OG_MAX_BYTES = int(os.environ.get("OG_MAX_BYTES", "65536") or "65536")
+OG_TIMEOUT_SECONDS = float(os.environ.get("OG_TIMEOUT_SECONDS", "8") or "8")
+OG_CACHE_SIZE = int(os.environ.get("OG_CACHE_SIZE", "2048") or "2048")
+OG_CACHE_TTL_SECONDS = int(os.environ.get("OG_CACHE_TTL_SECONDS", "86400") or "86400")
+# Misses are cached too, but for less time: pages sometimes gain an image later.
+OG_NEGATIVE_TTL_SECONDS = int(os.environ.get("OG_NEGATIVE_TTL_SECONDS", "3600") or "3600")
+
+_CHUNK_SIZE = 8192
+_HEAD_END = re.compile(rb"</head\s*>", re.IGNORECASE)
+_META_TAG = re.compile(r"<meta\b[^>]*>", re.IGNORECASE)
+_META_ATTR = re.compile(
+    r"""([a-zA-Z_:][-a-zA-Z0-9_:.]*)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+))"""
+)
+
+# Checked in order; the first one present wins.
+_IMAGE_KEYS = ("og:image", "og:image:url", "og:image:secure_url", "twitter:image", "twitter:image:src")
+
+_CACHE: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def _cache_get(url: str) -> Tuple[bool, Optional[str]]:
+    with _CACHE_LOCK:
+        hit = _CACHE.get(url)
+        if hit is None:
+            return False, None
+        expires, value = hit
+        if expires < time.monotonic():
+            _CACHE.pop(url, None)
+            return False, None
+        _CACHE.move_to_end(url)
+        return True, value
+
+
+def _cache_put(url: str, value: Optional[str]) -> None:
+    ttl = OG_CACHE_TTL_SECONDS if value else OG_NEGATIVE_TTL_SECONDS
+    with _CACHE_LOCK:
+        _CACHE[url] = (time.monotonic() + ttl, value)
+        _CACHE.move_to_end(url)
+        while len(_CACHE) > OG_CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+
+def read_head(url: str, *, max_bytes: int = OG_MAX_BYTES, timeout: float = OG_TIMEOUT_SECONDS) -> str:
+    """Download a page only up to ``</head>`` (or ``max_bytes``) and decode it."""
+    with requests.get(
+        url,
+        stream=True,
+        timeout=timeout,
+        headers={"User-Agent": "Mozilla/5.0 (compatible; AcademyManager/1.0)"},
+    ) as resp:
+        resp.raise_for_status()
+        content_type = str(resp.headers.get("content-type") or "").lower()
+        if content_type and "html" not in content_type:
+            return ""
+
+        buf = bytearray()
+        for chunk in resp.iter_content(chunk_size=_CHUNK_SIZE):
+            if not chunk:
+                continue
+            # Re-scan a small overlap so a tag split across chunks is still found.
+            start = max(0, len(buf) - 16)
+            buf.extend(chunk)
+            match = _HEAD_END.search(buf, start)
+            if match:
+                del buf[match.end():]
+                break
+            if len(buf) >= max_bytes:
+                del buf[max_bytes:]
+                break
+        encoding = resp.encoding or "utf-8"
+
+    try:
+        return bytes(buf).decode(encoding, errors="replace")
+    except LookupError:
+        return bytes(buf).decode("utf-8", errors="replace")
+
+
+def scan_meta(head_html: str) -> Dict[str, str]:
+    """Map ``property``/``name`` -> ``content`` for every <meta> tag (first one wins)."""
+    found: Dict[str, str] = {}
+    for tag in _META_TAG.findall(head_html):
+        attrs = {}
+        for name, dq, sq, bare in _META_ATTR.findall(tag):
+            attrs[name.lower()] = dq or sq or bare
+        key = (attrs.get("property") or attrs.get("name") or "").strip().lower()
+        content = (attrs.get("content") or "").strip()
+        if key and content and key not in found:
+            found[key] = html.unescape(content)
+    return found
+
+
+def extract_og_image(url: str) -> Optional[str]:
+    """Return the article's og:image (or twitter:image) URL, cached per article."""
+    url = str(url or "").strip()
+    if not url:
+        return None
+
+    hit, cached = _cache_get(url)
+    if hit:
+        return cached
+
+    image_url: Optional[str] = None
+    try:
+        meta = scan_meta(read_head(url))
+        for key in _IMAGE_KEYS:
+            if meta.get(key):
+                image_url = urljoin(url, meta[key])
+                break
+    except Exception:
+        image_url = None
+
+    _cache_put(url, image_url)
+    return image_url
@@ -0,0 +1,202 @@
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional, Union
+
+from sqlite_db import SQLiteDB
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SAAS_DB_PATH = os.environ.get("SAAS_DB_PATH", "").strip() or os.path.join(BASE_DIR, "saas.db")
+
+# Must outlive one publish (image download + Graph upload + sheet writes).
+PUBLISH_LEASE_SECONDS = int(os.environ.get("PUBLISH_LEASE_SECONDS", "600") or "600")
+
+# Finished claims are kept for a while as a publish log.
+_CLAIM_RETENTION_SECONDS = 30 * 24 * 3600
+
+
+def make_owner_id() -> str:
+    """Unique holder id for one tick (host + pid + random suffix)."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class PublishLock:
+    """Leases and per-row publish claims stored in saas.db.
+
+    A lease is a named mutex with an expiry, so a crashed holder cannot
+    block forever. A claim marks one queue item as Publishing for a single
+    owner until it finishes or the claim expires. Callers re-check the
+    sheet row after claiming, so a finished claim may be taken again (e.g.
+    when an admin moves a Failed row back to Scheduled).
+    """
+
+    def __init__(self, db: Union[str, SQLiteDB] = SAAS_DB_PATH, *, create_tables: bool = True) -> None:
+        self.db = db if isinstance(db, SQLiteDB) else SQLiteDB(db)
+        if create_tables:
+            self.init_db()
+
+    def init_db(self) -> None:
+        """Create the tables; the webhook runs this once per saas.db schema version."""
+        conn = self.db.conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS publish_claims (
+                claim_key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                status TEXT NOT NULL,
+                claimed_at REAL NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_publish_claims_claimed_at ON publish_claims (claimed_at)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS publish_budget (
+                hour INTEGER PRIMARY KEY,
+                used INTEGER NOT NULL
+            )
+            """
+        )
+
+    # ---------- Leases ----------
+    def acquire(self, name: str, owner: str, ttl: float = PUBLISH_LEASE_SECONDS) -> bool:
+        now = time.time()
+        conn = self.db.conn()
+        cur = conn.execute(
+            """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.expires_at <= ? OR leases.owner = excluded.owner
+            """,
+            (name, owner, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def release(self, name: str, owner: str) -> None:
+        conn = self.db.conn()
+        conn.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def is_held(self, name: str) -> bool:
+        conn = self.db.conn()
+        row = conn.execute(
+            "SELECT 1 FROM leases WHERE name = ? AND expires_at > ?", (name, time.time())
+        ).fetchone()
+        return row is not None
+
+    @contextmanager
+    def lease(self, name: str, owner: Optional[str] = None, ttl: float = PUBLISH_LEASE_SECONDS) -> Iterator[bool]:
+        """``with lock.lease("prefill") as acquired:`` — body should skip if not acquired."""
+        owner = owner or make_owner_id()
+        acquired = self.acquire(name, owner, ttl)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release(name, owner)
+
+    # ---------- Row claims (Scheduled -> Publishing -> Posted/Failed) ----------
+    def claim(self, claim_key: str, owner: str, ttl: float = PUBLISH_LEASE_SECONDS) -> bool:
+        """Take the item for publishing unless another owner is still publishing it."""
+        now = time.time()
+        conn = self.db.conn()
+        cur = conn.execute(
+            """
+            INSERT INTO publish_claims (claim_key, owner, status, claimed_at, expires_at)
+            VALUES (?, ?, 'publishing', ?, ?)
+            ON CONFLICT(claim_key) DO UPDATE SET
+                owner = excluded.owner,
+                status = excluded.status,
+                claimed_at = excluded.claimed_at,
+                expires_at = excluded.expires_at
+            WHERE publish_claims.status != 'publishing' OR publish_claims.expires_at <= ?
+            """,
+            (claim_key, owner, now, now + ttl, now),
+        )
+        return cur.rowcount == 1
+
+    def active_claims(self) -> int:
+        """Items currently being published (unexpired 'publishing' claims)."""
+        conn = self.db.conn()
+        row = conn.execute(
+            "SELECT COUNT(*) FROM publish_claims WHERE status = 'publishing' AND expires_at > ?",
+            (time.time(),),
+        ).fetchone()
+        return int(row[0] or 0)
+
+    # ---------- Page-wide hourly budget ----------
+    def reserve_publish_slot(self, limit: int, now: Optional[float] = None) -> Optional[int]:
+        """Count one publish in the current UTC hour; the hour, or None once ``limit`` is used up.
+
+        The increment and the returned count are one statement, so concurrent
+        ticks cannot both take the last slot.
+        """
+        hour = int((now or time.time()) // 3600)
+        conn = self.db.conn()
+        used = conn.execute(
+            """
+            INSERT INTO publish_budget (hour, used) VALUES (?, 1)
+            ON CONFLICT(hour) DO UPDATE SET used = used + 1
+            RETURNING used
+            """,
+            (hour,),
+        ).fetchall()[0][0]
+        if used > limit:
+            self.return_publish_slot(hour)
+            return None
+        return hour
+
+    def return_publish_slot(self, hour: int) -> None:
+        """Give back a slot from ``reserve_publish_slot`` that was not used."""
+        conn = self.db.conn()
+        conn.execute("UPDATE publish_budget SET used = used - 1 WHERE hour = ? AND used > 0", (hour,))
+
+    def claim_state(self, claim_key: str) -> Optional[str]:
+        """'publishing' while a claim is live, 'expired' once it lapsed, the finished status, or None."""
+        conn = self.db.conn()
+        row = conn.execute(
+            "SELECT status, expires_at FROM publish_claims WHERE claim_key = ?", (claim_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, expires_at = row
+        if status == "publishing" and (expires_at is None or expires_at <= time.time()):
+            return "expired"
+        return status
+
+    def release_claim(self, claim_key: str, owner: str) -> None:
+        conn = self.db.conn()
+        conn.execute(
+            "DELETE FROM publish_claims WHERE claim_key = ? AND owner = ? AND status = 'publishing'",
+            (claim_key, owner),
+        )
+
+    def finish(self, claim_key: str, owner: str, status: str) -> None:
+        now = time.time()
+        conn = self.db.conn()
+        conn.execute(
+            """
+            UPDATE publish_claims SET status = ?, expires_at = NULL
+            WHERE claim_key = ? AND owner = ?
+            """,
+            (status, claim_key, owner),
+        )
+        conn.execute(
+            "DELETE FROM publish_claims WHERE status != 'publishing' AND claimed_at < ?",
+            (now - _CLAIM_RETENTION_SECONDS,),
+        )
+        conn.execute("DELETE FROM publish_budget WHERE hour < ?", (int(now // 3600) - 48,))
@@ -0,0 +1,264 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from gsheets_cms import ID_COLUMN, compile_schema, fetch_rows, update_fields
+from publish_lock import PublishLock, make_owner_id
+
+
+# Held while the archiver deletes rows (row numbers shift underneath publishers).
+ARCHIVE_LEASE = "archive"
+
+PostFn = Callable[[str, Optional[str]], Tuple[bool, str]]
+
+# Drain mode: after downtime a tick publishes several due rows instead of one.
+PUBLISH_MAX_PER_TICK = int(os.environ.get("PUBLISH_MAX_PER_TICK", "5") or "5")
+# No new item is started after this many seconds (keep below the worker timeout).
+PUBLISH_TICK_BUDGET_SECONDS = float(os.environ.get("PUBLISH_TICK_BUDGET_SECONDS", "20") or "20")
+# Page-wide cap per UTC clock hour across all ticks and processes (counter in saas.db).
+PUBLISH_MAX_PER_HOUR = int(os.environ.get("PUBLISH_MAX_PER_HOUR", "12") or "12")
+PUBLISH_CONCURRENCY = int(os.environ.get("PUBLISH_CONCURRENCY", "3") or "3")
+
+# The scheduler only takes Scheduled rows; an admin may also retry a Failed one.
+_DUE_STATUSES = ("scheduled",)
+MANUAL_POST_STATUSES = ("scheduled", "failed")
+
+
+def claim_key(item: Dict[str, Any]) -> str:
+    """Stable key for a queue row: its ID, or a content hash for rows without one.
+
+    Row numbers cannot be used since they shift when rows are deleted.
+    """
+    row_id = str(item.get(ID_COLUMN) or "").strip()
+    if row_id:
+        return f"id:{row_id}"
+    raw = "|".join(
+        str(item.get(k) or "").strip()
+        for k in ("Timestamp", "Scheduled_Time", "Image_URL", "AI_Caption")
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _still_scheduled(ws, header: List[str], item: Dict[str, Any], statuses: Tuple[str, ...] = _DUE_STATUSES) -> bool:
+    # Re-read the row after claiming: another host may have posted it, or a
+    # delete may have shifted a different row into this position.
+    row_number = int(item.get("_row_number") or 0)
+    current = compile_schema(header).record(ws.row_values(row_number), row_number)
+    return (
+        str(current.get("Status", "")).strip().lower() in statuses
+        and claim_key(current) == claim_key(item)
+    )
+
+
+def publish_item(
+    ws,
+    header: List[str],
+    item: Dict[str, Any],
+    post_fn: PostFn,
+    *,
+    lock: PublishLock,
+    owner: str,
+    dry_run: bool = False,
+    statuses: Tuple[str, ...] = _DUE_STATUSES,
+) -> Optional[Dict[str, Any]]:
+    """Claim, publish and mark one due row. Returns None if another tick owns it."""
+    key = claim_key(item)
+    if not lock.claim(key, owner):
+        return None
+    # Claim first, then check: the archiver takes its lease first and then
+    # checks for claims, so one side always sees the other.
+    if lock.is_held(ARCHIVE_LEASE):
+        lock.release_claim(key, owner)
+        return None
+
+    row_number = int(item.get("_row_number") or 0)
+    if not _still_scheduled(ws, header, item, statuses):
+        # Posted elsewhere or shifted by a delete; the next tick re-reads it.
+        lock.release_claim(key, owner)
+        return None
+
+    try:
+        update_fields(ws, row_number, header, {"Status": "Publishing"})
+    except Exception:
+        # Nothing went out yet: put the row back for the next tick.
+        _requeue(ws, header, row_number, key, lock=lock, owner=owner)
+        raise
+
+    try:
+        if dry_run:
+            ok, err = True, ""
+        else:
+            caption = str(item.get("AI_Caption") or "").strip()
+            image_url = str(item.get("Image_URL") or "").strip() or None
+            ok, err = post_fn(caption, image_url)
+    except Exception as e:
+        # Unknown whether the post went out, so never retry it automatically.
+        ok, err = False, str(e)
+
+    # The claim records the outcome first; if the sheet write below fails,
+    # reap_stuck_rows copies it to the row on a later tick.
+    lock.finish(key, owner, "posted" if ok else "failed")
+    update_fields(ws, row_number, header, {"Status": "Posted" if ok else "Failed"})
+    if dry_run:
+        return {"action": "dry_run_posted", "row": row_number}
+    if ok:
+        return {"action": "posted", "row": row_number}
+    return {"action": "failed", "row": row_number, "error": err}
+
+
+def publish_now(
+    ws,
+    header: List[str],
+    row_number: int,
+    post_fn: PostFn,
+    *,
+    lock: PublishLock,
+    row_id: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Manual "post now" for one row, through the same claim and archive lease as the scheduler.
+
+    Returns None when the row is being published or archived elsewhere, is
+    not Scheduled/Failed, or (with ``row_id``) no longer holds that ID.
+    """
+    item = fetch_rows(ws, header, [row_number])[0]
+    if row_id and str(item.get(ID_COLUMN) or "").strip() != row_id:
+        return None
+    return publish_item(
+        ws, header, item, post_fn, lock=lock, owner=make_owner_id(), statuses=MANUAL_POST_STATUSES
+    )
+
+
+def _requeue(ws, header: List[str], row_number: int, key: str, *, lock: PublishLock, owner: str) -> None:
+    try:
+        update_fields(ws, row_number, header, {"Status": "Scheduled"})
+    except Exception:
+        # Row may be left as Publishing; mark the claim so reaping restores it.
+        lock.finish(key, owner, "requeued")
+        return
+    lock.release_claim(key, owner)
+
+
+# Claim outcome -> sheet Status for rows stuck in Publishing. A claim that
+# expired mid-publish (or is gone) may already have posted, so it becomes Failed
+# for an admin to check rather than being retried.
+_REAPED_STATUS = {"posted": "Posted", "failed": "Failed", "requeued": "Scheduled"}
+
+
+def reap_stuck_rows(ws, header: List[str], rows: List[Dict[str, Any]], *, lock: PublishLock) -> List[Dict[str, Any]]:
+    """Fix rows left in Publishing by a crashed or failed publish.
+
+    Rows whose claim is still live are in flight and left alone. Returns one
+    result per row changed.
+    """
+    stuck = [r for r in rows if str(r.get("Status", "")).strip().lower() == "publishing"]
+    if not stuck:
+        return []
+    results: List[Dict[str, Any]] = []
+    for current in fetch_rows(ws, header, [int(r.get("_row_number") or 0) for r in stuck]):
+        if str(current.get("Status", "")).strip().lower() != "publishing":
+            continue
+        key = claim_key(current)
+        state = lock.claim_state(key)
+        if state == "publishing":
+            continue
+        status = _REAPED_STATUS.get(state or "", "Failed")
+        row_number = int(current.get("_row_number") or 0)
+        update_fields(ws, row_number, header, {"Status": status})
+        results.append({"action": "reaped", "row": row_number, "status": status})
+    return results
+
+
+def publish_due_batch(
+    ws,
+    header: List[str],
+    due: List[Dict[str, Any]],
+    post_fn: PostFn,
+    *,
+    lock: PublishLock,
+    owner: str,
+    dry_run: bool = False,
+    max_items: int = PUBLISH_MAX_PER_TICK,
+    budget_seconds: float = PUBLISH_TICK_BUDGET_SECONDS,
+    max_per_hour: int = PUBLISH_MAX_PER_HOUR,
+    concurrency: int = PUBLISH_CONCURRENCY,
+) -> List[Dict[str, Any]]:
+    """Publish up to ``max_items`` due rows (oldest first), a few at a time.
+
+    ``due`` may be projected records (Status/Scheduled_Time/ID only). The
+    whole list is walked: rows another tick is publishing are skipped, so
+    overlapping ticks take different rows. Full rows are fetched in chunks
+    only for rows this tick may take. Stops starting new items once
+    ``allowed`` rows were taken, ``budget_seconds`` have passed or the
+    page-wide hourly cap is reached. Returns one result per attempted row,
+    plus ``{"action": "hourly_cap"}`` if the cap stopped the tick.
+    """
+    allowed = min(max_items, len(due))
+    if allowed <= 0:
+        return []
+
+    def _candidates() -> Iterator[Dict[str, Any]]:
+        # Skip rows with a live claim before paying for their full read.
+        free = (
+            r
+            for r in due
+            if not (str(r.get(ID_COLUMN) or "").strip() and lock.claim_state(claim_key(r)) == "publishing")
+        )
+        while True:
+            chunk = list(itertools.islice(free, allowed))
+            if not chunk:
+                return
+            yield from fetch_rows(ws, header, [int(r.get("_row_number") or 0) for r in chunk])
+
+    deadline = time.monotonic() + budget_seconds
+    pending = _candidates()
+    mutex = threading.Lock()
+    results: List[Dict[str, Any]] = []
+    reserved = 0
+    capped = False
+
+    def _worker() -> None:
+        nonlocal reserved, capped
+        while True:
+            with mutex:
+                if reserved >= allowed or capped or time.monotonic() >= deadline:
+                    return
+                try:
+                    item = next(pending, None)
+                except Exception as e:
+                    # Full-row read failed; later candidates would hit it too.
+                    results.append({"action": "error", "error": str(e)})
+                    return
+                if item is None:
+                    return
+                reserved += 1
+            hour = lock.reserve_publish_slot(max_per_hour)
+            if hour is None:
+                with mutex:
+                    reserved -= 1
+                    if not capped:
+                        capped = True
+                        results.append({"action": "hourly_cap"})
+                return
+            try:
+                result = publish_item(ws, header, item, post_fn, lock=lock, owner=owner, dry_run=dry_run)
+            except Exception as e:
+                result = {"action": "error", "row": int(item.get("_row_number") or 0), "error": str(e)}
+            with mutex:
+                if result is None:
+                    # Claimed elsewhere or moved: nothing was published.
+                    lock.return_publish_slot(hour)
+                    reserved -= 1
+                else:
+                    results.append(result)
+
+    workers = max(1, min(concurrency, allowed))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in range(workers):
+            pool.submit(_worker)
+
+    results.sort(key=lambda r: r.get("row") or 0)
+    return results
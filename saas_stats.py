@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlite_db import SQLiteDB
+
+
+# /admin/stats is polled by dashboards; one computation serves every poll in this window.
+ADMIN_STATS_CACHE_SECONDS = float(os.environ.get("ADMIN_STATS_CACHE_SECONDS", "60") or "60")
+STATS_EXPIRING_DAYS = 7
+STATS_REDEMPTION_DAYS = 30
+
+# Created by init_db; every aggregate below is answered from one of these.
+SAAS_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_vouchers_used_created ON vouchers (is_used, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_users_subscription_end ON users (subscription_end)",
+)
+
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def ensure_indexes(db: SQLiteDB) -> None:
+    for sql in SAAS_INDEXES:
+        db.execute(sql)
+
+
+def collect_stats(db: SQLiteDB, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Aggregate subscriber and voucher counts straight from saas.db.
+
+    ``subscription_end`` / ``used_at`` are naive UTC ISO strings, so range
+    filters are plain string comparisons that SQLite answers from the indexes.
+    """
+    now = now or datetime.utcnow()
+    now_s = now.strftime(_TIME_FORMAT)
+    soon_s = (now + timedelta(days=STATS_EXPIRING_DAYS)).strftime(_TIME_FORMAT)
+    since_s = (now - timedelta(days=STATS_REDEMPTION_DAYS - 1)).strftime("%Y-%m-%d")
+
+    active, expiring = db.query_one(
+        "SELECT COUNT(*), COALESCE(SUM(subscription_end <= ?), 0) "
+        "FROM users WHERE subscription_end > ?",
+        (soon_s, now_s),
+    )
+    unused = db.query_all(
+        "SELECT duration_days, COUNT(*) FROM vouchers WHERE is_used = 0 "
+        "GROUP BY duration_days ORDER BY duration_days"
+    )
+    redemptions = db.query_all(
+        "SELECT substr(used_at, 1, 10) AS day, COUNT(*) FROM vouchers "
+        "WHERE is_used = 1 AND used_at >= ? GROUP BY day ORDER BY day",
+        (since_s,),
+    )
+    return {
+        "generated_at": now_s,
+        "active_subscribers": active,
+        f"expiring_within_{STATS_EXPIRING_DAYS}_days": expiring,
+        "unused_vouchers_by_duration": {str(days): n for days, n in unused},
+        "unused_vouchers_total": sum(n for _, n in unused),
+        "redemptions_per_day": {day: n for day, n in redemptions},
+    }
+
+
+class StatsCache:
+    """``collect_stats`` memoised for ``ttl`` seconds per process."""
+
+    def __init__(self, db: SQLiteDB, *, ttl: float = ADMIN_STATS_CACHE_SECONDS) -> None:
+        self.db = db
+        self.ttl = ttl
+        self._value: Optional[Dict[str, Any]] = None
+        self._until = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._value is None or time.time() >= self._until:
+                self._value = collect_stats(self.db)
+                self._until = time.time() + self.ttl
+            return self._value
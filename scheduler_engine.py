@@ -0,0 +1,158 @@
+import hashlib
+import heapq
+import signal
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from gsheets_cms import find_due_scheduled, parse_time_utc
+
+
+Rows = List[Dict[str, Any]]
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def _is_scheduled(row: Dict[str, Any]) -> bool:
+    return str(row.get("Status", "")).strip().lower() == "scheduled"
+
+
+def prefill_deadline(rows: Rows, now: datetime, prefill_hours: int) -> Optional[datetime]:
+    """Earliest time >= now at which no Scheduled post falls within the next ``prefill_hours``."""
+    if prefill_hours <= 0:
+        return None
+    window = timedelta(hours=prefill_hours)
+    times = sorted(
+        dt
+        for dt in (parse_time_utc(r.get("Scheduled_Time")) for r in rows if _is_scheduled(r))
+        if dt and dt >= now
+    )
+    t = now
+    for dt in times:
+        if dt > t + window:
+            break
+        t = dt + timedelta(seconds=1)
+    return t
+
+
+class SchedulerEngine:
+    """Sleeps until the next Scheduled_Time instead of polling on a fixed interval.
+
+    Upcoming publish times live in a min-heap. The loop wakes at the
+    earliest of: the next due post, the next prefill deadline, the next
+    sheet refresh, or notify() (also bound to SIGUSR1). Refreshes back off
+    exponentially while the sheet is unchanged and snap back to
+    ``min_refresh`` as soon as it changes or an action runs.
+    """
+
+    def __init__(
+        self,
+        load_rows: Callable[[], Tuple[Any, List[str], Rows]],
+        publish: Callable[[Any, List[str], Rows], None],
+        prefill: Callable[[Any, List[str], Rows, datetime], None],
+        *,
+        prefill_hours: int,
+        min_refresh: float,
+        max_refresh: float,
+    ) -> None:
+        self.load_rows = load_rows
+        self.publish = publish
+        self.prefill = prefill
+        self.prefill_hours = prefill_hours
+        self.min_refresh = max(min_refresh, 1.0)
+        self.max_refresh = max(max_refresh, self.min_refresh)
+
+        self._heap: List[Tuple[float, int]] = []
+        self._prefill_at: Optional[float] = None
+        self._refresh_interval = self.min_refresh
+        self._next_refresh = 0.0
+        self._signature = ""
+        self._wake = threading.Event()
+
+    def notify(self) -> None:
+        """Signal an external change (new upload, manual edit) so the loop refreshes now."""
+        self._wake.set()
+
+    def install_signal_handler(self) -> None:
+        if hasattr(signal, "SIGUSR1"):
+            signal.signal(signal.SIGUSR1, lambda *_: self.notify())
+
+    # ---------- Snapshot ----------
+    def _rebuild(self, rows: Rows, now: datetime) -> bool:
+        # Anything still due after a step (rate cap, claimed elsewhere, failed
+        # prefill) is retried after min_refresh rather than in a hot loop.
+        retry_at = time.time() + self.min_refresh
+        heap = []
+        parts = []
+        for r in rows:
+            if not _is_scheduled(r):
+                continue
+            dt = parse_time_utc(r.get("Scheduled_Time"))
+            if dt:
+                heap.append((max(dt.timestamp(), retry_at), int(r.get("_row_number") or 0)))
+                parts.append(f"{r.get('_row_number')}|{r.get('Scheduled_Time')}")
+        heapq.heapify(heap)
+        self._heap = heap
+
+        deadline = prefill_deadline(rows, now, self.prefill_hours)
+        self._prefill_at = max(deadline.timestamp(), retry_at) if deadline else None
+
+        signature = hashlib.sha1("\n".join(parts).encode("utf-8")).hexdigest()
+        changed = signature != self._signature
+        self._signature = signature
+        return changed
+
+    def _next_wake(self) -> float:
+        candidates = [self._next_refresh]
+        if self._heap:
+            candidates.append(self._heap[0][0])
+        if self._prefill_at is not None:
+            candidates.append(self._prefill_at)
+        return min(candidates)
+
+    # ---------- Loop ----------
+    def step(self) -> None:
+        """Refresh from the sheet, run whatever is due, and plan the next wake-up."""
+        ws, header, rows = self.load_rows()
+        now = _utc_now()
+        acted = False
+
+        due = find_due_scheduled(rows, now)
+        if due:
+            self.publish(ws, header, due)
+            acted = True
+        elif self._needs_prefill(rows, now):
+            self.prefill(ws, header, rows, now)
+            acted = True
+
+        if acted:
+            # Our own writes changed the sheet; take a fresh snapshot to plan from.
+            ws, header, rows = self.load_rows()
+            now = _utc_now()
+
+        changed = self._rebuild(rows, now)
+        if changed or acted:
+            self._refresh_interval = self.min_refresh
+        else:
+            self._refresh_interval = min(self._refresh_interval * 2, self.max_refresh)
+        self._next_refresh = time.time() + self._refresh_interval
+
+    def _needs_prefill(self, rows: Rows, now: datetime) -> bool:
+        deadline = prefill_deadline(rows, now, self.prefill_hours)
+        return deadline is not None and deadline <= now
+
+    def run_forever(self) -> None:
+        while True:
+            try:
+                self.step()
+            except Exception as e:
+                print("scheduler error:", str(e))
+                self._refresh_interval = min(self._refresh_interval * 2, self.max_refresh)
+                self._next_refresh = time.time() + self._refresh_interval
+
+            timeout = max(0.0, self._next_wake() - time.time())
+            self._wake.wait(timeout)
+            self._wake.clear()
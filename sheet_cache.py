@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from sqlite_db import SQLiteDB
+
+if TYPE_CHECKING:
+    import gspread
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHEET_CACHE_DB_PATH = os.environ.get("SHEET_CACHE_DB_PATH", "").strip() or os.path.join(
+    BASE_DIR, "sheet_cache.db"
+)
+# Drive metadata can trail an edit slightly, so snapshots are re-read at least this often.
+SHEET_CACHE_MAX_AGE_SECONDS = float(os.environ.get("SHEET_CACHE_MAX_AGE_SECONDS", "300") or "300")
+
+
+def drive_version(ws: gspread.Worksheet) -> Optional[str]:
+    """Spreadsheet revision from the Drive API (``version``, else ``modifiedTime``).
+
+    One small metadata request instead of downloading the sheet. Returns
+    None when Drive cannot be reached, which callers treat as "changed".
+    """
+    from gspread.urls import DRIVE_FILES_API_V3_URL
+
+    http = ws.client.http_client
+    try:
+        res = http.request(
+            "get",
+            f"{DRIVE_FILES_API_V3_URL}/{ws.spreadsheet_id}",
+            params={"fields": "version,modifiedTime", "supportsAllDrives": True},
+        )
+        meta = res.json()
+    except Exception:
+        try:
+            meta = http.get_file_drive_metadata(ws.spreadsheet_id)
+        except Exception:
+            return None
+    version = meta.get("version") or meta.get("modifiedTime")
+    return str(version) if version else None
+
+
+class SheetCache:
+    """Sheet read results keyed by spreadsheet revision, shared through SQLite.
+
+    ``get(ws, kind, loader)`` checks the Drive revision first and only calls
+    ``loader`` (the real Sheets read) when the revision moved, the entry is
+    older than ``max_age``, or nothing is cached. The webhook workers,
+    main.py and the dashboard can point at the same file, so one fresh
+    read serves all of them.
+    """
+
+    def __init__(
+        self,
+        db_path: str = SHEET_CACHE_DB_PATH,
+        *,
+        max_age: float = SHEET_CACHE_MAX_AGE_SECONDS,
+    ) -> None:
+        self.db_path = db_path
+        self.max_age = max_age
+        self._db = SQLiteDB(db_path)
+        # Decoded copies of what this process last saw, to skip JSON parsing on hits.
+        self._memo: Dict[Tuple[str, str], Tuple[str, float, Any]] = {}
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS sheet_snapshots (
+                sheet_key TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                version TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                payload TEXT NOT NULL,
+                PRIMARY KEY (sheet_key, kind)
+            )
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._db.conn()
+
+    @staticmethod
+    def sheet_key(ws: gspread.Worksheet) -> str:
+        return f"{ws.spreadsheet_id}:{ws.id}"
+
+    def _lookup(self, key: Tuple[str, str]) -> Optional[Tuple[str, float, Any]]:
+        row = self._conn().execute(
+            "SELECT version, fetched_at FROM sheet_snapshots WHERE sheet_key = ? AND kind = ?",
+            key,
+        ).fetchone()
+        if row is None:
+            return None
+        memo = self._memo.get(key)
+        if memo and memo[0] == row[0] and memo[1] == row[1]:
+            return memo
+        payload = self._conn().execute(
+            "SELECT payload FROM sheet_snapshots WHERE sheet_key = ? AND kind = ?", key
+        ).fetchone()
+        if payload is None:
+            return None
+        entry = (row[0], row[1], json.loads(payload[0]))
+        self._memo[key] = entry
+        return entry
+
+    def get(self, ws: gspread.Worksheet, kind: str, loader: Callable[[], Any]) -> Any:
+        key = (self.sheet_key(ws), kind)
+        # Read the revision before the data: an edit landing in between is
+        # stored under the older revision and simply re-read next time.
+        version = drive_version(ws)
+        cached = self._lookup(key)
+        if (
+            version
+            and cached
+            and cached[0] == version
+            and time.time() - cached[1] < self.max_age
+        ):
+            return cached[2]
+
+        data = loader()
+        if version:
+            fetched_at = time.time()
+            self._conn().execute(
+                "INSERT OR REPLACE INTO sheet_snapshots (sheet_key, kind, version, fetched_at, payload) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key[0], key[1], version, fetched_at, json.dumps(data, ensure_ascii=False)),
+            )
+            self._memo[key] = (version, fetched_at, data)
+        return data
+
+    def invalidate(self, ws: gspread.Worksheet) -> None:
+        sheet_key = self.sheet_key(ws)
+        self._conn().execute("DELETE FROM sheet_snapshots WHERE sheet_key = ?", (sheet_key,))
+        for key in [k for k in self._memo if k[0] == sheet_key]:
+            self._memo.pop(key, None)
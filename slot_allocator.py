@@ -0,0 +1,144 @@
+import os
+from datetime import datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from gsheets_cms import parse_time_utc
+
+
+HOURS_PER_WEEK = 168
+
+# Queue hours in UTC; when unset, the dashboard's active hours (Cairo time) apply.
+ACTIVE_HOURS = [int(x) for x in os.environ.get("ACTIVE_HOURS", "").split(",") if x.strip().isdigit()]
+# Dashboard default for "active_hours" (Cairo time).
+DEFAULT_ACTIVE_HOURS = [9, 11, 14, 17, 20, 22]
+
+
+@lru_cache(maxsize=32)
+def _weekly_tables(active_hours: Tuple[int, ...]) -> Tuple[Tuple[bool, ...], Tuple[int, ...]]:
+    """168-hour bitmap of allowed hours plus, per hour-of-week, the distance to the next allowed one."""
+    allowed = {h % 24 for h in active_hours}
+    bitmap = tuple((not allowed) or (how % 24) in allowed for how in range(HOURS_PER_WEEK))
+
+    # Walk backwards twice around the week so every hour sees the next allowed hour, wrapping.
+    next_offset = [0] * HOURS_PER_WEEK
+    distance = HOURS_PER_WEEK
+    for i in range(2 * HOURS_PER_WEEK - 1, -1, -1):
+        how = i % HOURS_PER_WEEK
+        distance = 0 if bitmap[how] else distance + 1
+        next_offset[how] = distance
+    return bitmap, tuple(next_offset)
+
+
+class SlotAllocator:
+    """Hands out one publishing slot per allowed hour.
+
+    Allowed hours come from a precomputed 168-hour weekly bitmap, so the
+    next allowed hour is a table lookup. Hours already holding a Scheduled
+    post are tracked in an occupancy index; runs of occupied hours are
+    skipped through path-compressed "next free" pointers, so repeated
+    queries stay (amortized) constant time.
+    """
+
+    def __init__(
+        self,
+        active_hours: Iterable[int],
+        *,
+        tz: tzinfo = timezone.utc,
+        buffer_minutes: int = 0,
+    ) -> None:
+        self.tz = tz
+        self.buffer = timedelta(minutes=max(buffer_minutes, 0))
+        hours = tuple(sorted({int(h) % 24 for h in active_hours}))
+        self._bitmap, self._next_offset = _weekly_tables(hours)
+        self._occupied: set = set()
+        self._skip: Dict[int, int] = {}
+
+    # Slots are whole hours since the epoch.
+    @staticmethod
+    def _slot_of(dt: datetime) -> int:
+        return int(dt.timestamp() // 3600)
+
+    def _hour_of_week(self, slot: int) -> int:
+        local = datetime.fromtimestamp(slot * 3600, self.tz)
+        return local.weekday() * 24 + local.hour
+
+    def _next_allowed(self, slot: int) -> int:
+        return slot + self._next_offset[self._hour_of_week(slot)]
+
+    def is_allowed(self, dt: datetime) -> bool:
+        return self._bitmap[self._hour_of_week(self._slot_of(dt))]
+
+    # ---------- Occupancy ----------
+    def occupy(self, dt: datetime) -> None:
+        self._occupied.add(self._slot_of(dt))
+
+    def occupy_rows(self, rows: Iterable[Dict[str, Any]]) -> "SlotAllocator":
+        for r in rows:
+            if str(r.get("Status", "")).strip().lower() not in {"scheduled", "publishing"}:
+                continue
+            dt = parse_time_utc(r.get("Scheduled_Time"))
+            if dt:
+                self.occupy(dt)
+        return self
+
+    def _find_free(self, slot: int) -> int:
+        """First allowed, unoccupied slot >= ``slot``."""
+        path = []
+        slot = self._next_allowed(slot)
+        while slot in self._occupied:
+            path.append(slot)
+            slot = self._skip.get(slot) or self._next_allowed(slot + 1)
+        for visited in path:
+            self._skip[visited] = slot
+        return slot
+
+    # ---------- Queries ----------
+    def next_free(self, now_utc: datetime) -> datetime:
+        """Earliest free slot after the buffer (the exact buffered time if its hour is free)."""
+        candidate = now_utc + self.buffer
+        first = self._slot_of(candidate)
+        slot = self._find_free(first)
+        if slot == first:
+            return candidate
+        return datetime.fromtimestamp(slot * 3600, timezone.utc)
+
+    def allocate(self, now_utc: datetime, count: int = 1, *, until: Optional[datetime] = None) -> List[datetime]:
+        """Reserve ``count`` consecutive free slots (e.g. for albums or batch prefill).
+
+        With ``until``, stops early at the first slot past it.
+        """
+        slots: List[datetime] = []
+        for _ in range(max(count, 0)):
+            dt = self.next_free_after(slots[-1]) if slots else self.next_free(now_utc)
+            if until is not None and dt > until:
+                break
+            self.occupy(dt)
+            slots.append(dt)
+        return slots
+
+    def next_free_after(self, dt: datetime) -> datetime:
+        slot = self._find_free(self._slot_of(dt) + 1)
+        return datetime.fromtimestamp(slot * 3600, timezone.utc)
+
+
+def queue_allocator(
+    rows: Iterable[Dict[str, Any]],
+    *,
+    buffer_minutes: int,
+    dashboard_hours: Optional[Iterable[int]] = None,
+) -> SlotAllocator:
+    """Allocator for the Buffer queue with the hours of ``rows`` already taken.
+
+    ACTIVE_HOURS (UTC) wins; otherwise ``dashboard_hours`` (Cairo time,
+    DEFAULT_ACTIVE_HOURS when None). Every writer of Scheduled rows uses
+    this so they agree on the allowed hours.
+    """
+    if ACTIVE_HOURS:
+        allocator = SlotAllocator(ACTIVE_HOURS, buffer_minutes=buffer_minutes)
+    else:
+        import pytz
+
+        hours = DEFAULT_ACTIVE_HOURS if dashboard_hours is None else dashboard_hours
+        allocator = SlotAllocator(hours, tz=pytz.timezone("Africa/Cairo"), buffer_minutes=buffer_minutes)
+    return allocator.occupy_rows(rows)
@@ -32,7 +32,7 @@ def main() -> None:
     importlib.reload(webhook)
 
     admin = os.environ.get("ADMIN_TOKEN", "")
-    client = webhook.app.test_client()
+    client = webhook.create_app().test_client()
     resp = client.get("/self-test", headers={"X-Admin-Token": admin})
 
     print("HTTP", resp.status_code)
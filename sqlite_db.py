@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional, Sequence
+
+
+# Page cache per connection, in KiB (SQLite takes negative cache_size as KiB).
+SQLITE_CACHE_SIZE_KIB = int(os.environ.get("SQLITE_CACHE_SIZE_KIB", "8192") or "8192")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "10000") or "10000")
+# Prepared statements kept per connection; connections live as long as their thread.
+_STATEMENT_CACHE = 256
+
+
+class SQLiteDB:
+    """One SQLite file shared by many threads and worker processes.
+
+    Each thread keeps its own long-lived connection (re-opened after a fork),
+    so the connect cost and statement preparation are paid once instead of
+    per call. Connections run in autocommit mode with WAL, NORMAL sync and a
+    busy timeout; multi-statement writes go through ``transaction()``.
+    Callers must not close the connections they get from ``conn()``.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._local = threading.local()
+
+    def conn(self) -> sqlite3.Connection:
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != pid:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=_STATEMENT_CACHE,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{max(SQLITE_CACHE_SIZE_KIB, 0)}")
+            conn.execute(f"PRAGMA busy_timeout={max(SQLITE_BUSY_TIMEOUT_MS, 0)}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate: bool = True) -> Iterator[sqlite3.Connection]:
+        """``BEGIN IMMEDIATE`` (write lock up front) ... COMMIT, or ROLLBACK on error."""
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> sqlite3.Cursor:
+        return self.conn().execute(sql, params)
+
+    def query_one(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        return self.conn().execute(sql, params).fetchone()
+
+    def query_all(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        return self.conn().execute(sql, params).fetchall()
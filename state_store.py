@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from sqlite_db import SQLiteDB
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# "sqlite" is shared by every gunicorn worker on the host; "memory" is per-process.
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite").strip().lower() or "sqlite"
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "").strip() or os.path.join(BASE_DIR, "state.db")
+
+# Expired keys are removed lazily on read and swept every N writes.
+_SWEEP_EVERY = 200
+
+
+class StateStore(ABC):
+    """TTL key-value store for state that must be shared between workers.
+
+    Values are JSON-serialisable. Storing ``None`` deletes the key, so
+    ``compare_and_set(key, None, value)`` means "set only if absent".
+    """
+
+    @abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def pop(self, key: str, default: Any = None) -> Any:
+        ...
+
+    @abstractmethod
+    def compare_and_set(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        ...
+
+    def update(
+        self, key: str, fn: Callable[[Any], Any], ttl: Optional[float] = None, *, retries: int = 20
+    ) -> Any:
+        """Atomically replace the value with ``fn(current)`` using a CAS loop."""
+        for _ in range(retries):
+            current = self.get(key)
+            new_value = fn(current)
+            if self.compare_and_set(key, current, new_value, ttl=ttl):
+                return new_value
+        raise RuntimeError(f"State update for {key!r} kept conflicting")
+
+
+def _encode(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[float]:
+    return time.time() + ttl if ttl else None
+
+
+class MemoryStateStore(StateStore):
+    """In-process backend (single worker / local runs)."""
+
+    def __init__(self) -> None:
+        self._data: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._lock = threading.Lock()
+
+    def _read(self, key: str) -> Optional[str]:
+        hit = self._data.get(key)
+        if hit is None:
+            return None
+        raw, expires = hit
+        if expires is not None and expires <= time.time():
+            del self._data[key]
+            return None
+        return raw
+
+    def _write(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        if value is None:
+            self._data.pop(key, None)
+        else:
+            self._data[key] = (_encode(value), _expires_at(ttl))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            raw = self._read(key)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            self._write(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            raw = self._read(key)
+            self._data.pop(key, None)
+        return default if raw is None else json.loads(raw)
+
+    def compare_and_set(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            raw = self._read(key)
+            current = None if raw is None else json.loads(raw)
+            if current != expected:
+                return False
+            self._write(key, value, ttl)
+            return True
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        with self._lock:
+            raw = self._read(key)
+            expires = self._data[key][1] if raw is not None else None
+            value = int(json.loads(raw) if raw is not None else 0) + amount
+            self._data[key] = (_encode(value), _expires_at(ttl) if ttl else expires)
+            return value
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite (WAL) backend shared by all processes that use the same file."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self._db = SQLiteDB(db_path)
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # Autocommit; multi-statement operations run inside _atomic.
+        return self._db.conn()
+
+    def _read(self, conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, conn: sqlite3.Connection, key: str, value: Any, ttl: Optional[float]) -> None:
+        if value is None:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, _encode(value), _expires_at(ttl)),
+            )
+        self._writes += 1
+        if self._writes % _SWEEP_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def _atomic(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._db.transaction() as conn:
+            return fn(conn)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        raw = self._read(self._conn(), key)
+        return default if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._write(self._conn(), key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def pop(self, key: str, default: Any = None) -> Any:
+        def _pop(conn: sqlite3.Connection) -> Optional[str]:
+            raw = self._read(conn, key)
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            return raw
+
+        raw = self._atomic(_pop)
+        return default if raw is None else json.loads(raw)
+
+    def compare_and_set(self, key: str, expected: Any, value: Any, ttl: Optional[float] = None) -> bool:
+        def _cas(conn: sqlite3.Connection) -> bool:
+            raw = self._read(conn, key)
+            current = None if raw is None else json.loads(raw)
+            if current != expected:
+                return False
+            self._write(conn, key, value, ttl)
+            return True
+
+        return self._atomic(_cas)
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        def _incr(conn: sqlite3.Connection) -> int:
+            raw = self._read(conn, key)
+            value = int(json.loads(raw) if raw is not None else 0) + amount
+            if ttl:
+                expires = _expires_at(ttl)
+            elif raw is not None:
+                expires = conn.execute("SELECT expires_at FROM kv WHERE key = ?", (key,)).fetchone()[0]
+            else:
+                expires = None
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, _encode(value), expires),
+            )
+            return value
+
+        return self._atomic(_incr)
+
+
+def make_state_store(backend: str = STATE_BACKEND, db_path: str = STATE_DB_PATH) -> StateStore:
+    if backend == "memory":
+        return MemoryStateStore()
+    if backend == "sqlite":
+        return SQLiteStateStore(db_path)
+    raise RuntimeError(f"Unknown STATE_BACKEND: {backend}")
@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from sqlite_db import SQLiteDB
+
+
+# Upper bound for caching an active subscription (the expiry itself is the other bound).
+SUBSCRIPTION_CACHE_TTL_SECONDS = float(os.environ.get("SUBSCRIPTION_CACHE_TTL_SECONDS", "300") or "300")
+# Inactive results are kept briefly: a voucher redeemed on another worker only
+# invalidates that worker's cache.
+SUBSCRIPTION_NEGATIVE_TTL_SECONDS = float(os.environ.get("SUBSCRIPTION_NEGATIVE_TTL_SECONDS", "30") or "30")
+SUBSCRIPTION_CACHE_MAX_ENTRIES = 10_000
+
+
+def _expiry_timestamp(subscription_end: Optional[str]) -> Optional[float]:
+    # Stored as naive UTC ISO strings (datetime.utcnow().isoformat()).
+    if not subscription_end:
+        return None
+    try:
+        dt = datetime.fromisoformat(subscription_end)
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class SubscriptionService:
+    """Subscription lookups with an in-memory cache bounded by the expiry time.
+
+    One primary-key query returns the expiry and the active flag is derived
+    from it. Active entries never outlive the expiry, so a lapsed
+    subscription is seen immediately. Call ``invalidate`` after any write to
+    a user row.
+    """
+
+    def __init__(
+        self,
+        db: SQLiteDB,
+        *,
+        ttl: float = SUBSCRIPTION_CACHE_TTL_SECONDS,
+        negative_ttl: float = SUBSCRIPTION_NEGATIVE_TTL_SECONDS,
+    ) -> None:
+        self.db = db
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # user_id -> (cache_until, subscription_end, expiry_ts)
+        self._cache: "OrderedDict[str, Tuple[float, Optional[str], Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def status(self, user_id: str) -> Tuple[bool, Optional[str]]:
+        """(active, subscription_end) for ``user_id``."""
+        now = time.time()
+        with self._lock:
+            hit = self._cache.get(user_id)
+            if hit is not None and hit[0] > now:
+                self._cache.move_to_end(user_id)
+                _, subscription_end, expiry_ts = hit
+                return expiry_ts is not None and expiry_ts > now, subscription_end
+
+        row = self.db.query_one("SELECT subscription_end FROM users WHERE user_id = ?", (user_id,))
+        subscription_end = row[0] if row and row[0] else None
+        expiry_ts = _expiry_timestamp(subscription_end)
+        active = expiry_ts is not None and expiry_ts > now
+        if active:
+            cache_until = min(now + self.ttl, expiry_ts)
+        else:
+            cache_until = now + self.negative_ttl
+
+        with self._lock:
+            self._cache[user_id] = (cache_until, subscription_end, expiry_ts)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > SUBSCRIPTION_CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+        return active, subscription_end
+
+    def is_active(self, user_id: str) -> bool:
+        return self.status(user_id)[0]
+
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._cache.pop(user_id, None)
@@ -1,22 +1,38 @@
+import asyncio
 import base64
 import os
+import time
 from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from typing import Any, Dict
 
 import requests
 from groq import Groq
 from telegram import Update
 from telegram.ext import Application, ContextTypes, MessageHandler, filters
 
+from album_ingest import (
+    ALBUM_BRIEF,
+    ALBUM_MAX_WAIT_SECONDS,
+    ALBUM_WINDOW_SECONDS,
+    album_rows,
+    caption_album,
+    clean_caption,
+    upload_all,
+)
 from gsheets_cms import (
     SheetConfig,
     append_row,
+    append_rows,
     ensure_headers,
     load_service_account_info_from_env,
     make_gspread_client,
+    list_records_projected,
     open_worksheet,
     utc_now_iso,
 )
+from slot_allocator import queue_allocator
+from state_store import make_state_store
 
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "").strip()
@@ -49,9 +65,16 @@ def _upload_to_imgbb(image_bytes: bytes) -> str:
     return str((data.get("data") or {}).get("url") or "").strip()
 
 
+_CAPTION_FALLBACK = "🥋 جاهزين للتمرين؟ احجز مكانك دلوقتي! 📞"
+# Shared with the webhook for the dashboard settings (active hours).
+_STATE = make_state_store()
+# media_group_id -> {"items": [(message_id, photo, caption), ...], "first"/"last": monotonic times}
+_ALBUMS: Dict[str, Dict[str, Any]] = {}
+
+
 def _generate_ai_caption(image_url: str) -> str:
     if not GROQ_API_KEY:
-        return "🥋 جاهزين للتمرين؟ احجز مكانك دلوقتي! 📞"
+        return _CAPTION_FALLBACK
 
     client = Groq(api_key=GROQ_API_KEY)
     prompt = (
@@ -67,7 +90,7 @@ def _generate_ai_caption(image_url: str) -> str:
         max_tokens=250,
         temperature=0.8,
     )
-    return (res.choices[0].message.content or "").strip()
+    return clean_caption(res.choices[0].message.content or "")
 
 
 def _get_sheet():
@@ -85,6 +108,80 @@ def _get_sheet():
     return ws, header
 
 
+async def _download_photo(photo) -> bytes:
+    tg_file = await photo.get_file()
+    bio = BytesIO()
+    await tg_file.download_to_memory(out=bio)
+    return bio.getvalue()
+
+
+async def handle_album_photo(update: Update) -> None:
+    """Group album updates by media_group_id and ingest the whole album at once.
+
+    The first update of a group waits until no photo arrived for
+    ALBUM_WINDOW_SECONDS (at most ALBUM_MAX_WAIT_SECONDS). It then downloads
+    and uploads all photos in parallel, writes every caption with one LLM call
+    and appends all rows in one write. Failed photos are reported and skipped.
+    """
+    message = update.message
+    group_id = str(message.media_group_id)
+    item = (message.message_id, message.photo[-1], message.caption or "")
+    album = _ALBUMS.get(group_id)
+    if album is not None:
+        album["items"].append(item)
+        album["last"] = time.monotonic()
+        return
+
+    started = time.monotonic()
+    album = _ALBUMS[group_id] = {"items": [item], "first": started, "last": started}
+    await message.reply_text("📥 استلمت الألبوم… جاري الرفع وتجهيز الكابشنز ✨")
+    while True:
+        quiet_at = album["last"] + ALBUM_WINDOW_SECONDS
+        wait = min(quiet_at, album["first"] + ALBUM_MAX_WAIT_SECONDS) - time.monotonic()
+        if wait <= 0:
+            break
+        await asyncio.sleep(wait)
+    _ALBUMS.pop(group_id, None)
+    # concurrent_updates can hand the updates over out of order; keep the album order.
+    items = sorted(album["items"], key=lambda i: i[0])
+
+    try:
+        downloads = await asyncio.gather(
+            *(_download_photo(photo) for _, photo, _ in items), return_exceptions=True
+        )
+        blobs = [d for d in downloads if not isinstance(d, BaseException)]
+        image_urls, errors = await asyncio.to_thread(upload_all, blobs, _upload_to_imgbb)
+        errors = [str(d) for d in downloads if isinstance(d, BaseException)] + errors
+        if not image_urls:
+            raise RuntimeError(errors[0] if errors else "album upload failed")
+
+        groq = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+        note = " ".join(n for _, _, n in items if n).strip()
+        captions = await asyncio.to_thread(
+            caption_album, groq, image_urls, ALBUM_BRIEF, _CAPTION_FALLBACK, note=note
+        )
+        ws, header = await asyncio.to_thread(_get_sheet)
+        queued = await asyncio.to_thread(list_records_projected, ws, header)
+        # One free active hour per photo, after the posts already scheduled.
+        allocator = queue_allocator(
+            queued,
+            buffer_minutes=BUFFER_MINUTES,
+            dashboard_hours=(_STATE.get("bot_config") or {}).get("active_hours"),
+        )
+        slots = allocator.allocate(datetime.now(timezone.utc).replace(microsecond=0), len(image_urls))
+        rows = album_rows(image_urls, captions, slots)
+        await asyncio.to_thread(append_rows, ws, header, rows)
+
+        lines = [f"✅ Saved {len(rows)} posts to queue.", ""]
+        lines += [f"⏰ {row['Scheduled_Time']}" for row in rows]
+        if errors:
+            lines.append(f"⚠️ {len(errors)} photos failed: {errors[0]}")
+        await message.reply_text("\n".join(lines))
+
+    except Exception as e:
+        await message.reply_text(f"❌ Error: {str(e)}")
+
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not update.message or not update.message.photo:
         return
@@ -93,14 +190,13 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if TELEGRAM_ADMIN_ID and user_id != TELEGRAM_ADMIN_ID:
         return
 
-    await update.message.reply_text("📥 استلمت الصورة… جاري الرفع وتجهيز الكابشن ✨")
+    if update.message.media_group_id:
+        await handle_album_photo(update)
+        return
 
-    photo = update.message.photo[-1]
-    tg_file = await photo.get_file()
+    await update.message.reply_text("📥 استلمت الصورة… جاري الرفع وتجهيز الكابشن ✨")
 
-    bio = BytesIO()
-    await tg_file.download_to_memory(out=bio)
-    image_bytes = bio.getvalue()
+    image_bytes = await _download_photo(update.message.photo[-1])
 
     try:
         image_url = _upload_to_imgbb(image_bytes)
@@ -135,7 +231,8 @@ def main() -> None:
     if not TELEGRAM_BOT_TOKEN:
         raise SystemExit("TELEGRAM_BOT_TOKEN is missing")
 
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Concurrent updates: an album's first update waits for the rest of the group.
+    app = Application.builder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(True).build()
     app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     app.run_polling(allowed_updates=Update.ALL_TYPES)
 
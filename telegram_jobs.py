@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlite_db import SQLiteDB
+
+
+# Background threads per process for Telegram uploads (download, ImgBB, Groq, Sheets, Facebook).
+TELEGRAM_JOB_WORKERS = int(os.environ.get("TELEGRAM_JOB_WORKERS", "4") or "4")
+# A running job not updated for this long belonged to a worker that died (video uploads included).
+TELEGRAM_JOB_STALE_SECONDS = int(os.environ.get("TELEGRAM_JOB_STALE_SECONDS", "1800") or "1800")
+# Queued jobs this old were accepted by a process that died before starting them.
+_ORPHAN_QUEUED_SECONDS = 60
+_JOB_RETENTION_SECONDS = 14 * 24 * 3600
+
+# fn(payload, progress) -> final chat message (or None)
+JobHandler = Callable[[Dict[str, Any], Callable[[str], None]], Optional[str]]
+
+
+class JobDeferred(Exception):
+    """Raised by a handler that is not ready yet: the job runs again after ``delay`` seconds.
+
+    The job goes back to queued and no worker thread is held while it waits.
+    """
+
+    def __init__(self, delay: float) -> None:
+        super().__init__(f"deferred for {delay:.1f}s")
+        self.delay = delay
+
+
+class TelegramJobQueue:
+    """Telegram uploads run off the request thread, recorded in saas.db.
+
+    ``submit`` stores the job and returns at once, so the webhook can ack
+    Telegram before any download or upload starts. The update_id is unique,
+    so a retried delivery does not create a second job. Handlers report each
+    finished stage through ``progress``, which updates the job row and messages the chat.
+    """
+
+    def __init__(
+        self,
+        db: SQLiteDB,
+        notify: Callable[[int, str], None],
+        *,
+        workers: int = TELEGRAM_JOB_WORKERS,
+    ) -> None:
+        self.db = db
+        self.notify = notify
+        self.workers = max(workers, 1)
+        self._handlers: Dict[str, JobHandler] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def init_db(self) -> None:
+        """Create the jobs table; call once before submitting or recovering."""
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS telegram_jobs (
+                job_id TEXT PRIMARY KEY,
+                update_id INTEGER UNIQUE,
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_telegram_jobs_status ON telegram_jobs (status, updated_at)"
+        )
+
+    def handler(self, kind: str) -> Callable[[JobHandler], JobHandler]:
+        def register(fn: JobHandler) -> JobHandler:
+            self._handlers[kind] = fn
+            return fn
+
+        return register
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # Built lazily (and again after a fork) so gunicorn workers get their own threads.
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="tg-job"
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def submit(
+        self,
+        kind: str,
+        chat_id: int,
+        payload: Dict[str, Any],
+        *,
+        update_id: Optional[int] = None,
+        delay: float = 0,
+    ) -> Optional[str]:
+        """Record and schedule a job (after ``delay`` seconds); None when this update_id was already accepted."""
+        if kind not in self._handlers:
+            raise RuntimeError(f"No Telegram job handler for {kind!r}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO telegram_jobs "
+            "(job_id, update_id, chat_id, kind, payload, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+            (job_id, update_id, int(chat_id), kind, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+        if cur.rowcount != 1:
+            return None
+        self._schedule(job_id, delay)
+        return job_id
+
+    def _schedule(self, job_id: str, delay: float) -> None:
+        if delay <= 0:
+            self._pool().submit(self._run, job_id)
+            return
+        timer = threading.Timer(delay, lambda: self._pool().submit(self._run, job_id))
+        timer.daemon = True
+        timer.start()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self.db.query_one(
+            "SELECT job_id, update_id, chat_id, kind, status, stage, result, error, created_at, updated_at "
+            "FROM telegram_jobs WHERE job_id = ?",
+            (job_id,),
+        )
+        if row is None:
+            return None
+        keys = ("job_id", "update_id", "chat_id", "kind", "status", "stage", "result", "error", "created_at", "updated_at")
+        return dict(zip(keys, row))
+
+    def _set(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        self.db.execute(f"UPDATE telegram_jobs SET {cols} WHERE job_id = ?", (*fields.values(), job_id))
+
+    def _run(self, job_id: str) -> None:
+        # Claim first: recover() in another worker may have picked the same queued job.
+        cur = self.db.execute(
+            "UPDATE telegram_jobs SET status = 'running', updated_at = ? WHERE job_id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+        if cur.rowcount != 1:
+            return
+        row = self.db.query_one("SELECT chat_id, kind, payload FROM telegram_jobs WHERE job_id = ?", (job_id,))
+        chat_id, kind, payload = int(row[0]), row[1], json.loads(row[2])
+
+        def progress(stage: str) -> None:
+            self._set(job_id, stage=stage)
+            self.notify(chat_id, stage)
+
+        try:
+            result = self._handlers[kind](payload, progress)
+        except JobDeferred as deferred:
+            self._set(job_id, status="queued")
+            self._schedule(job_id, deferred.delay)
+            return
+        except Exception as e:
+            self._set(job_id, status="failed", error=str(e))
+            self.notify(chat_id, f"❌ Error: {str(e)}")
+            return
+        self._set(job_id, status="done", result=result)
+        if result:
+            self.notify(chat_id, result)
+
+    def recover(self) -> List[str]:
+        """Start queued jobs orphaned by a dead worker; report stale running ones as interrupted.
+
+        Running jobs are not retried, since the upload or post may already have happened.
+        """
+        now = time.time()
+        stale = self.db.query_all(
+            "SELECT job_id, chat_id, stage FROM telegram_jobs WHERE status = 'running' AND updated_at < ?",
+            (now - TELEGRAM_JOB_STALE_SECONDS,),
+        )
+        for job_id, chat_id, stage in stale:
+            cur = self.db.execute(
+                "UPDATE telegram_jobs SET status = 'interrupted', updated_at = ? "
+                "WHERE job_id = ? AND status = 'running'",
+                (now, job_id),
+            )
+            if cur.rowcount == 1:
+                self.notify(int(chat_id), f"⚠️ المهمة اتقطعت عند: {stage or 'البداية'}. ابعت المحتوى تاني.")
+
+        queued = [
+            r[0]
+            for r in self.db.query_all(
+                "SELECT job_id FROM telegram_jobs WHERE status = 'queued' AND created_at < ?",
+                (now - _ORPHAN_QUEUED_SECONDS,),
+            )
+        ]
+        for job_id in queued:
+            self._pool().submit(self._run, job_id)
+
+        self.db.execute(
+            "DELETE FROM telegram_jobs WHERE status IN ('done', 'failed', 'interrupted') AND updated_at < ?",
+            (now - _JOB_RETENTION_SECONDS,),
+        )
+        return queued
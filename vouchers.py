@@ -0,0 +1,116 @@
+import secrets
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlite_db import SQLiteDB
+
+
+# No 0/O, 1/I/L: codes are typed by hand.
+VOUCHER_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+VOUCHER_CODE_LENGTH = 12
+
+# Bytes >= _REJECT_FROM are dropped so every alphabet symbol is equally likely
+# (256 is not a multiple of the alphabet size).
+_REJECT_FROM = 256 - 256 % len(VOUCHER_ALPHABET)
+_REJECTED = bytes(range(_REJECT_FROM, 256))
+_TABLE = bytes(
+    ord(VOUCHER_ALPHABET[b % len(VOUCHER_ALPHABET)]) if b < _REJECT_FROM else 0 for b in range(256)
+)
+
+# Stored subscription_end format; fixed width, so string order is time order.
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+# Rounds of top-up when fresh codes collide with stored ones (practically never).
+_MAX_ROUNDS = 5
+
+
+def generate_codes(count: int, length: int = VOUCHER_CODE_LENGTH) -> List[str]:
+    """``count`` distinct random codes from the OS CSPRNG.
+
+    Random bytes are mapped onto the alphabet in one ``bytes.translate``
+    pass (rejected bytes deleted in the same call) and then sliced into codes.
+    """
+    codes: dict = {}
+    while len(codes) < count:
+        need = (count - len(codes)) * length
+        # Over-draw by the rejection rate plus a little slack.
+        raw = secrets.token_bytes(need * 256 // _REJECT_FROM + 16)
+        chars = raw.translate(_TABLE, _REJECTED).decode("ascii")
+        for i in range(0, len(chars) - length + 1, length):
+            codes.setdefault(chars[i : i + length], None)
+            if len(codes) >= count:
+                break
+    return list(codes)
+
+
+def create_vouchers(db: SQLiteDB, count: int, duration_days: int) -> List[str]:
+    """Insert ``count`` new vouchers in one transaction and return exactly the stored codes.
+
+    Candidates go into a temp table with ``executemany``; ones that already
+    exist in ``vouchers`` are dropped there, and the rest are copied over
+    with a single INSERT ... SELECT.
+    """
+    if count <= 0:
+        return []
+    now = datetime.utcnow().isoformat()
+    stored: List[str] = []
+    with db.transaction() as conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_vouchers (code TEXT PRIMARY KEY)")
+        for _ in range(_MAX_ROUNDS):
+            missing = count - len(stored)
+            if missing <= 0:
+                break
+            conn.execute("DELETE FROM new_vouchers")
+            conn.executemany(
+                "INSERT OR IGNORE INTO new_vouchers (code) VALUES (?)",
+                ((code,) for code in generate_codes(missing)),
+            )
+            conn.execute("DELETE FROM new_vouchers WHERE code IN (SELECT code FROM vouchers)")
+            conn.execute(
+                "INSERT INTO vouchers (code, duration_days, created_at) "
+                "SELECT code, ?, ? FROM new_vouchers",
+                (duration_days, now),
+            )
+            stored.extend(row[0] for row in conn.execute("SELECT code FROM new_vouchers"))
+        conn.execute("DELETE FROM new_vouchers")
+    return stored
+
+
+def redeem_voucher(db: SQLiteDB, user_id: str, code: str) -> Tuple[str, Optional[str]]:
+    """Redeem ``code`` for ``user_id`` in one ``BEGIN IMMEDIATE`` transaction.
+
+    Returns ``("activated", subscription_end)``, ``("used", None)`` or
+    ``("invalid", None)``. The guarded UPDATE claims the voucher, so of two
+    concurrent redemptions exactly one succeeds. The subscription is then
+    extended from the later of now and the current expiry.
+    """
+    now = datetime.utcnow().strftime(_TIME_FORMAT)
+    with db.transaction() as conn:
+        claimed = conn.execute(
+            "UPDATE vouchers SET is_used = 1, used_by = ?, used_at = ? "
+            "WHERE code = ? AND is_used = 0 RETURNING duration_days",
+            (user_id, now, code),
+        ).fetchall()
+        if not claimed:
+            exists = conn.execute("SELECT 1 FROM vouchers WHERE code = ?", (code,)).fetchone()
+            return ("used" if exists else "invalid"), None
+
+        end = conn.execute(
+            """
+            INSERT INTO users (user_id, subscription_end, created_at)
+            VALUES (:user_id, strftime(:fmt, :now, :shift), :now)
+            ON CONFLICT(user_id) DO UPDATE SET subscription_end = strftime(
+                :fmt,
+                MAX(:now, COALESCE(strftime(:fmt, users.subscription_end), :now)),
+                :shift
+            )
+            RETURNING subscription_end
+            """,
+            {
+                "user_id": user_id,
+                "fmt": _TIME_FORMAT,
+                "now": now,
+                "shift": f"+{int(claimed[0][0])} days",
+            },
+        ).fetchall()
+    return "activated", end[0][0]
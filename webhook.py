@@ -1,33 +1,75 @@
-from flask import Flask, request, jsonify, Response
+from flask import Blueprint, Flask, Response, current_app, jsonify, request
 import base64
 import os
 import random
-import sqlite3
+import threading
 import urllib.parse
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-from groq import Groq
 import requests
-import feedparser
-from bs4 import BeautifulSoup
-import pytz
 
+from album_ingest import (
+    ALBUM_BRIEF,
+    ALBUM_WINDOW_SECONDS,
+    album_quiet_in,
+    album_rows,
+    caption_album,
+    clean_caption,
+    collect_album_item,
+    take_album,
+    upload_all,
+)
+from archiver import archive_once
+from batch_prefill import PREFILL_BRIEF, PREFILL_FALLBACK, generate_batch, run_batch_prefill
+from feed_harvester import FEED_DB_PATH, FeedHarvester
+from page_meta import extract_og_image
+from publish_lock import SAAS_DB_PATH, PublishLock, make_owner_id
+from publisher import PUBLISH_MAX_PER_TICK, publish_due_batch, publish_now, reap_stuck_rows
+from saas_stats import StatsCache, ensure_indexes
+from sheet_cache import SheetCache
+from slot_allocator import DEFAULT_ACTIVE_HOURS, SlotAllocator, queue_allocator
+from sqlite_db import SQLiteDB
+from state_store import StateStore, make_state_store
+from subscriptions import SubscriptionService
+from telegram_jobs import JobDeferred, TelegramJobQueue
+from vouchers import create_vouchers, redeem_voucher
 from gsheets_cms import (
+    ID_COLUMN,
+    RowIndex,
     SheetConfig,
-    append_row,
+    append_rows,
+    delete_row,
     ensure_headers,
     find_due_scheduled,
     has_scheduled_within,
+    list_records_projected,
     list_rows,
     load_service_account_info_from_env,
     make_gspread_client,
     open_worksheet,
+    resolve_row,
     update_fields,
     utc_now_iso,
 )
 
-app = Flask(__name__)
+# Routes grouped by role; create_app() registers only the selected groups so
+# Messenger and media/cron traffic can run as separate services.
+core_bp = Blueprint("core", __name__)  # landing, health, status (always on)
+fb_bp = Blueprint("fb", __name__)
+telegram_bp = Blueprint("telegram", __name__)
+cms_bp = Blueprint("cms", __name__)
+saas_bp = Blueprint("saas", __name__)
+scheduler_bp = Blueprint("scheduler", __name__)
+BLUEPRINTS = {
+    "fb": fb_bp,
+    "telegram": telegram_bp,
+    "cms": cms_bp,
+    "saas": saas_bp,
+    "scheduler": scheduler_bp,
+}
+# Comma-separated BLUEPRINTS keys for this process, or "all" (e.g. "fb" / "telegram,cms,scheduler")
+WEBHOOK_BLUEPRINTS = os.environ.get("WEBHOOK_BLUEPRINTS", "all").strip() or "all"
 
 # API Keys from environment
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY_4")
@@ -49,6 +91,15 @@ FB_REPLY_MESSAGES = os.environ.get("FB_REPLY_MESSAGES", "1").strip().lower() in
     "yes",
 }
 
+# Background RSS harvester (feeds are polled off the request path)
+FEED_HARVESTER_ENABLED = os.environ.get(
+    "FEED_HARVESTER_ENABLED", "1"
+).strip().lower() in {
+    "1",
+    "true",
+    "yes",
+}
+
 # Google Sheets CMS
 GOOGLE_SHEET_ID = os.environ.get("GOOGLE_SHEET_ID", "").strip()
 GOOGLE_SHEET_WORKSHEET = (
@@ -67,18 +118,19 @@ TELEGRAM_PUBLISH_PASSPHRASE = os.environ.get(
 BUFFER_MINUTES = int(os.environ.get("BUFFER_MINUTES", "30") or "30")
 PREFILL_HOURS = int(os.environ.get("PREFILL_HOURS", "6") or "6")
 
-ACTIVE_HOURS_RAW = os.environ.get("ACTIVE_HOURS", "").strip()
-if ACTIVE_HOURS_RAW:
-    ACTIVE_HOURS = [int(x) for x in ACTIVE_HOURS_RAW.split(",") if x.strip().isdigit()]
-else:
-    ACTIVE_HOURS = []
-
 _GS_CLIENT = None
 _GS_WS = None
 _GS_HEADER = None
+# ID -> رقم الصف (يتحدّث محلياً عند الحذف بدل إعادة قراءة الشيت)
+_ROW_INDEX = RowIndex()
+# لقطات الشيت حسب رقم المراجعة في Drive (مشتركة بين العمال وmain.py على نفس الجهاز)
+_SHEET_CACHE: Optional[SheetCache] = None
 
-_TELEGRAM_AUTH_UNTIL: Dict[int, datetime] = {}
-_PENDING_VIDEO: Dict[int, Dict[str, str]] = {}
+# Shared state (auth windows, pending videos, rate limits, dedup keys, config).
+# Backed by SQLite by default so every gunicorn worker sees the same values.
+_STATE: Optional[StateStore] = None
+
+_PENDING_VIDEO_TTL_SECONDS = 24 * 3600
 
 _CONTENT_TYPES = [
     "education_tip",  # تعليمي
@@ -90,11 +142,10 @@ _CONTENT_TYPES = [
     "kids_advice",  # أولياء الأمور
     "training_drill",  # فني/تدريبي
 ]
-_CONTENT_TYPE_INDEX = 0
 
-# بسيط ومفيد ضد التخمين (in-memory). مناسب لـ Render single instance.
-_GEN_FAILS = {}
-_GEN_BLOCKED_UNTIL = {}
+# بسيط ومفيد ضد التخمين. العدادات في _STATE فبتشتغل مع أكتر من worker.
+_GEN_FAIL_WINDOW_SECONDS = 600
+_GEN_BLOCK_SECONDS = 1800
 
 
 def _landing_html(dashboard_url: str) -> str:
@@ -192,18 +243,18 @@ def _landing_html(dashboard_url: str) -> str:
 </html>"""
 
 
-@app.route("/", methods=["GET"])
+@core_bp.route("/", methods=["GET"])
 def landing_page():
     dashboard_url = os.environ.get("DASHBOARD_URL") or "https://october.streamlit.app/"
     return Response(_landing_html(dashboard_url), mimetype="text/html")
 
 
-@app.route("/health", methods=["GET"])
+@core_bp.route("/health", methods=["GET"])
 def health():
     return jsonify({"status": "ok", "service": "academy-webhook"})
 
 
-@app.route("/self-test", methods=["GET"])
+@core_bp.route("/self-test", methods=["GET"])
 def self_test():
     """Safe smoke test (no posting).
 
@@ -362,6 +413,28 @@ def _get_sheet():
     return ws, header
 
 
+def _sheet_written(ws) -> None:
+    # رقم المراجعة في Drive ممكن يتأخر بعد كتابتنا، فنمسح اللقطة بدل ما نقرأ قديم
+    if _SHEET_CACHE is not None:
+        _SHEET_CACHE.invalidate(ws)
+
+
+def _indexed(rows: List[Dict[str, Any]], numbers: List[int]) -> None:
+    # الصفوف الجديدة تدخل الـ index علطول، فأول /post <id> ليها ما يعيدش قراية عمود الـ ID
+    for row, number in zip(rows, numbers):
+        row_id = str(row.get(ID_COLUMN) or "").strip()
+        if row_id and number:
+            _ROW_INDEX.on_append(row_id, number)
+
+
+def _append_queue_rows(ws, header, rows: List[Dict[str, Any]]) -> List[int]:
+    """append_rows, then keep _ROW_INDEX and the sheet cache in step."""
+    numbers = append_rows(ws, header, rows)
+    _indexed(rows, numbers)
+    _sheet_written(ws)
+    return numbers
+
+
 def _pollinations_url(prompt_en: str) -> str:
     encoded = urllib.parse.quote(str(prompt_en or "").strip(), safe="")
     params = urllib.parse.urlencode(
@@ -377,6 +450,7 @@ def _pollinations_url(prompt_en: str) -> str:
 
 
 def _generate_image_prompt_en() -> str:
+    client = _groq_client()
     if not client:
         return (
             "Anime-style illustration of kids martial arts training in Cairo gym,"
@@ -398,6 +472,7 @@ def _generate_image_prompt_en() -> str:
 
 
 def _generate_image_prompt_from_text(ar_text: str) -> str:
+    client = _groq_client()
     if not client:
         return (
             "Anime-style illustration of kids martial arts training in Cairo gym, "
@@ -420,6 +495,7 @@ def _generate_image_prompt_from_text(ar_text: str) -> str:
 
 
 def _generate_ar_caption_from_prompt(prompt_en: str) -> str:
+    client = _groq_client()
     if not client:
         return "🥋 تدريب النهارده نار! جاهزين تبدأوا؟ احجز مكانك دلوقتي 💪📞"
     prompt = (
@@ -437,19 +513,14 @@ def _generate_ar_caption_from_prompt(prompt_en: str) -> str:
         max_tokens=250,
         temperature=0.85,
     )
-    return _clean_caption_text(res.choices[0].message.content or "")
+    return clean_caption(res.choices[0].message.content or "")
 
 
-def _next_available_slot(now_utc: datetime) -> datetime:
-    candidate = now_utc + timedelta(minutes=max(BUFFER_MINUTES, 0))
-    if not ACTIVE_HOURS:
-        return candidate
-
-    for _ in range(0, 72):
-        if candidate.hour in ACTIVE_HOURS:
-            return candidate
-        candidate = (candidate + timedelta(hours=1)).replace(minute=0, second=0)
-    return now_utc + timedelta(minutes=max(BUFFER_MINUTES, 0))
+def _slot_allocator(rows: List[Dict[str, Any]]) -> SlotAllocator:
+    # ساعات لوحة التحكم (بتوقيت القاهرة) إلا لو ACTIVE_HOURS متحددة في البيئة
+    return queue_allocator(
+        rows, buffer_minutes=BUFFER_MINUTES, dashboard_hours=_bot_config().get("active_hours") or []
+    )
 
 
 def _telegram_api_url(method: str) -> str:
@@ -470,15 +541,12 @@ def _telegram_send_message(chat_id: int, text: str) -> None:
 
 
 def _telegram_is_authorized(chat_id: int) -> bool:
-    now = datetime.now(timezone.utc)
-    expires = _TELEGRAM_AUTH_UNTIL.get(chat_id)
-    return bool(expires and expires > now)
+    return _STATE.get(f"tg_auth:{chat_id}") is not None
 
 
 def _telegram_authorize(chat_id: int, minutes: int = 120) -> None:
-    _TELEGRAM_AUTH_UNTIL[chat_id] = datetime.now(timezone.utc) + timedelta(
-        minutes=minutes
-    )
+    expires = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+    _STATE.set(f"tg_auth:{chat_id}", expires.isoformat(), ttl=minutes * 60)
 
 
 def _telegram_send_message_with_markup(
@@ -535,9 +603,9 @@ def _telegram_admin_help() -> str:
         "/menu - فتح لوحة التحكم\n"
         "/auth <pass> - تفعيل النشر لمدة ساعتين\n"
         "/queue - عرض آخر 10 منشورات مجدولة\n"
-        "/post <row> - نشر فوري لصف محدد\n"
-        "/delete <row> - حذف صف\n"
-        "/caption <row> <text> - تعديل الكابشن\n"
+        "/post <id> - نشر فوري لمنشور محدد (أو رقم الصف)\n"
+        "/delete <id> - حذف منشور\n"
+        "/caption <id> <text> - تعديل الكابشن\n"
         "/status - حالة الطابور\n"
     )
 
@@ -575,8 +643,8 @@ def _telegram_handle_admin_callback(chat_id: int, data: str) -> None:
         _telegram_send_message(chat_id, _telegram_admin_help())
         return
     if data == "dash_status":
-        ws, _header = _get_sheet()
-        rows = list_rows(ws)
+        ws, header = _get_sheet()
+        rows = list_records_projected(ws, header, ["Status"], cache=_SHEET_CACHE)
         pending = [
             r for r in rows if str(r.get("Status", "")).strip().lower() == "scheduled"
         ]
@@ -585,7 +653,8 @@ def _telegram_handle_admin_callback(chat_id: int, data: str) -> None:
 
     if data == "dash_queue":
         ws, _header = _get_sheet()
-        rows = list_rows(ws)
+        rows = list_rows(ws, cache=_SHEET_CACHE)
+        _ROW_INDEX.rebuild(rows)
         pending = [
             r for r in rows if str(r.get("Status", "")).strip().lower() == "scheduled"
         ]
@@ -595,25 +664,25 @@ def _telegram_handle_admin_callback(chat_id: int, data: str) -> None:
             return
         lines = []
         for r in pending[:10]:
-            row_no = int(r.get("_row_number") or 0)
+            ref = str(r.get(ID_COLUMN) or "").strip() or str(r.get("_row_number") or "")
             sched = str(r.get("Scheduled_Time") or "").strip()
             cap = str(r.get("AI_Caption") or "").strip().replace("\n", " ")
             if len(cap) > 60:
                 cap = cap[:57] + "..."
-            lines.append(f"#{row_no} • {sched}\n{cap}")
+            lines.append(f"#{ref} • {sched}\n{cap}")
         _telegram_send_message(chat_id, "\n\n".join(lines))
         return
 
     if data == "dash_post":
-        _telegram_send_message(chat_id, "اكتب: /post <row>")
+        _telegram_send_message(chat_id, "اكتب: /post <id>")
         return
 
     if data == "dash_caption":
-        _telegram_send_message(chat_id, "اكتب: /caption <row> <text>")
+        _telegram_send_message(chat_id, "اكتب: /caption <id> <text>")
         return
 
     if data == "dash_delete":
-        _telegram_send_message(chat_id, "اكتب: /delete <row>")
+        _telegram_send_message(chat_id, "اكتب: /delete <id>")
         return
 
     if data == "dash_ai_post":
@@ -625,17 +694,19 @@ def _telegram_handle_admin_callback(chat_id: int, data: str) -> None:
 
         try:
             ws, header = _get_sheet()
-            append_row(
+            _append_queue_rows(
                 ws,
                 header,
-                {
-                    "Timestamp": utc_now_iso(),
-                    "Image_URL": img_url,
-                    "AI_Caption": caption_ar,
-                    "Status": "Posted" if ok else "Failed",
-                    "Scheduled_Time": "",
-                    "Source": "AI_Generated",
-                },
+                [
+                    {
+                        "Timestamp": utc_now_iso(),
+                        "Image_URL": img_url,
+                        "AI_Caption": caption_ar,
+                        "Status": "Posted" if ok else "Failed",
+                        "Scheduled_Time": "",
+                        "Source": "AI_Generated",
+                    }
+                ],
             )
         except Exception:
             pass
@@ -647,44 +718,12 @@ def _telegram_handle_admin_callback(chat_id: int, data: str) -> None:
         return
 
     if data.startswith("vid_cat:"):
-        info = _PENDING_VIDEO.get(chat_id)
+        # pop ذرّي: لو الزرار اتداس مرتين بس worker واحد ينشر
+        info = _STATE.pop(f"tg_pending_video:{chat_id}")
         if not info:
             _telegram_send_message(chat_id, "❌ مفيش فيديو مُعلّق.")
             return
-        topic = data.split(":", 1)[1]
-        try:
-            video_bytes = _telegram_download_file(info["file_id"])
-            caption = _generate_caption_for_video_with_context(topic)
-            ok, err = _post_video_to_facebook_page(
-                caption,
-                video_bytes,
-                info.get("filename", "video.mp4"),
-                info.get("mime_type", "video/mp4"),
-            )
-
-            try:
-                ws, header = _get_sheet()
-                append_row(
-                    ws,
-                    header,
-                    {
-                        "Timestamp": utc_now_iso(),
-                        "Image_URL": "",
-                        "AI_Caption": caption,
-                        "Status": "Posted" if ok else "Failed",
-                        "Scheduled_Time": "",
-                        "Source": "User_Video",
-                    },
-                )
-            except Exception:
-                pass
-
-            if ok:
-                _telegram_send_message(chat_id, "✅ تم نشر الفيديو مع كابشن.")
-            else:
-                _telegram_send_message(chat_id, f"❌ فشل نشر الفيديو: {err}")
-        finally:
-            _PENDING_VIDEO.pop(chat_id, None)
+        _TG_JOBS.submit("video", chat_id, {**info, "topic": data.split(":", 1)[1]})
         return
 
 
@@ -711,8 +750,8 @@ def _telegram_handle_admin_command(chat_id: int, text: str) -> None:
         return
 
     if cmd.startswith("/status"):
-        ws, _header = _get_sheet()
-        rows = list_rows(ws)
+        ws, header = _get_sheet()
+        rows = list_records_projected(ws, header, ["Status"], cache=_SHEET_CACHE)
         pending = [
             r for r in rows if str(r.get("Status", "")).strip().lower() == "scheduled"
         ]
@@ -721,7 +760,8 @@ def _telegram_handle_admin_command(chat_id: int, text: str) -> None:
 
     if cmd.startswith("/queue"):
         ws, _header = _get_sheet()
-        rows = list_rows(ws)
+        rows = list_rows(ws, cache=_SHEET_CACHE)
+        _ROW_INDEX.rebuild(rows)
         pending = [
             r for r in rows if str(r.get("Status", "")).strip().lower() == "scheduled"
         ]
@@ -731,58 +771,77 @@ def _telegram_handle_admin_command(chat_id: int, text: str) -> None:
             return
         lines = []
         for r in pending[:10]:
-            row_no = int(r.get("_row_number") or 0)
+            ref = str(r.get(ID_COLUMN) or "").strip() or str(r.get("_row_number") or "")
             sched = str(r.get("Scheduled_Time") or "").strip()
             cap = str(r.get("AI_Caption") or "").strip().replace("\n", " ")
             if len(cap) > 60:
                 cap = cap[:57] + "..."
-            lines.append(f"#{row_no} • {sched}\n{cap}")
+            lines.append(f"#{ref} • {sched}\n{cap}")
         _telegram_send_message(chat_id, "\n\n".join(lines))
         return
 
     if cmd.startswith("/post "):
         parts = cmd.split(maxsplit=1)
-        if len(parts) < 2 or not parts[1].strip().isdigit():
-            _telegram_send_message(chat_id, "استخدم: /post <row>")
+        if len(parts) < 2 or not parts[1].strip():
+            _telegram_send_message(chat_id, "استخدم: /post <id>")
             return
-        row_number = int(parts[1].strip())
         ws, header = _get_sheet()
-        values = ws.row_values(row_number)
-        item = {
-            header[i]: (values[i] if i < len(values) else "")
-            for i in range(len(header))
-        }
-        caption = str(item.get("AI_Caption") or "").strip()
-        image_url = str(item.get("Image_URL") or "").strip() or None
-        ok, err = _post_to_facebook_page(caption, image_url)
-        if ok:
-            update_fields(ws, row_number, header, {"Status": "Posted"})
+        ref = parts[1].strip()
+        row_number = resolve_row(ws, header, ref, _ROW_INDEX)
+        if not row_number:
+            _telegram_send_message(chat_id, "❌ المنشور غير موجود.")
+            return
+        # نفس مسار الـ tick (claim + Publishing + archive lease) علشان الصف ما يتنشرش مرتين
+        result = publish_now(
+            ws,
+            header,
+            row_number,
+            _post_to_facebook_page,
+            lock=_PUBLISH_LOCK,
+            row_id=None if ref.isdigit() else ref,
+        )
+        if result is None:
+            _telegram_send_message(chat_id, "⏳ الصف بيتنشر أو بيتأرشف دلوقتي، أو مش Scheduled/Failed.")
+            return
+        _sheet_written(ws)
+        if result["action"] == "posted":
             _telegram_send_message(chat_id, f"✅ Posted row {row_number}")
         else:
-            update_fields(ws, row_number, header, {"Status": "Failed"})
-            _telegram_send_message(chat_id, f"❌ Failed: {err}")
+            _telegram_send_message(chat_id, f"❌ Failed: {result.get('error')}")
         return
 
     if cmd.startswith("/delete "):
         parts = cmd.split(maxsplit=1)
-        if len(parts) < 2 or not parts[1].strip().isdigit():
-            _telegram_send_message(chat_id, "استخدم: /delete <row>")
+        if len(parts) < 2 or not parts[1].strip():
+            _telegram_send_message(chat_id, "استخدم: /delete <id>")
             return
-        row_number = int(parts[1].strip())
-        ws, _header = _get_sheet()
-        ws.delete_rows(row_number)
+        ws, header = _get_sheet()
+        ref = parts[1].strip()
+        row_number = resolve_row(ws, header, ref, _ROW_INDEX)
+        if not row_number:
+            _telegram_send_message(chat_id, "❌ المنشور غير موجود.")
+            return
+        if not delete_row(ws, header, row_number, None if ref.isdigit() else ref):
+            _telegram_send_message(chat_id, "⚠️ الصف اتغير قبل الحذف، جرّب تاني.")
+            return
+        _ROW_INDEX.on_delete([row_number])
+        _sheet_written(ws)
         _telegram_send_message(chat_id, f"🗑️ Deleted row {row_number}")
         return
 
     if cmd.startswith("/caption "):
         parts = cmd.split(maxsplit=2)
-        if len(parts) < 3 or not parts[1].strip().isdigit():
-            _telegram_send_message(chat_id, "استخدم: /caption <row> <text>")
+        if len(parts) < 3 or not parts[1].strip():
+            _telegram_send_message(chat_id, "استخدم: /caption <id> <text>")
             return
-        row_number = int(parts[1].strip())
         new_caption = parts[2].strip()
         ws, header = _get_sheet()
+        row_number = resolve_row(ws, header, parts[1], _ROW_INDEX)
+        if not row_number:
+            _telegram_send_message(chat_id, "❌ المنشور غير موجود.")
+            return
         update_fields(ws, row_number, header, {"AI_Caption": new_caption})
+        _sheet_written(ws)
         _telegram_send_message(chat_id, f"✅ Updated caption for row {row_number}")
         return
 
@@ -822,6 +881,7 @@ def _imgbb_upload(image_bytes: bytes) -> str:
 
 
 def _generate_caption_for_image_url(image_url: str) -> str:
+    client = _groq_client()
     if not client:
         return "🥋 جاهزين للتمرين؟ احجز مكانك دلوقتي! 📞"
     prompt = (
@@ -840,17 +900,11 @@ def _generate_caption_for_image_url(image_url: str) -> str:
         max_tokens=250,
         temperature=0.85,
     )
-    return _clean_caption_text(res.choices[0].message.content or "")
-
-
-def _clean_caption_text(text: str) -> str:
-    lines = [ln.strip() for ln in str(text or "").splitlines() if ln.strip()]
-    banned = ("prompt", "english", "description", "وصف الصورة", "image prompt")
-    filtered = [ln for ln in lines if all(b not in ln.lower() for b in banned)]
-    return "\n".join(filtered).strip() or str(text or "").strip()
+    return clean_caption(res.choices[0].message.content or "")
 
 
 def _generate_caption_for_video() -> str:
+    client = _groq_client()
     if not client:
         return "🎥 تمرين قوي ومفيد! احجز مكانك دلوقتي 💪📞"
     prompt = (
@@ -868,6 +922,7 @@ def _generate_caption_for_video() -> str:
 
 
 def _generate_caption_for_video_with_context(topic: str) -> str:
+    client = _groq_client()
     if not client:
         return "🎥 تمرين ممتع ومفيد! احجز مكانك دلوقتي 💪📞"
     topic_map = {
@@ -895,6 +950,7 @@ def _generate_caption_for_video_with_context(topic: str) -> str:
 
 
 def _generate_caption_for_video_from_text(text: str) -> str:
+    client = _groq_client()
     if not client:
         return "🎥 تمرين ممتع ومفيد! احجز مكانك دلوقتي 💪📞"
     prompt = (
@@ -911,20 +967,52 @@ def _generate_caption_for_video_from_text(text: str) -> str:
     return (res.choices[0].message.content or "").strip()
 
 
-# Initialize Groq
-client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+# Groq client (and the SDK import) is built on first use, not at worker boot
+_GROQ_CLIENT = None
+_GROQ_LOCK = threading.Lock()
+
+
+def _groq_client():
+    global _GROQ_CLIENT
+    if _GROQ_CLIENT is None and GROQ_API_KEY:
+        with _GROQ_LOCK:
+            if _GROQ_CLIENT is None:
+                from groq import Groq
+
+                _GROQ_CLIENT = Groq(api_key=GROQ_API_KEY)
+    return _GROQ_CLIENT
+
 
 # SQLite DB for SaaS (subscriptions + vouchers)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "saas.db")
+DB_PATH = SAAS_DB_PATH
+
+
+# اتصال واحد لكل thread (WAL + cache) بدل فتح اتصال جديد في كل طلب
+_SAAS_DB = SQLiteDB(DB_PATH)
 
 
 def get_db():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    """Per-thread saas.db connection in autocommit mode. Do not close it."""
+    return _SAAS_DB.conn()
+
+
+# ارفع الرقم ده مع أي تعديل في init_db عشان أول worker بعد الـ deploy يطبّقه
+_SAAS_SCHEMA_VERSION = 3
 
 
 def init_db():
-    conn = get_db()
+    """Create the SaaS tables once per schema version (tracked in PRAGMA user_version)."""
+    if get_db().execute("PRAGMA user_version").fetchone()[0] >= _SAAS_SCHEMA_VERSION:
+        return
+    with _SAAS_DB.transaction() as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= _SAAS_SCHEMA_VERSION:
+            return
+        _create_saas_schema(conn)
+        conn.execute(f"PRAGMA user_version = {_SAAS_SCHEMA_VERSION}")
+
+
+def _create_saas_schema(conn):
     cur = conn.cursor()
     cur.execute(
         """
@@ -947,11 +1035,23 @@ def init_db():
         )
         """
     )
-    conn.commit()
-    conn.close()
+    ensure_indexes(_SAAS_DB)
+    # جداول الـ leases/claims/الميزانية ومهام تيليجرام، مرة واحدة مع نسخة المخطط مش مع كل worker
+    PublishLock(_SAAS_DB, create_tables=False).init_db()
+    _TG_JOBS.init_db()
+
+
+# حالة الاشتراك من الذاكرة (مدة الكاش لا تتعدى تاريخ الانتهاء)
+_SUBSCRIPTIONS = SubscriptionService(_SAAS_DB)
 
+# إحصائيات /admin/stats (كاش قصير عشان الداشبورد يقدر يسأل كتير)
+_STATS = StatsCache(_SAAS_DB)
 
-init_db()
+# رفع تيليجرام في الخلفية (سجل المهام في saas.db)
+_TG_JOBS = TelegramJobQueue(_SAAS_DB, _telegram_send_message)
+
+# Leases + per-row publish claims (shared by workers, cron retries and main.py)
+_PUBLISH_LOCK: Optional[PublishLock] = None
 
 # الثوابت والصور
 FALLBACK_IMAGES = [
@@ -1044,92 +1144,38 @@ ACADEMY_DATA = {
 # Configuration Defaults (قابل للتعديل من التطبيق)
 BOT_CONFIG = {
     "system_prompt_mood": "حماسي جداً",
-    "active_hours": [9, 11, 14, 17, 20, 22],
+    "active_hours": list(DEFAULT_ACTIVE_HOURS),
     "rss_feeds": RSS_FEEDS,
 }
 
-# ذاكرة مؤقتة لمنع التكرار في نفس الساعة
-LAST_POST_HOUR_KEY = None
+# مفتاح منع التكرار في نفس الساعة (محفوظ في _STATE)
+LAST_POST_HOUR_KEY = "last_post_hour"
 
 
-# ============ SaaS Helpers ============
-def _generate_code(length=12):
-    alphabet = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
-    return "".join(random.choice(alphabet) for _ in range(length))
+def _bot_config() -> Dict[str, Any]:
+    """Defaults overlaid with whatever /update-config stored in shared state."""
+    return {**BOT_CONFIG, **(_STATE.get("bot_config") or {})}
 
 
+# ============ SaaS Helpers ============
 def generate_vouchers(count=20, duration_days=30):
-    now = datetime.utcnow().isoformat()
-    codes = []
-    conn = get_db()
-    cur = conn.cursor()
-    for _ in range(count):
-        code = _generate_code()
-        codes.append(code)
-        cur.execute(
-            "INSERT OR IGNORE INTO vouchers (code, duration_days, created_at) VALUES (?, ?, ?)",
-            (code, duration_days, now),
-        )
-    conn.commit()
-    conn.close()
-    return codes
+    # أكواد من secrets + إدخال جماعي في transaction واحدة؛ يرجع الأكواد المحفوظة فعلاً فقط
+    return create_vouchers(_SAAS_DB, count, duration_days)
 
 
 def activate_voucher(user_id: str, voucher_code: str):
-    conn = get_db()
-    cur = conn.cursor()
-
-    cur.execute(
-        "SELECT duration_days, is_used FROM vouchers WHERE code = ?",
-        (voucher_code,),
-    )
-    row = cur.fetchone()
-    if not row:
-        conn.close()
+    status, subscription_end = redeem_voucher(_SAAS_DB, user_id, voucher_code)
+    if status == "invalid":
         return False, "❌ الكود غير صحيح"
-
-    duration_days, is_used = row
-    if is_used:
-        conn.close()
+    if status == "used":
         return False, "⚠️ الكود مستخدم مسبقاً"
 
-    expiry = datetime.utcnow() + timedelta(days=duration_days)
-    expiry_str = expiry.isoformat()
-    now = datetime.utcnow().isoformat()
-
-    # Upsert user
-    cur.execute(
-        "INSERT OR REPLACE INTO users (user_id, subscription_end, created_at) VALUES (?, ?, COALESCE((SELECT created_at FROM users WHERE user_id = ?), ?))",
-        (user_id, expiry_str, user_id, now),
-    )
-
-    # Mark voucher used
-    cur.execute(
-        "UPDATE vouchers SET is_used = 1, used_by = ?, used_at = ? WHERE code = ?",
-        (user_id, now, voucher_code),
-    )
-
-    conn.commit()
-    conn.close()
-    return True, expiry_str
+    _SUBSCRIPTIONS.invalidate(user_id)
+    return True, subscription_end
 
 
 def is_premium(user_id: str):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT subscription_end FROM users WHERE user_id = ?",
-        (user_id,),
-    )
-    row = cur.fetchone()
-    conn.close()
-    if not row or not row[0]:
-        return False
-    try:
-        expiry = datetime.fromisoformat(row[0])
-        return expiry > datetime.utcnow()
-    except Exception:
-        return False
+    return _SUBSCRIPTIONS.is_active(user_id)
 
 
 def get_mood_prompt(mood):
@@ -1156,58 +1202,69 @@ SYSTEM_PROMPT_BASE = """أنت "كابتن عز غريب"، صانع محتوى
 """
 
 
+def _cairo_tz():
+    import pytz
+
+    return pytz.timezone("Africa/Cairo")
+
+
 def get_cairo_time():
     """Get current time in Cairo"""
-    cairo_tz = pytz.timezone("Africa/Cairo")
-    return datetime.now(cairo_tz)
+    return datetime.now(_cairo_tz())
 
 
 def extract_image_from_url(url):
     """Attempt to extract the main image from a webpage/article"""
-    try:
-        response = requests.get(url, timeout=10)
-        soup = BeautifulSoup(response.content, "html.parser")
+    # بيقرأ لحد </head> بس، والنتيجة (حتى لو مفيش صورة) بتتخزن لكل رابط
+    return extract_og_image(url)
 
-        # Try og:image
-        og_image = soup.find("meta", property="og:image")
-        if og_image and og_image.get("content"):
-            return og_image["content"]
 
-        # Try twitter:image
-        twitter_image = soup.find("meta", attrs={"name": "twitter:image"})
-        if twitter_image and twitter_image.get("content"):
-            return twitter_image["content"]
+_FEED_HARVESTER: Optional[FeedHarvester] = None
+
+_SERVICES_LOCK = threading.Lock()
 
-        return None
-    except:
-        return None
+
+def _init_services() -> None:
+    """Open the databases and build the shared services (once per process).
+
+    Called by create_app, so importing this module has no side effects.
+    """
+    global _SHEET_CACHE, _STATE, _PUBLISH_LOCK, _FEED_HARVESTER
+    with _SERVICES_LOCK:
+        if _STATE is not None:
+            return
+        init_db()
+        _PUBLISH_LOCK = PublishLock(_SAAS_DB, create_tables=False)
+        _SHEET_CACHE = SheetCache()
+        _FEED_HARVESTER = FeedHarvester(
+            FEED_DB_PATH,
+            lambda: _bot_config().get("rss_feeds", RSS_FEEDS),
+            lock=_PUBLISH_LOCK,
+            image_extractor=extract_image_from_url,
+        )
+        _STATE = make_state_store()
 
 
 def fetch_content_idea():
     """Fetch an idea from RSS or generate a topic based on time of day"""
     # توزيع متساوٍ (Round-robin)
-    global _CONTENT_TYPE_INDEX
-    post_type = _CONTENT_TYPES[_CONTENT_TYPE_INDEX % len(_CONTENT_TYPES)]
-    _CONTENT_TYPE_INDEX += 1
+    content_type_index = _STATE.incr("content_type_index") - 1
+    post_type = _CONTENT_TYPES[content_type_index % len(_CONTENT_TYPES)]
 
     # تفضيل احضار محتوى خارجي للتعليق عليه (Curated Content)
+    # المقالات بتتجمع في الخلفية، فالاختيار هنا استعلام محلي بدون شبكة
     try:
-        # استخدام القائمة من الكونفيج
-        feeds_list = BOT_CONFIG.get("rss_feeds", RSS_FEEDS)
-
         if random.choice([True, False]):  # 50% فرصة لجلب محتوى خارجي
-            feed = feedparser.parse(random.choice(feeds_list))
-            if feed.entries:
-                entry = random.choice(feed.entries[:5])
-                image_url = extract_image_from_url(entry.link)
+            entry = _FEED_HARVESTER.pick_entry()
+            if entry:
                 return {
                     "type": "curated",
-                    "title": entry.title,
-                    "link": entry.link,
-                    "summary": entry.get("summary", ""),
-                    "image_url": image_url,
+                    "title": entry["title"],
+                    "link": entry["link"],
+                    "summary": entry["summary"],
+                    "image_url": entry["image_url"],
                 }
-    except:
+    except Exception:
         pass
 
     # لو فشل ال RSS، ارجع لإنشاء محتوى أصلي
@@ -1220,13 +1277,14 @@ def fetch_content_idea():
 
 def generate_social_post(idea):
     """Generate the post text using Groq"""
+    client = _groq_client()
     if not client:
         return None
 
     if idea["type"] == "curated":
         prompt = f"""
         أنت كابتن عز غريب.
-        {get_mood_prompt(BOT_CONFIG['system_prompt_mood'])}
+        {get_mood_prompt(_bot_config()['system_prompt_mood'])}
         
         لقيت المقال ده عن الرياضة:
         العنوان: {idea['title']}
@@ -1254,7 +1312,7 @@ def generate_social_post(idea):
 
         prompt = f"""
         أنت كابتن عز غريب.
-        {get_mood_prompt(BOT_CONFIG['system_prompt_mood'])}
+        {get_mood_prompt(_bot_config()['system_prompt_mood'])}
 
         اكتب بوست فيسبوك عن: {topic_desc}
         
@@ -1373,12 +1431,21 @@ def _post_video_to_facebook_page(
         return False, str(e)
 
 
-def generate_response(message):
-    """Generate AI response using Groq"""
-    if not client:
-        return "عذراً، حدث خطأ مؤقت. للتواصل: 01004945997 أو 01033111786"
+_REPLY_MODEL = "llama-3.3-70b-versatile"
+_REPLY_UNAVAILABLE = "عذراً، حدث خطأ مؤقت. للتواصل: 01004945997 أو 01033111786"
+
+
+def _academy_phones() -> str:
+    return f"{ACADEMY_DATA['phone']} أو {ACADEMY_DATA['phone_alt']}"
+
 
-    phones = f"{ACADEMY_DATA['phone']} أو {ACADEMY_DATA['phone_alt']}"
+def _reply_fallback() -> str:
+    return f"أهلاً! 🥋\n\nللاستفسار عن الأكاديمية، تواصل معنا:\n📞 {_academy_phones()}\n📍 {ACADEMY_DATA['location']}"
+
+
+def _reply_messages(message: str) -> List[Dict[str, str]]:
+    """Chat messages for a Messenger/comment reply (shared by the sync and ASGI servers)."""
+    phones = _academy_phones()
 
     context = f"""
 📍 معلومات الأكاديمية:
@@ -1403,23 +1470,44 @@ def generate_response(message):
     for offer in ACADEMY_DATA["offers"]:
         context += f"- {offer}\n"
 
-    mood_prompt = get_mood_prompt(BOT_CONFIG.get("system_prompt_mood", "حماسي جداً"))
+    mood_prompt = get_mood_prompt(
+        _bot_config().get("system_prompt_mood", "حماسي جداً")
+    )
     full_system_prompt = f"{SYSTEM_PROMPT_BASE}\n{mood_prompt}\n\n{context}"
+    return [
+        {"role": "system", "content": full_system_prompt},
+        {"role": "user", "content": message},
+    ]
+
+
+def generate_response(message):
+    """Generate AI response using Groq"""
+    client = _groq_client()
+    if not client:
+        return _REPLY_UNAVAILABLE
 
     try:
         response = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[
-                {"role": "system", "content": full_system_prompt},
-                {"role": "user", "content": message},
-            ],
+            model=_REPLY_MODEL,
+            messages=_reply_messages(message),
             max_tokens=800,
             temperature=0.7,
         )
         return response.choices[0].message.content
     except Exception as e:
         print(f"Error generating response: {e}")
-        return f"أهلاً! 🥋\n\nللاستفسار عن الأكاديمية، تواصل معنا:\n📞 {phones}\n📍 {ACADEMY_DATA['location']}"
+        return _reply_fallback()
+
+
+def _send_message_request(recipient_id, message_text) -> Tuple[str, Dict[str, Any]]:
+    return "https://graph.facebook.com/v18.0/me/messages", {
+        "recipient": {"id": recipient_id},
+        "message": {"text": message_text},
+    }
+
+
+def _comment_reply_request(comment_id, message) -> Tuple[str, Dict[str, Any]]:
+    return f"https://graph.facebook.com/v18.0/{comment_id}/comments", {"message": message}
 
 
 def send_message(recipient_id, message_text):
@@ -1428,12 +1516,12 @@ def send_message(recipient_id, message_text):
         print("Error: PAGE_ACCESS_TOKEN not set")
         return
 
-    url = "https://graph.facebook.com/v18.0/me/messages"
-    params = {"access_token": PAGE_ACCESS_TOKEN}
-    data = {"recipient": {"id": recipient_id}, "message": {"text": message_text}}
+    url, data = _send_message_request(recipient_id, message_text)
 
     try:
-        response = requests.post(url, params=params, json=data, timeout=10)
+        response = requests.post(
+            url, params={"access_token": PAGE_ACCESS_TOKEN}, json=data, timeout=10
+        )
         response.raise_for_status()
         print(f"✅ Message sent to {recipient_id}")
     except Exception as e:
@@ -1446,39 +1534,49 @@ def reply_to_comment(comment_id, message):
         print("Error: PAGE_ACCESS_TOKEN not set")
         return
 
-    url = f"https://graph.facebook.com/v18.0/{comment_id}/comments"
-    params = {"access_token": PAGE_ACCESS_TOKEN}
-    data = {"message": message}
+    url, data = _comment_reply_request(comment_id, message)
 
     try:
-        response = requests.post(url, params=params, json=data, timeout=10)
+        response = requests.post(
+            url, params={"access_token": PAGE_ACCESS_TOKEN}, json=data, timeout=10
+        )
         response.raise_for_status()
         print(f"✅ Comment reply sent to {comment_id}")
     except Exception as e:
         print(f"❌ Error replying to comment: {e}")
 
 
-@app.route("/status", methods=["GET"])
+@core_bp.route("/status", methods=["GET"])
 def bot_status():
     """Return bot status and configuration"""
     cairo_now = get_cairo_time()
+    config = _bot_config()
+    last_post_hour = _STATE.get(LAST_POST_HOUR_KEY)
     return jsonify(
         {
             "status": "online",
             "time_cairo": str(cairo_now.strftime("%Y-%m-%d %H:%M:%S")),
-            "active_hours": BOT_CONFIG.get("active_hours", []),
-            "mood": BOT_CONFIG.get("system_prompt_mood", "Unknown"),
-            "last_post_hour": LAST_POST_HOUR_KEY if LAST_POST_HOUR_KEY else "None",
-            "rss_count": len(BOT_CONFIG.get("rss_feeds", [])),
+            "active_hours": config.get("active_hours", []),
+            "mood": config.get("system_prompt_mood", "Unknown"),
+            "last_post_hour": last_post_hour if last_post_hour else "None",
+            "rss_count": len(config.get("rss_feeds", [])),
+            "blueprints": current_app.config.get("WEBHOOK_BLUEPRINTS", []),
         }
     )
 
 
-@app.route("/update-config", methods=["POST"])
+@scheduler_bp.route("/feeds/health", methods=["GET"])
+def feeds_health():
+    """Per-feed health scores from the background harvester (admin-only)."""
+    auth = _require_admin()
+    if auth:
+        return jsonify(auth[0]), auth[1]
+    return jsonify({"feeds": _FEED_HARVESTER.feed_health()}), 200
+
+
+@core_bp.route("/update-config", methods=["POST"])
 def update_config():
     """Update Bot Configuration from App"""
-    global BOT_CONFIG
-
     # Check Secret
     if not CRON_SECRET:
         return "CRON_SECRET is not configured", 500
@@ -1491,19 +1589,19 @@ def update_config():
         return "No data provided", 400
 
     # Update Config
+    changes = {}
     if "active_hours" in data:
-        BOT_CONFIG["active_hours"] = data["active_hours"]
+        changes["active_hours"] = data["active_hours"]
     if "mood" in data:
-        BOT_CONFIG["system_prompt_mood"] = data["mood"]
+        changes["system_prompt_mood"] = data["mood"]
     if "rss_feeds" in data:
-        BOT_CONFIG["rss_feeds"] = data["rss_feeds"]
-        global RSS_FEEDS
-        RSS_FEEDS = data["rss_feeds"]  # Update the global RSS list too
+        changes["rss_feeds"] = data["rss_feeds"]
 
-    return jsonify({"status": "updated", "config": BOT_CONFIG})
+    _STATE.update("bot_config", lambda current: {**(current or {}), **changes})
+    return jsonify({"status": "updated", "config": _bot_config()})
 
 
-@app.route("/gen-vouchers", methods=["POST"])
+@saas_bp.route("/gen-vouchers", methods=["POST"])
 def gen_vouchers():
     """Generate voucher codes (admin-only).
 
@@ -1517,7 +1615,7 @@ def gen_vouchers():
     )
     now_ts = datetime.utcnow().timestamp()
 
-    blocked_until = _GEN_BLOCKED_UNTIL.get(ip)
+    blocked_until = _STATE.get(f"gen_blocked:{ip}")
     if blocked_until and now_ts < blocked_until:
         return jsonify({"status": "error", "message": "تم حظر المحاولات مؤقتاً"}), 429
 
@@ -1528,13 +1626,20 @@ def gen_vouchers():
         provided = request.headers.get("X-Admin-Token", "")
         if not provided or provided != ADMIN_TOKEN:
             # track failures
-            window = _GEN_FAILS.get(ip)
-            if not window or now_ts - window["first_ts"] > 600:
-                window = {"first_ts": now_ts, "count": 0}
-            window["count"] += 1
-            _GEN_FAILS[ip] = window
+            def _count_failure(window):
+                if not window or now_ts - window["first_ts"] > _GEN_FAIL_WINDOW_SECONDS:
+                    window = {"first_ts": now_ts, "count": 0}
+                return {**window, "count": window["count"] + 1}
+
+            window = _STATE.update(
+                f"gen_fails:{ip}", _count_failure, ttl=_GEN_FAIL_WINDOW_SECONDS
+            )
             if window["count"] >= 5:
-                _GEN_BLOCKED_UNTIL[ip] = now_ts + 1800  # 30 min
+                _STATE.set(
+                    f"gen_blocked:{ip}",
+                    now_ts + _GEN_BLOCK_SECONDS,
+                    ttl=_GEN_BLOCK_SECONDS,
+                )  # 30 min
             return jsonify({"status": "error", "message": "غير مصرح"}), 403
     else:
         # Legacy fallback (only when ADMIN_TOKEN is not configured)
@@ -1553,7 +1658,7 @@ def gen_vouchers():
     )
 
 
-@app.route("/activate", methods=["POST"])
+@saas_bp.route("/activate", methods=["POST"])
 def activate_subscription_route():
     data = request.get_json() or {}
     user_id = data.get("user_id")
@@ -1568,7 +1673,7 @@ def activate_subscription_route():
     return jsonify({"status": "error", "message": result}), 400
 
 
-@app.route("/subscription-status", methods=["GET"])
+@saas_bp.route("/subscription-status", methods=["GET"])
 def subscription_status():
     user_id = request.args.get("user_id")
     secret = request.args.get("secret")
@@ -1579,15 +1684,7 @@ def subscription_status():
     if not user_id:
         return jsonify({"status": "error", "message": "user_id مطلوب"}), 400
 
-    active = is_premium(user_id)
-
-    # Fetch expiry
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT subscription_end FROM users WHERE user_id = ?", (user_id,))
-    row = cur.fetchone()
-    conn.close()
-    expiry = row[0] if row and row[0] else None
+    active, expiry = _SUBSCRIPTIONS.status(user_id)
 
     return jsonify(
         {
@@ -1598,7 +1695,16 @@ def subscription_status():
     )
 
 
-@app.route("/auto-post-trigger", methods=["GET", "POST"])
+@saas_bp.route("/admin/stats", methods=["GET"])
+def admin_stats():
+    """Subscriber / voucher aggregates for dashboards (cached briefly)."""
+    auth = _require_admin()
+    if auth:
+        return jsonify(auth[0]), auth[1]
+    return jsonify(_STATS.get()), 200
+
+
+@scheduler_bp.route("/auto-post-trigger", methods=["GET", "POST"])
 def auto_scheduler():
     """
     هذا الرابط يتم استدعاؤه بواسطة خدمة Cron Job خارجية
@@ -1614,35 +1720,47 @@ def auto_scheduler():
     # 2. Time Check (Configurable)
     cairo_now = get_cairo_time()
     current_hour_key = cairo_now.strftime("%Y-%m-%d-%H")
-
-    global LAST_POST_HOUR_KEY
+    active_hours = _bot_config()["active_hours"]
 
     # التحقق هل الساعة الحالية موجودة في الساعات النشطة؟
     is_active_time = False
-    if cairo_now.hour in BOT_CONFIG["active_hours"]:
+    if cairo_now.hour in active_hours:
         is_active_time = True
 
     if not is_active_time:
         return (
-            f"Not an active hour (Current: {cairo_now.hour}). Active: {BOT_CONFIG['active_hours']}",
+            f"Not an active hour (Current: {cairo_now.hour}). Active: {active_hours}",
             200,
         )
 
+    # lease: لو طلبين من الكرون اتداخلوا، واحد بس يدخل منطقة النشر
+    with _PUBLISH_LOCK.lease("auto_post") as acquired:
+        if not acquired:
+            return "Another auto-post is in progress. Skipping.", 200
+        return _auto_post_for_hour(cairo_now, current_hour_key)
+
+
+def _auto_post_for_hour(cairo_now: datetime, current_hour_key: str):
     # منع التكرار: لو نشرنا بالفعل في هذه الساعة، لا تنشر مرة أخرى
-    if LAST_POST_HOUR_KEY == current_hour_key:
+    # الحجز بـ compare-and-set، فلو طلبين وصلوا مع بعض واحد بس يكمل
+    previous_hour_key = _STATE.get(LAST_POST_HOUR_KEY)
+    if previous_hour_key == current_hour_key or not _STATE.compare_and_set(
+        LAST_POST_HOUR_KEY, previous_hour_key, current_hour_key
+    ):
         return f"Already posted this hour ({current_hour_key}). Skipping.", 200
 
-    # 3. Generate Content
-    idea = fetch_content_idea()
-    post_text = generate_social_post(idea)
+    # أي فشل أو exception قبل النشر الناجح يرجّع الحجز علشان المحاولة الجاية تنشر
+    posted = False
+    try:
+        # 3. Generate Content
+        idea = fetch_content_idea()
+        post_text = generate_social_post(idea)
+        if not post_text:
+            return "Failed to generate content", 500
 
-    if post_text:
         # 4. Publish
         result = publish_to_facebook(post_text, idea.get("image_url"))
-
-        # تحديث وقت آخر نشر بعد النجاح
-        if "Successfully" in str(result) or "id" in str(result):
-            LAST_POST_HOUR_KEY = current_hour_key
+        posted = "Successfully" in str(result) or "id" in str(result)
 
         return jsonify(
             {
@@ -1652,15 +1770,19 @@ def auto_scheduler():
                 "result": result,
             }
         )
-
-    return "Failed to generate content", 500
+    finally:
+        if not posted:
+            _STATE.compare_and_set(
+                LAST_POST_HOUR_KEY, current_hour_key, previous_hour_key
+            )
 
 
-@app.route("/publisher-tick", methods=["GET"])
+@scheduler_bp.route("/publisher-tick", methods=["GET"])
 def publisher_tick():
     """Minute-level publisher tick.
 
-    - Publishes due scheduled items from Google Sheets.
+    - Publishes due scheduled items from Google Sheets (up to PUBLISH_MAX_PER_TICK,
+      or ?max=N, per call so a backlog drains quickly after downtime).
     - If queue is empty and no scheduled items in next PREFILL_HOURS, pre-fills one AI-generated item.
     """
     if not CRON_SECRET:
@@ -1674,6 +1796,10 @@ def publisher_tick():
         "true",
         "yes",
     }
+    try:
+        max_items = int(request.args.get("max") or PUBLISH_MAX_PER_TICK)
+    except ValueError:
+        max_items = PUBLISH_MAX_PER_TICK
 
     if not GOOGLE_SHEET_ID:
         return (
@@ -1683,40 +1809,50 @@ def publisher_tick():
 
     try:
         ws, header = _get_sheet()
-        rows = list_rows(ws)
+        # Status/Scheduled_Time only; publish_due_batch fetches full rows it publishes.
+        rows = list_records_projected(ws, header, cache=_SHEET_CACHE)
 
-        # 1) Publish due
-        due = find_due_scheduled(rows)
-        if due:
-            item = due[0]
-            row_number = int(item.get("_row_number") or 0)
-            caption = str(item.get("AI_Caption") or "").strip()
-            image_url = str(item.get("Image_URL") or "").strip() or None
+        owner = make_owner_id()
 
-            if dry_run:
-                update_fields(ws, row_number, header, {"Status": "Posted"})
-                return (
-                    jsonify(
-                        {"enabled": True, "action": "dry_run_posted", "row": row_number}
-                    ),
-                    200,
-                )
+        # 0) Rows a crashed/failed publish left as "Publishing"
+        reaped = reap_stuck_rows(ws, header, rows, lock=_PUBLISH_LOCK)
+        extra = {"reaped": reaped} if reaped else {}
+        if reaped:
+            _sheet_written(ws)
 
-            ok, err = _post_to_facebook_page(caption, image_url)
-            if ok:
-                update_fields(ws, row_number, header, {"Status": "Posted"})
+        # 1) Publish due (row claims let overlapping ticks take different rows)
+        due = find_due_scheduled(rows)
+        if due:
+            results = publish_due_batch(
+                ws,
+                header,
+                due,
+                _post_to_facebook_page,
+                lock=_PUBLISH_LOCK,
+                owner=owner,
+                dry_run=dry_run,
+                max_items=max(1, max_items),
+            )
+            if results and not dry_run:
+                _sheet_written(ws)
+            if not results:
                 return (
-                    jsonify({"enabled": True, "action": "posted", "row": row_number}),
+                    jsonify({"enabled": True, "action": "busy", "due": len(due), **extra}),
                     200,
                 )
-            update_fields(ws, row_number, header, {"Status": "Failed"})
             return (
                 jsonify(
                     {
                         "enabled": True,
-                        "action": "failed",
-                        "row": row_number,
-                        "error": err,
+                        "action": "published",
+                        "due": len(due),
+                        "posted": sum(
+                            1
+                            for r in results
+                            if r["action"] in {"posted", "dry_run_posted"}
+                        ),
+                        "results": results,
+                        **extra,
                     }
                 ),
                 200,
@@ -1727,31 +1863,82 @@ def publisher_tick():
             now = datetime.now(timezone.utc).replace(microsecond=0)
             window_end = now + timedelta(hours=max(PREFILL_HOURS, 1))
             if not has_scheduled_within(rows, start=now, end=window_end):
-                prompt_en = _generate_image_prompt_en()
-                caption_ar = _generate_ar_caption_from_prompt(prompt_en)
-                prompt_en = _generate_image_prompt_from_text(caption_ar)
-                img_url = _pollinations_url(prompt_en)
-                scheduled_time = _next_available_slot(now)
-                append_row(
-                    ws,
-                    header,
-                    {
-                        "Timestamp": utc_now_iso(),
-                        "Image_URL": img_url,
-                        "AI_Caption": caption_ar,
-                        "Status": "Scheduled",
-                        "Scheduled_Time": scheduled_time.isoformat(),
-                        "Source": "AI_Generated",
-                    },
-                )
-                return jsonify({"enabled": True, "action": "prefilled"}), 200
+                with _PUBLISH_LOCK.lease("prefill", owner) as acquired:
+                    # Re-read under the lease: a tick that just released it may
+                    # have prefilled already.
+                    fresh_rows = list_records_projected(ws, header) if acquired else []
+                    if acquired and not has_scheduled_within(
+                        fresh_rows, start=now, end=window_end
+                    ):
+                        # كل الخانات الفاضية حتى PREFILL_HORIZON_HOURS بطلب Groq واحد وكتابة واحدة
+                        created = run_batch_prefill(
+                            ws,
+                            header,
+                            _slot_allocator(fresh_rows),
+                            now,
+                            lambda n: generate_batch(
+                                _groq_client(), n, PREFILL_BRIEF, PREFILL_FALLBACK
+                            ),
+                            _pollinations_url,
+                            clean_caption=clean_caption,
+                        )
+                        if created:
+                            _indexed(created, [r.get("_row_number") or 0 for r in created])
+                            _sheet_written(ws)
+                        return (
+                            jsonify(
+                                {
+                                    "enabled": True,
+                                    "action": "prefilled",
+                                    "count": len(created),
+                                    "slots": [r["Scheduled_Time"] for r in created],
+                                    **extra,
+                                }
+                            ),
+                            200,
+                        )
+
+        return jsonify({"enabled": True, "action": "noop", **extra}), 200
+    except Exception as e:
+        return jsonify({"enabled": True, "action": "error", "error": str(e)}), 500
+
+
+@scheduler_bp.route("/archive-tick", methods=["GET"])
+def archive_tick():
+    """Daily cron: move old Posted/Failed rows from the Buffer sheet to the Archive worksheet.
+
+    Skips (action "busy") while a publish is in flight, since deleting rows
+    shifts row numbers. ``?dry_run=1`` only counts the rows it would move.
+    """
+    if not CRON_SECRET:
+        return "CRON_SECRET is not configured", 500
+    if request.args.get("secret") != CRON_SECRET:
+        return "Unauthorized", 401
+    if not GOOGLE_SHEET_ID:
+        return (
+            jsonify({"enabled": False, "error": "GOOGLE_SHEET_ID not configured"}),
+            200,
+        )
 
-        return jsonify({"enabled": True, "action": "noop"}), 200
+    dry_run = str(request.args.get("dry_run", "")).strip().lower() in {
+        "1",
+        "true",
+        "yes",
+    }
+    try:
+        ws, header = _get_sheet()
+        result = archive_once(
+            ws, header, lock=_PUBLISH_LOCK, owner=make_owner_id(), dry_run=dry_run
+        )
+        _ROW_INDEX.on_delete(result.get("rows") or [])
+        if result.get("rows"):
+            _sheet_written(ws)
+        return jsonify({"enabled": True, **result}), 200
     except Exception as e:
         return jsonify({"enabled": True, "action": "error", "error": str(e)}), 500
 
 
-@app.route("/telegram/webhook", methods=["POST"])
+@telegram_bp.route("/telegram/webhook", methods=["POST"])
 def telegram_webhook():
     """Telegram webhook uploader (admin-only)."""
     secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
@@ -1852,46 +2039,30 @@ def telegram_webhook():
             _telegram_send_message(int(chat_id), "❌ لم أستطع قراءة الفيديو.")
             return jsonify({"ok": True})
 
-        # If caption provided, generate caption from it and post immediately
+        # If caption provided, generate caption from it and post (in the background)
         if caption_text:
-            try:
-                video_bytes = _telegram_download_file(str(file_id))
-                caption = _generate_caption_for_video_from_text(caption_text)
-                ok, err = _post_video_to_facebook_page(
-                    caption, video_bytes, filename, mime_type
-                )
-
-                try:
-                    ws, header = _get_sheet()
-                    append_row(
-                        ws,
-                        header,
-                        {
-                            "Timestamp": utc_now_iso(),
-                            "Image_URL": "",
-                            "AI_Caption": caption,
-                            "Status": "Posted" if ok else "Failed",
-                            "Scheduled_Time": "",
-                            "Source": "User_Video",
-                        },
-                    )
-                except Exception:
-                    pass
-
-                if ok:
-                    _telegram_send_message(int(chat_id), "✅ تم نشر الفيديو مع كابشن.")
-                else:
-                    _telegram_send_message(int(chat_id), f"❌ فشل نشر الفيديو: {err}")
-                return jsonify({"ok": True})
-            except Exception as e:
-                _telegram_send_message(int(chat_id), f"❌ Error: {str(e)}")
-                return jsonify({"ok": True})
+            _TG_JOBS.submit(
+                "video",
+                int(chat_id),
+                {
+                    "file_id": str(file_id),
+                    "filename": filename,
+                    "mime_type": mime_type,
+                    "caption_text": caption_text,
+                },
+                update_id=update.get("update_id"),
+            )
+            return jsonify({"ok": True})
 
-        _PENDING_VIDEO[int(chat_id)] = {
-            "file_id": str(file_id),
-            "filename": filename,
-            "mime_type": mime_type,
-        }
+        _STATE.set(
+            f"tg_pending_video:{int(chat_id)}",
+            {
+                "file_id": str(file_id),
+                "filename": filename,
+                "mime_type": mime_type,
+            },
+            ttl=_PENDING_VIDEO_TTL_SECONDS,
+        )
         _telegram_send_message_with_markup(
             int(chat_id),
             "الفيديو عن إيه؟ اختار النوع علشان أكتب كابشن مناسب:",
@@ -1907,17 +2078,19 @@ def telegram_webhook():
                 now = datetime.now(timezone.utc).replace(microsecond=0)
                 scheduled_time = now + timedelta(minutes=max(BUFFER_MINUTES, 0))
                 ws, header = _get_sheet()
-                append_row(
+                _append_queue_rows(
                     ws,
                     header,
-                    {
-                        "Timestamp": utc_now_iso(),
-                        "Image_URL": "",
-                        "AI_Caption": text,
-                        "Status": "Scheduled",
-                        "Scheduled_Time": scheduled_time.isoformat(),
-                        "Source": "User_Text",
-                    },
+                    [
+                        {
+                            "Timestamp": utc_now_iso(),
+                            "Image_URL": "",
+                            "AI_Caption": text,
+                            "Status": "Scheduled",
+                            "Scheduled_Time": scheduled_time.isoformat(),
+                            "Source": "User_Text",
+                        }
+                    ],
                 )
                 _telegram_send_message(
                     int(chat_id),
@@ -1932,18 +2105,48 @@ def telegram_webhook():
     if not file_id:
         return jsonify({"ok": True})
 
-    try:
-        image_bytes = _telegram_download_file(str(file_id))
-        image_url = _imgbb_upload(image_bytes)
-        caption = _generate_caption_for_image_url(image_url)
+    # ألبوم: كل صورة بتيجي في update لوحدها؛ أول update بس بيعمل job للمجموعة كلها
+    media_group_id = message.get("media_group_id")
+    if media_group_id:
+        item = {
+            "update_id": update.get("update_id"),
+            "message_id": message.get("message_id"),
+            "file_id": str(file_id),
+            "caption": str(message.get("caption") or "").strip(),
+        }
+        if collect_album_item(_STATE, str(media_group_id), item):
+            _TG_JOBS.submit(
+                "album",
+                int(chat_id),
+                {"media_group_id": str(media_group_id)},
+                update_id=update.get("update_id"),
+                delay=ALBUM_WINDOW_SECONDS,
+            )
+        return jsonify({"ok": True}), 200
 
-        now = datetime.now(timezone.utc).replace(microsecond=0)
-        scheduled_time = now + timedelta(minutes=max(BUFFER_MINUTES, 0))
+    # رد فوري لتيليجرام؛ التحميل والرفع والكابشن والشيت في الخلفية
+    job_id = _TG_JOBS.submit(
+        "photo", int(chat_id), {"file_id": str(file_id)}, update_id=update.get("update_id")
+    )
+    return jsonify({"ok": True, "job_id": job_id}), 200
 
-        ws, header = _get_sheet()
-        append_row(
-            ws,
-            header,
+
+@_TG_JOBS.handler("photo")
+def _tg_job_photo(payload: Dict[str, Any], progress) -> str:
+    image_bytes = _telegram_download_file(payload["file_id"])
+    progress("📥 تم تحميل الصورة، جاري الرفع...")
+    image_url = _imgbb_upload(image_bytes)
+    progress("☁️ تم رفع الصورة، جاري كتابة الكابشن...")
+    caption = _generate_caption_for_image_url(image_url)
+
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    scheduled_time = now + timedelta(minutes=max(BUFFER_MINUTES, 0))
+
+    ws, header = _get_sheet()
+    _append_queue_rows(
+        ws,
+        header,
+        [
             {
                 "Timestamp": utc_now_iso(),
                 "Image_URL": image_url,
@@ -1951,29 +2154,103 @@ def telegram_webhook():
                 "Status": "Scheduled",
                 "Scheduled_Time": scheduled_time.isoformat(),
                 "Source": "User_Upload",
-            },
+            }
+        ],
+    )
+    return f"✅ Saved to queue. Will post in {BUFFER_MINUTES} mins.\n⏰ {scheduled_time.isoformat()}"
+
+
+@_TG_JOBS.handler("album")
+def _tg_job_album(payload: Dict[str, Any], progress) -> str:
+    # الألبوم لسه بيوصل: نرجع الـ job للطابور بدل ما ننام وإحنا شاغلين worker
+    remaining = album_quiet_in(_STATE, payload["media_group_id"])
+    if remaining > 0:
+        raise JobDeferred(remaining)
+    items = take_album(_STATE, payload["media_group_id"])
+    if not items:
+        return ""
+    progress(f"📥 استلمت {len(items)} صور، جاري التحميل والرفع...")
+    image_urls, errors = upload_all(
+        [i["file_id"] for i in items],
+        lambda file_id: _imgbb_upload(_telegram_download_file(file_id)),
+    )
+    if not image_urls:
+        raise RuntimeError(errors[0] if errors else "album upload failed")
+    progress(f"☁️ تم رفع {len(image_urls)} صور، جاري كتابة الكابشنز...")
+
+    note = " ".join(i.get("caption") or "" for i in items).strip()
+    captions = caption_album(
+        _groq_client(), image_urls, ALBUM_BRIEF, PREFILL_FALLBACK["caption"], note=note
+    )
+    ws, header = _get_sheet()
+    # كل صورة تاخد ساعة نشطة فاضية، من غير ما تتخانق مع المنشورات المجدولة
+    queued = list_records_projected(ws, header, cache=_SHEET_CACHE)
+    slots = _slot_allocator(queued).allocate(datetime.now(timezone.utc).replace(microsecond=0), len(image_urls))
+    rows = album_rows(image_urls, captions, slots)
+    _append_queue_rows(ws, header, rows)
+
+    lines = [f"✅ Saved {len(rows)} posts to queue."]
+    lines += [f"⏰ {row['Scheduled_Time']}" for row in rows]
+    if errors:
+        lines.append(f"⚠️ {len(errors)} صور فشلت: {errors[0]}")
+    return "\n".join(lines)
+
+
+@_TG_JOBS.handler("video")
+def _tg_job_video(payload: Dict[str, Any], progress) -> str:
+    video_bytes = _telegram_download_file(payload["file_id"])
+    progress("📥 تم تحميل الفيديو، جاري كتابة الكابشن...")
+    if payload.get("caption_text"):
+        caption = _generate_caption_for_video_from_text(payload["caption_text"])
+    else:
+        caption = _generate_caption_for_video_with_context(payload.get("topic") or "general")
+    progress("✍️ الكابشن جاهز، جاري رفع الفيديو على فيسبوك...")
+    ok, err = _post_video_to_facebook_page(
+        caption,
+        video_bytes,
+        payload.get("filename", "video.mp4"),
+        payload.get("mime_type", "video/mp4"),
+    )
+
+    try:
+        ws, header = _get_sheet()
+        _append_queue_rows(
+            ws,
+            header,
+            [
+                {
+                    "Timestamp": utc_now_iso(),
+                    "Image_URL": "",
+                    "AI_Caption": caption,
+                    "Status": "Posted" if ok else "Failed",
+                    "Scheduled_Time": "",
+                    "Source": "User_Video",
+                }
+            ],
         )
+    except Exception:
+        pass
+
+    if ok:
+        return "✅ تم نشر الفيديو مع كابشن."
+    return f"❌ فشل نشر الفيديو: {err}"
 
-        if chat_id:
-            _telegram_send_message(
-                int(chat_id),
-                f"✅ Saved to queue. Will post in {BUFFER_MINUTES} mins.\n⏰ {scheduled_time.isoformat()}",
-            )
-        return jsonify({"ok": True, "image_url": image_url}), 200
-    except Exception as e:
-        if chat_id:
-            _telegram_send_message(int(chat_id), f"❌ Error: {str(e)}")
-        return jsonify({"ok": True}), 200
+
+def _cms_row(ws, header, payload: Dict[str, Any]) -> Optional[int]:
+    # الأفضل "id" (ثابت)، و row_number مدعوم للتوافق مع العملاء القدامى
+    return resolve_row(
+        ws, header, payload.get("id") or payload.get("row_number"), _ROW_INDEX
+    )
 
 
-@app.route("/cms/pending", methods=["GET"])
+@cms_bp.route("/cms/pending", methods=["GET"])
 def cms_pending():
     auth = _require_admin()
     if auth:
         return jsonify(auth[0]), auth[1]
 
     ws, _header = _get_sheet()
-    rows = list_rows(ws)
+    rows = list_rows(ws, cache=_SHEET_CACHE)
     pending = [
         r for r in rows if str(r.get("Status", "")).strip().lower() == "scheduled"
     ]
@@ -1981,67 +2258,74 @@ def cms_pending():
     return jsonify({"items": pending}), 200
 
 
-@app.route("/cms/update-caption", methods=["POST"])
+@cms_bp.route("/cms/update-caption", methods=["POST"])
 def cms_update_caption():
     auth = _require_admin()
     if auth:
         return jsonify(auth[0]), auth[1]
 
     payload = request.get_json(silent=True) or {}
-    row_number = int(payload.get("row_number") or 0)
     caption = str(payload.get("caption") or "")
-    if row_number < 2:
-        return jsonify({"error": "row_number required"}), 400
-
     ws, header = _get_sheet()
+    row_number = _cms_row(ws, header, payload)
+    if not row_number:
+        return jsonify({"error": "id (or row_number) required"}), 400
+
     update_fields(ws, row_number, header, {"AI_Caption": caption})
+    _sheet_written(ws)
     return jsonify({"ok": True}), 200
 
 
-@app.route("/cms/post-now", methods=["POST"])
+@cms_bp.route("/cms/post-now", methods=["POST"])
 def cms_post_now():
     auth = _require_admin()
     if auth:
         return jsonify(auth[0]), auth[1]
 
     payload = request.get_json(silent=True) or {}
-    row_number = int(payload.get("row_number") or 0)
-    if row_number < 2:
-        return jsonify({"error": "row_number required"}), 400
-
     ws, header = _get_sheet()
-    # Read row
-    values = ws.row_values(row_number)
-    item = {
-        header[i]: (values[i] if i < len(values) else "") for i in range(len(header))
-    }
-    caption = str(item.get("AI_Caption") or "").strip()
-    image_url = str(item.get("Image_URL") or "").strip() or None
-    ok, err = _post_to_facebook_page(caption, image_url)
-    if ok:
-        update_fields(ws, row_number, header, {"Status": "Posted"})
+    row_number = _cms_row(ws, header, payload)
+    if not row_number:
+        return jsonify({"error": "id (or row_number) required"}), 400
+
+    result = publish_now(
+        ws,
+        header,
+        row_number,
+        _post_to_facebook_page,
+        lock=_PUBLISH_LOCK,
+        row_id=str(payload.get("id") or "").strip() or None,
+    )
+    if result is None:
+        return jsonify({"ok": False, "error": "row is busy or not Scheduled/Failed"}), 409
+    _sheet_written(ws)
+    if result["action"] == "posted":
         return jsonify({"ok": True}), 200
-    update_fields(ws, row_number, header, {"Status": "Failed"})
-    return jsonify({"ok": False, "error": err}), 500
+    return jsonify({"ok": False, "error": result.get("error")}), 500
 
 
-@app.route("/cms/delete", methods=["POST"])
+@cms_bp.route("/cms/delete", methods=["POST"])
 def cms_delete():
     auth = _require_admin()
     if auth:
         return jsonify(auth[0]), auth[1]
 
     payload = request.get_json(silent=True) or {}
-    row_number = int(payload.get("row_number") or 0)
-    if row_number < 2:
-        return jsonify({"error": "row_number required"}), 400
-
-    ws, _header = _get_sheet()
-    ws.delete_rows(row_number)
+    ws, header = _get_sheet()
+    row_number = _cms_row(ws, header, payload)
+    if not row_number:
+        return jsonify({"error": "id (or row_number) required"}), 400
+
+    # الحذف مش بيتكرر، فنتأكد إن الصف لسه هو نفس الـ ID قبل ما نحذفه
+    row_id = str(payload.get("id") or "").strip() or None
+    if not delete_row(ws, header, row_number, row_id):
+        return jsonify({"ok": False, "error": "row changed, not deleted"}), 409
+    _ROW_INDEX.on_delete([row_number])
+    _sheet_written(ws)
     return jsonify({"ok": True}), 200
 
 
-@app.route("/webhook", methods=["GET"])
+@fb_bp.route("/webhook", methods=["GET"])
 def verify_webhook():
     """Webhook verification for Facebook"""
     mode = request.args.get("hub.mode")
@@ -2056,70 +2340,111 @@ def verify_webhook():
         return "Forbidden", 403
 
 
-@app.route("/webhook", methods=["POST"])
-def handle_webhook():
-    """Handle incoming Facebook webhooks"""
-    data = request.get_json()
-
-    print(f"📨 Received webhook: {data}")
-
-    if data.get("object") == "page":
-        for entry in data.get("entry", []):
-            page_id = str(entry.get("id") or "")
-            # Handle Messenger Messages
-            for messaging in entry.get("messaging", []):
-                sender_id = str(messaging.get("sender", {}).get("id") or "")
+def fb_webhook_events(data: Dict[str, Any]):
+    """Yield ("message", sender_id, text) / ("comment", comment_id, text) to answer.
 
-                if not FB_REPLY_MESSAGES:
+    Applies the FB_REPLY_* toggles and skips the page's own messages and comments.
+    """
+    if (data or {}).get("object") != "page":
+        return
+    for entry in data.get("entry", []):
+        page_id = str(entry.get("id") or "")
+        # Handle Messenger Messages
+        for messaging in entry.get("messaging", []):
+            sender_id = str(messaging.get("sender", {}).get("id") or "")
+
+            if not FB_REPLY_MESSAGES:
+                continue
+
+            if page_id and sender_id == page_id:
+                continue
+
+            if "message" in messaging and "text" in messaging["message"]:
+                message_text = messaging["message"]["text"]
+                print(f"💬 Message from {sender_id}: {message_text}")
+                yield "message", sender_id, message_text
+
+        # Handle Comments
+        for change in entry.get("changes", []):
+            if change.get("field") == "feed":
+                if not FB_REPLY_COMMENTS:
                     continue
+                value = change.get("value", {})
 
-                if page_id and sender_id == page_id:
+                # Only reply to NEW comments (add)
+                if value.get("verb") != "add":
                     continue
 
-                if "message" in messaging and "text" in messaging["message"]:
-                    message_text = messaging["message"]["text"]
-                    print(f"💬 Message from {sender_id}: {message_text}")
+                if value.get("item") == "comment":
+                    comment_id = value.get("comment_id")
+                    message = value.get("message", "")
+                    sender_id = str(value.get("from", {}).get("id") or "")
 
-                    # Generate response
-                    response = generate_response(message_text)
+                    if page_id and sender_id == page_id:
+                        continue
 
-                    # Send back
-                    send_message(sender_id, response)
+                    # Print debug info
+                    print(f"DEBUG: Processing comment from {sender_id}: {message}")
+                    yield "comment", comment_id, message
 
-            # Handle Comments
-            for change in entry.get("changes", []):
-                if change.get("field") == "feed":
-                    if not FB_REPLY_COMMENTS:
-                        continue
-                    value = change.get("value", {})
 
-                    # Only reply to NEW comments (add)
-                    if value.get("verb") != "add":
-                        continue
+@fb_bp.route("/webhook", methods=["POST"])
+def handle_webhook():
+    """Handle incoming Facebook webhooks"""
+    data = request.get_json(silent=True)
+    # فيسبوك دايماً بيبعت JSON object؛ أي حاجة تانية (list/string) مش delivery
+    if not isinstance(data, dict):
+        return "Bad Request", 400
 
-                    if value.get("item") == "comment":
-                        comment_id = value.get("comment_id")
-                        message = value.get("message", "")
-                        sender_id = str(value.get("from", {}).get("id") or "")
+    print(f"📨 Received webhook: {data}")
 
-                        if page_id and sender_id == page_id:
-                            continue
+    for kind, target_id, text in fb_webhook_events(data):
+        # Generate response
+        response = generate_response(text)
+        if kind == "message":
+            send_message(target_id, response)
+        elif response:
+            reply_to_comment(target_id, response)
+        else:
+            print("❌ Failed to generate response for comment")
 
-                        # Print debug info
-                        print(f"DEBUG: Processing comment from {sender_id}: {message}")
+    return "OK", 200
 
-                        # Generate response
-                        response = generate_response(message)
 
-                        # Reply to comment
-                        if response:
-                            reply_to_comment(comment_id, response)
-                        else:
-                            print("❌ Failed to generate response for comment")
+def _parse_roles(roles: Optional[str]) -> List[str]:
+    names = [r.strip().lower() for r in (roles or WEBHOOK_BLUEPRINTS).split(",") if r.strip()]
+    if not names or "all" in names:
+        return list(BLUEPRINTS)
+    unknown = [r for r in names if r not in BLUEPRINTS]
+    if unknown:
+        raise RuntimeError(
+            f"Unknown WEBHOOK_BLUEPRINTS entries: {', '.join(unknown)} (use {', '.join(BLUEPRINTS)} or all)"
+        )
+    return names
 
-    return "OK", 200
+
+def create_app(roles: Optional[str] = None) -> Flask:
+    """Flask app with the core routes plus the selected blueprints.
+
+    ``roles`` is a comma-separated list of ``BLUEPRINTS`` keys (default:
+    ``WEBHOOK_BLUEPRINTS``). Databases are opened here, not on import;
+    the RSS harvester thread only runs in processes that serve the scheduler.
+    """
+    selected = _parse_roles(roles)
+    _init_services()
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(core_bp)
+    for name in selected:
+        flask_app.register_blueprint(BLUEPRINTS[name])
+    flask_app.config["WEBHOOK_BLUEPRINTS"] = selected
+
+    if "scheduler" in selected and FEED_HARVESTER_ENABLED:
+        _FEED_HARVESTER.start()
+    if "telegram" in selected:
+        _TG_JOBS.recover()
+    return flask_app
 
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host="0.0.0.0", port=port, debug=False)
+    create_app().run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,205 @@
+"""ASGI entry point: ``uvicorn webhook_asgi:app``.
+
+Facebook webhook deliveries (Messenger messages and page comments) are
+answered natively with ``AsyncGroq`` and one shared ``httpx.AsyncClient``,
+so a single process keeps hundreds of replies in flight. Every other route
+is the regular Flask app from ``webhook.py`` run through ``WsgiToAsgi``
+(a thread pool), so behaviour stays identical to ``gunicorn wsgi:app``.
+"""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+import webhook
+from webhook import (
+    GROQ_API_KEY,
+    PAGE_ACCESS_TOKEN,
+    _REPLY_MODEL,
+    _REPLY_UNAVAILABLE,
+    _comment_reply_request,
+    _reply_fallback,
+    _reply_messages,
+    _send_message_request,
+    fb_webhook_events,
+)
+
+
+# Replies generated at once per process (Groq + Graph calls); the rest wait their turn.
+ASGI_MAX_CONCURRENT_REPLIES = int(os.environ.get("ASGI_MAX_CONCURRENT_REPLIES", "200") or "200")
+ASGI_HTTP_MAX_CONNECTIONS = int(os.environ.get("ASGI_HTTP_MAX_CONNECTIONS", "200") or "200")
+
+# Entry module: building the app here opens the databases (see webhook.create_app).
+flask_app = webhook.create_app()
+
+_HTTP: Optional[httpx.AsyncClient] = None
+_GROQ = None
+_REPLY_SLOTS: Optional[asyncio.Semaphore] = None
+_WSGI = None
+
+
+def _http() -> httpx.AsyncClient:
+    global _HTTP
+    if _HTTP is None or _HTTP.is_closed:
+        _HTTP = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=ASGI_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=ASGI_HTTP_MAX_CONNECTIONS,
+            ),
+        )
+    return _HTTP
+
+
+def _groq():
+    global _GROQ
+    if _GROQ is None and GROQ_API_KEY:
+        from groq import AsyncGroq
+
+        _GROQ = AsyncGroq(api_key=GROQ_API_KEY, http_client=_http())
+    return _GROQ
+
+
+def _reply_slots() -> asyncio.Semaphore:
+    global _REPLY_SLOTS
+    if _REPLY_SLOTS is None:
+        _REPLY_SLOTS = asyncio.Semaphore(max(ASGI_MAX_CONCURRENT_REPLIES, 1))
+    return _REPLY_SLOTS
+
+
+def _wsgi():
+    global _WSGI
+    if _WSGI is None:
+        from asgiref.wsgi import WsgiToAsgi
+
+        _WSGI = WsgiToAsgi(flask_app)
+    return _WSGI
+
+
+async def generate_response(message: str) -> str:
+    """Async twin of ``webhook.generate_response``."""
+    client = _groq()
+    if not client:
+        return _REPLY_UNAVAILABLE
+    try:
+        response = await client.chat.completions.create(
+            model=_REPLY_MODEL,
+            messages=_reply_messages(message),
+            max_tokens=800,
+            temperature=0.7,
+        )
+        return response.choices[0].message.content
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        return _reply_fallback()
+
+
+async def _graph_post(url: str, data: Dict[str, Any]) -> None:
+    response = await _http().post(url, params={"access_token": PAGE_ACCESS_TOKEN}, json=data)
+    response.raise_for_status()
+
+
+async def send_message(recipient_id: str, message_text: str) -> None:
+    """Async twin of ``webhook.send_message``."""
+    if not PAGE_ACCESS_TOKEN:
+        print("Error: PAGE_ACCESS_TOKEN not set")
+        return
+    try:
+        await _graph_post(*_send_message_request(recipient_id, message_text))
+        print(f"✅ Message sent to {recipient_id}")
+    except Exception as e:
+        print(f"❌ Error sending message: {e}")
+
+
+async def reply_to_comment(comment_id: str, message: str) -> None:
+    """Async twin of ``webhook.reply_to_comment``."""
+    if not PAGE_ACCESS_TOKEN:
+        print("Error: PAGE_ACCESS_TOKEN not set")
+        return
+    try:
+        await _graph_post(*_comment_reply_request(comment_id, message))
+        print(f"✅ Comment reply sent to {comment_id}")
+    except Exception as e:
+        print(f"❌ Error replying to comment: {e}")
+
+
+async def _answer(kind: str, target_id: str, text: str) -> None:
+    async with _reply_slots():
+        response = await generate_response(text)
+        if kind == "message":
+            await send_message(target_id, response)
+        elif response:
+            await reply_to_comment(target_id, response)
+        else:
+            print("❌ Failed to generate response for comment")
+
+
+async def handle_webhook(data: Dict[str, Any]) -> None:
+    """Same events as the Flask handler, answered concurrently."""
+    print(f"📨 Received webhook: {data}")
+    await asyncio.gather(*(_answer(*event) for event in fb_webhook_events(data)))
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _respond(send, status: int, body: bytes, content_type: bytes = b"text/html; charset=utf-8") -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _HTTP is not None:
+                await _HTTP.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _serves_fb() -> bool:
+    return "fb" in flask_app.config.get("WEBHOOK_BLUEPRINTS", [])
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+
+    if (
+        scope["type"] == "http"
+        and scope["method"] == "POST"
+        and scope["path"] == "/webhook"
+        and _serves_fb()
+    ):
+        try:
+            data = json.loads(await _read_body(receive) or b"null")
+        except ValueError:
+            data = None
+        # Facebook always posts a JSON object; anything else is not a delivery.
+        if not isinstance(data, dict):
+            await _respond(send, 400, b"Bad Request")
+            return
+        await handle_webhook(data)
+        await _respond(send, 200, b"OK")
+        return
+
+    await _wsgi()(scope, receive, send)
@@ -0,0 +1,10 @@
+"""WSGI entry point: ``gunicorn wsgi:app``.
+
+Builds the Flask app from ``webhook.create_app`` (routes picked by
+``WEBHOOK_BLUEPRINTS``); ``webhook`` itself does nothing on import.
+"""
+
+from webhook import create_app
+
+
+app = create_app()